@@ -16,6 +16,29 @@ def ensure_existence(location, make=True):
     return location
 
 
+def get_subdirs(location, handover=None):
+    """Returns the names of the directories in location.
+
+    If results handed over in memory between analysis stages are provided,
+    keyed by the directories they would be written to, the directories are
+    derived from their keys instead of the contents of location on disk.
+
+    """
+
+    if handover is None:
+        return next(os.walk(location))[1]
+
+    subdirs = []
+    for key in handover:
+        relpath = os.path.relpath(key, location).split(os.sep)
+        if relpath[0] in [os.curdir, os.pardir]:
+            continue
+        if relpath[0] not in subdirs:
+            subdirs.append(relpath[0])
+
+    return subdirs
+
+
 def get_locations(mode="cases"):
     """Gets all required directories related to the specified mode.
 
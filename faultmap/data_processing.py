@@ -4,9 +4,10 @@
 """
 
 import csv
-import gc
+import itertools
 import json
 import logging
+import multiprocessing
 import os
 
 import matplotlib.pyplot as plt
@@ -18,7 +19,7 @@ import tables as tb
 from numba import jit
 from scipy import signal
 
-from faultmap import gaincalc, transentropy, config_setup
+from faultmap import gaincalc, transentropy, config_setup, resultstore
 
 
 @jit
@@ -54,36 +55,132 @@ def getfolders(path):
     return folders
 
 
-# Use jit for loop-jitting
-@jit(forceobj=True)
 def gen_iaaft_surrogates(data, iterations):
-    """Generates iAAFT surrogates
+    """Generates a single iAAFT surrogate of data with shape (1, samples),
+    performing at most the specified number of iterations.
 
     """
-    # Make copy to  prevent rotation of array
-    data_f = data.copy()
-    #    start_time = time.clock()
-    xs = data_f.copy()
-    # sorted amplitude stored
-    xs.sort()
-    # amplitude of fourier transform of orig
-    pwx = np.abs(np.fft.fft(data_f))
 
-    data_f.shape = (-1, 1)
-    # random permutation as starting point
-    xsur = np.random.permutation(data_f)
-    xsur.shape = (1, -1)
+    return gen_iaaft_surrogate_batch(data[0, :], 1, max_iterations=iterations)
 
-    for i in range(iterations):
-        fftsurx = pwx * np.exp(1j * np.angle(np.fft.fft(xsur)))
-        xoutb = np.real(np.fft.ifft(fftsurx))
-        ranks = xoutb.argsort(axis=1)
-        xsur[:, ranks] = xs
 
-    #    end_time = time.clock()
-    #    logging.info("Time to generate surrogates: " + str(end_time - start_time))
+def gen_iaaft_surrogate_batch(
+    data, trials, max_iterations=100, tolerance=1e-3, rng=None
+):
+    """Generates a batch of iAAFT surrogates (Schreiber 2000a) of a single
+    signal.
+
+    All surrogates are refined together using two-dimensional real FFTs and
+    vectorised rank remapping. Each surrogate stops being refined as soon as
+    it converges, i.e. when the rank remapping no longer changes it, or when
+    the relative change in its spectrum error drops below the tolerance.
+
+    Parameters
+    ----------
+        data : one-dimensional numpy.ndarray
+            The signal to generate surrogates for.
+        trials : int
+            Number of surrogates to generate.
+        max_iterations : int, default=100
+            Maximum number of iterations performed for any surrogate.
+        tolerance : float, default=1e-3
+            Relative change in spectrum error below which a surrogate is
+            considered to be converged.
+        rng : numpy.random.Generator, optional
+            Source of the random starting points. The global NumPy random
+            state is used if not provided.
+
+    Returns
+    -------
+        surrogates : numpy.ndarray
+            Array of shape (trials, samples) with one surrogate per row.
+
+    """
+
+    data = np.asarray(data, dtype=float).ravel()
+    samples = len(data)
 
-    return xsur
+    # Sorted amplitudes and Fourier amplitudes of the original signal
+    sorted_data = np.sort(data)
+    amplitudes = np.abs(np.fft.rfft(data))
+
+    # Random permutations as starting points
+    if rng is None:
+        rng = np.random
+    surrogates = data[np.argsort(rng.random((trials, samples)), axis=1)]
+
+    active = np.arange(trials)
+    spectrum_errors = np.full(trials, np.inf)
+
+    for _ in range(max_iterations):
+        if len(active) == 0:
+            break
+
+        # Impose the original Fourier amplitudes while keeping the phases
+        spectra = np.fft.rfft(surrogates[active], axis=1)
+        filtered = np.fft.irfft(
+            amplitudes * np.exp(1j * np.angle(spectra)), n=samples, axis=1
+        )
+
+        # Impose the original amplitude distribution by rank remapping
+        remapped = np.empty_like(filtered)
+        np.put_along_axis(
+            remapped,
+            np.argsort(filtered, axis=1),
+            sorted_data[np.newaxis, :],
+            axis=1,
+        )
+
+        new_errors = np.mean(
+            np.abs(np.abs(np.fft.rfft(remapped, axis=1)) - amplitudes), axis=1
+        )
+
+        unchanged = np.all(remapped == surrogates[active], axis=1)
+        stalled = np.abs(spectrum_errors[active] - new_errors) <= (
+            tolerance * new_errors
+        )
+
+        surrogates[active] = remapped
+        spectrum_errors[active] = new_errors
+        active = active[~(unchanged | stalled)]
+
+    return surrogates
+
+
+def gen_surrogates(data, surr_method, trials, rng=None):
+    """Generates a number of surrogates of a single signal.
+
+    Parameters
+    ----------
+        data : one-dimensional numpy.ndarray
+            The signal to generate surrogates for.
+        surr_method : str
+            Either 'iAAFT' (Schreiber 2000a) or 'random_shuffle'.
+        trials : int
+            Number of surrogates to generate.
+        rng : numpy.random.Generator, optional
+            Source of randomness. The global NumPy random state is used if
+            not provided.
+
+    Returns
+    -------
+        surrogates : numpy.ndarray
+            Array of shape (trials, samples) with one surrogate per row.
+
+    """
+
+    data = np.asarray(data, dtype=float).ravel()
+    if rng is None:
+        rng = np.random
+
+    if surr_method == "iAAFT":
+        surrogates = gen_iaaft_surrogate_batch(data, trials, rng=rng)
+    elif surr_method == "random_shuffle":
+        surrogates = data[np.argsort(rng.random((trials, len(data))), axis=1)]
+    else:
+        raise ValueError("Surrogate method not recognized")
+
+    return surrogates
 
 
 class ResultReconstructionData:
@@ -140,153 +237,229 @@ class ResultReconstructionData:
             logging.info("Defaulting to no bias correction")
 
 
-def process_auxfile(
-    filename, bias_correct=True, mi_scale=False, allow_neg=False
+def process_auxfields(
+    header, fields, bias_correct=True, mi_scale=False, allow_neg=False
 ):
-    """Processes an auxfile and returns a list of affected_vars,
-    weight_array as well as relative significance weight array.
+    """Processes the auxiliary data of a set of variable pairs at once.
 
     Parameters:
-        filename (string): path to auxfile to process
+        header (list): names of the report fields
+        fields (array): report fields of each pair in a row, as text
         allow_neg (bool): if true, allows negative values in final weight arrays, otherwise sets them to zero.
         bias_correct (bool): if true, subtracts the mean of the null distribution off the final value in weight array
 
+    Returns arrays of the weights, weights without significance testing,
+    significance relative weights, delays and significance thresholds of all
+    pairs.
+
     """
 
-    affectedvars = []
-    weights = []
-    nosigtest_weights = []
-    sigweights = []
-    delays = []
-    sigthresholds = []
-    # sigstds = []
+    fields = np.asarray(fields).astype(str).reshape(-1, len(header))
 
-    with open(filename, "r") as auxfile:
-        auxfilereader = csv.reader(auxfile, delimiter=",")
-        for rowindex, row in enumerate(auxfilereader):
-            if rowindex == 0:
-                # Find the indices of important rows
-                affectedvar_index = row.index("affectedvar")
-
-                if "max_ent" in row:
-                    maxval_index = row.index("max_ent")
-                else:
-                    maxval_index = row.index("max_corr")
+    def column(name):
+        return fields[:, header.index(name)]
 
-                if "bias_mean" in row:
-                    biasmean_index = row.index("bias_mean")
-                else:
-                    biasmean_index = None
+    if "max_ent" in header:
+        weight_candidates = column("max_ent").astype(float)
+    else:
+        weight_candidates = column("max_corr").astype(float)
 
-                if "threshold" in row:
-                    thresh_index = row.index("threshold")
-                else:
-                    thresh_index = row.index("threshcorr")
+    if "threshold" in header:
+        thresholds = column("threshold")
+    else:
+        thresholds = column("threshcorr")
+    # Thresholds are not reported if no significance testing was done
+    thresholds = np.where(thresholds == "", "0", thresholds).astype(float)
 
-                if "mi_fwd" in row:  # This should be available by default
-                    mi_index = row.index("mi_fwd")
-                else:
-                    mi_index = None
+    threshpass = column("threshpass")
+    directionpass = column("directionpass")
 
-                threshpass_index = row.index("threshpass")
-                directionpass_index = row.index("directionpass")
-                maxdelay_index = row.index("max_delay")
+    # Test if weight failed threshpass or directionpass test and
+    # write as zero if true
 
-            if rowindex > 0:
+    # In rare cases it might be desired to allow negative values
+    # (e.g. correlation test)
+    # TODO: Put the allow_neg parameter in a configuration file
+    # NOTE: allow_neg also removes significance testing
 
-                affectedvars.append(row[affectedvar_index])
+    if allow_neg:
+        nosigtest_weights = weight_candidates.copy()
+        weights = weight_candidates.copy()
+    else:
+        positive = weight_candidates > 0.0
+        # Attach to no significance test result
+        nosigtest_weights = np.where(positive, weight_candidates, 0.0)
+        # threshpass is either None or True for weights that pass
+        failed = (threshpass == "False") | (directionpass == "False")
+        weights = np.where(positive & ~failed, weight_candidates, 0.0)
+
+    # If both bias correction and mutual information scaling is to be performed,
+    # bias correction should happen first
+
+    # Perform bias correction if required
+    if bias_correct and ("bias_mean" in header):
+        corrected = weights > 0.0
+        weights[corrected] -= column("bias_mean")[corrected].astype(float)
+        if np.any(weights[corrected] < 0):
+            raise ValueError("Negative weight after subtracting biasmean")
+
+    if mi_scale and ("mi_fwd" in header):
+        scaled = weights > 0.0
+        weights[scaled] /= column("mi_fwd")[scaled].astype(float)
+
+    delays = column("max_delay").astype(float)
+
+    # Test if sigtest passed before assigning weight
+    # If the threshold is negative, take the absolute value
+    # TODO: Need to think the implications of this through
+    passed = (
+        (threshpass == "True") & (directionpass == "True") & (thresholds != 0)
+    )
+    sigweights = np.zeros(len(fields))
+    sigweights[passed] = weight_candidates[passed] / abs(thresholds[passed])
+    sigweights[~(sigweights > 0.0)] = 0.0
 
-                # Test if weight failed threshpass or directionpass test and
-                # write as zero if true
+    return weights, nosigtest_weights, sigweights, delays, thresholds
 
-                # In rare cases it might be desired to allow negative values
-                # (e.g. correlation test)
-                # TODO: Put the allow_neg parameter in a configuration file
-                # NOTE: allow_neg also removes significance testing
 
-                weight_candidate = float(row[maxval_index])
+def process_auxdata(
+    auxrows, bias_correct=True, mi_scale=False, allow_neg=False
+):
+    """Processes auxiliary data and returns a list of affected_vars,
+    weight_array as well as relative significance weight array.
 
-                if allow_neg:
-                    nosigtest_weight = weight_candidate
-                    sigtest_weight = weight_candidate
-                else:
-                    if weight_candidate > 0.0:
-                        # Attach to no significance test result
-                        nosigtest_weight = weight_candidate
-                        if (
-                            row[threshpass_index] == "False"
-                            or row[directionpass_index] == "False"
-                        ):
-                            sigtest_weight = 0.0
-                        else:
-                            # threshpass is either None or True
-                            sigtest_weight = weight_candidate
-                    else:
-                        sigtest_weight = 0.0
-                        nosigtest_weight = 0.0
-
-                # If both bias correction and mutual information scaling is to be performed,
-                # bias correction should happen first
-
-                # Perform bias correction if required
-                if bias_correct and biasmean_index and (sigtest_weight > 0.0):
-                    sigtest_weight = sigtest_weight - float(
-                        row[biasmean_index]
-                    )
-                    if sigtest_weight < 0:
-                        raise ValueError(
-                            "Negative weight after subtracting biasmean"
-                        )
+    Parameters:
+        auxrows (iterable): rows of auxiliary data, with the header first
+        allow_neg (bool): if true, allows negative values in final weight arrays, otherwise sets them to zero.
+        bias_correct (bool): if true, subtracts the mean of the null distribution off the final value in weight array
 
-                if (mi_scale and mi_index) and (sigtest_weight > 0.0):
-                    sigtest_weight = sigtest_weight / float(row[mi_index])
-
-                weights.append(sigtest_weight)
-                nosigtest_weights.append(nosigtest_weight)
-                delays.append(float(row[maxdelay_index]))
-
-                try:
-                    threshold = float(row[thresh_index])
-                except:
-                    threshold = 0.0
-                sigthresholds.append(threshold)
-
-                # Test if sigtest passed before assigning weight
-                if (
-                    row[threshpass_index] == "True"
-                    and row[directionpass_index] == "True"
-                ):
-                    # If the threshold is negative, take the absolute value
-                    # TODO: Need to think the implications of this through
-                    if threshold != 0:
-                        sigweight = float(row[maxval_index]) / abs(threshold)
-                        if sigweight > 0.0:
-                            sigweights.append(sigweight)
-                        else:
-                            sigweights.append(0.0)
-                    else:
-                        sigweights.append(0.0)
+    """
 
-                else:
-                    sigweights.append(0.0)
+    auxrows = list(auxrows)
+    header = auxrows[0]
 
-    return (
-        affectedvars,
+    affectedvar_index = header.index("affectedvar")
+    affectedvars = [row[affectedvar_index] for row in auxrows[1:]]
+
+    (
         weights,
         nosigtest_weights,
         sigweights,
         delays,
         sigthresholds,
+    ) = process_auxfields(
+        header,
+        auxrows[1:],
+        bias_correct=bias_correct,
+        mi_scale=mi_scale,
+        allow_neg=allow_neg,
+    )
+
+    return (
+        affectedvars,
+        weights.tolist(),
+        nosigtest_weights.tolist(),
+        sigweights.tolist(),
+        delays.tolist(),
+        sigthresholds.tolist(),
     )
 
 
-def create_arrays(datadir, variables, bias_correct, mi_scale, generate_diffs):
+def process_auxfile(
+    filename, bias_correct=True, mi_scale=False, allow_neg=False
+):
+    """Processes an auxfile and returns a list of affected_vars,
+    weight_array as well as relative significance weight array.
+
+    See process_auxdata for the parameters.
+
     """
-    datadir is the location of the auxdata and weights folders for the
+
+    with open(filename, "r") as auxfile:
+        return process_auxdata(
+            csv.reader(auxfile, delimiter=","),
+            bias_correct=bias_correct,
+            mi_scale=mi_scale,
+            allow_neg=allow_neg,
+        )
+
+
+def create_arrays(
+    datadir,
+    variables,
+    bias_correct,
+    mi_scale,
+    generate_diffs,
+    writeoutput=True,
+    stores=None,
+):
+    """
+    datadir is the location of the result store for the
     specific case that is under investigation
 
     variables is the list of variables
 
+    The arrays are written to the result store, and also to CSV files if
+    writeoutput is True.
+
+    stores are the result stores handed over in memory, if any
+
+    """
+
+    if not resultstore.has_store(datadir, stores):
+        return None
+
+    store = resultstore.read_store(datadir, "a", stores)
+
+    # Arrays without significance testing are written to the result store of
+    # the nosigtest counterpart of sigtested data
+    nosigtest_store = None
+    dirparts = getfolders(datadir)
+    if "sigtested" in dirparts:
+        dirparts[dirparts.index("sigtested")] = "nosigtest"
+        nosigtest_store = resultstore.open_store(
+            os.path.join(*dirparts),
+            resultstore.get_variables(store),
+            store.root._v_attrs.boxnum,
+            stores=stores,
+        )
+
+    try:
+        create_store_arrays(
+            store,
+            nosigtest_store,
+            datadir,
+            variables,
+            bias_correct,
+            mi_scale,
+            generate_diffs,
+            writeoutput,
+        )
+    finally:
+        resultstore.close_store(store, stores)
+        if nosigtest_store is not None:
+            resultstore.close_store(nosigtest_store, stores)
+
+    return None
+
+
+def create_store_arrays(
+    store,
+    nosigtest_store,
+    datadir,
+    variables,
+    bias_correct,
+    mi_scale,
+    generate_diffs,
+    writeoutput,
+):
+    """Creates the arrays of all weight types from the auxiliary data in the
+    result store of datadir.
+
+    The weight, significance and delay arrays of each box, the arrays without
+    significance testing and the differences between boxes are all derived in
+    a single pass over the boxes and written once.
+
     """
 
     absoluteweightarray_name = "weight_absolute_arrays"
@@ -305,13 +478,25 @@ def create_arrays(datadir, variables, bias_correct, mi_scale, generate_diffs):
     directionalsigthresholdarray_name = "sigthreshold_directional_arrays"
     neutralsigthresholdarray_name = "sigthreshold_arrays"
 
-    directories = next(os.walk(datadir))[1]
-
     test_strings = ["auxdata_absolute", "auxdata_directional", "auxdata"]
 
+    # Arrays without significance testing are written next to the sigtested
+    # arrays in the nosigtest counterpart of datadir
+    nosigtest_savedir = None
+    if nosigtest_store is not None:
+        dirparts = getfolders(datadir)
+        dirparts[dirparts.index("sigtested")] = "nosigtest"
+        nosigtest_savedir = os.path.join(*dirparts)
+
+    # Location of each variable of the result store in the arrays
+    varindexes = {variable: index for index, variable in enumerate(variables)}
+    varlocs = np.array(
+        [varindexes[variable] for variable in resultstore.get_variables(store)]
+    )
+
     for test_string in test_strings:
 
-        if test_string in directories:
+        if test_string in store.root:
 
             if test_string == "auxdata_absolute":
                 weightarray_name = absoluteweightarray_name
@@ -332,325 +517,160 @@ def create_arrays(datadir, variables, bias_correct, mi_scale, generate_diffs):
                 delayarray_name = neutraldelayarray_name
                 sigthresholdarray_name = neutralsigthresholdarray_name
 
-            boxes = next(os.walk(os.path.join(datadir, test_string)))[1]
-            for box in boxes:
-                boxdir = os.path.join(datadir, test_string, box)
-                # Get list of causevars
-                causevar_filenames = next(os.walk(boxdir))[2]
-                causevars = []
-                affectedvar_array = []
-                weight_array = []
-                nosigtest_weight_array = []
-                sigweight_array = []
-                delay_array = []
-                sigthreshold_array = []
-                for causevar_file in causevar_filenames:
-                    causevars.append(str(causevar_file[:-4]))
-
-                    # Open auxfile and return weight array as well as
-                    # significance relative weight arrays
-
-                    # TODO: Confirm whether correlation test absolutes correlations before sending to auxfile
-                    # Otherwise, the allow null must be used much more wisely
-                    (
-                        affectedvars,
-                        weights,
-                        nosigtest_weights,
-                        sigweights,
-                        delays,
-                        sigthresholds,
-                    ) = process_auxfile(
-                        os.path.join(boxdir, causevar_file),
-                        bias_correct=bias_correct,
-                        mi_scale=mi_scale,
-                    )
+            # Arrays of the previous box are kept for the differences
+            base_weights_matrix = None
+            base_nosigtest_weights_matrix = None
 
-                    affectedvar_array.append(affectedvars)
-                    weight_array.append(weights)
-                    nosigtest_weight_array.append(nosigtest_weights)
-                    sigweight_array.append(sigweights)
-                    delay_array.append(delays)
-                    sigthreshold_array.append(sigthresholds)
-
-                # Write the arrays to file
-                # Create a base array based on the full set of variables
-                # found in the typical weightcalcdata function
-
-                # Initialize matrix with variables written
-                # in first row and column
-                weights_matrix = np.zeros(
-                    (len(variables) + 1, len(variables) + 1)
-                ).astype(object)
+            for boxindex in resultstore.get_boxindexes(store):
+                box = "box{:03d}".format(boxindex + 1)
 
-                weights_matrix[0, 0] = ""
-                weights_matrix[0, 1:] = variables
-                weights_matrix[1:, 0] = variables
-
-                nosigtest_weights_matrix = np.copy(weights_matrix)
-                sigweights_matrix = np.copy(weights_matrix)
-                delay_matrix = np.copy(weights_matrix)
-                sigthresh_matrix = np.copy(weights_matrix)
-
-                # Write results to appropriate entries in array
-                for causevar_index, causevar in enumerate(causevars):
-                    causevarloc = variables.index(causevar)
-                    for affectedvar_index, affectedvar in enumerate(
-                        affectedvar_array[causevar_index]
-                    ):
-                        affectedvarloc = variables.index(affectedvar)
-
-                        weights_matrix[
-                            affectedvarloc + 1, causevarloc + 1
-                        ] = weight_array[causevar_index][affectedvar_index]
-                        nosigtest_weights_matrix[
-                            affectedvarloc + 1, causevarloc + 1
-                        ] = nosigtest_weight_array[causevar_index][
-                            affectedvar_index
-                        ]
-                        sigweights_matrix[
-                            affectedvarloc + 1, causevarloc + 1
-                        ] = sigweight_array[causevar_index][affectedvar_index]
-                        delay_matrix[
-                            affectedvarloc + 1, causevarloc + 1
-                        ] = delay_array[causevar_index][affectedvar_index]
-                        sigthresh_matrix[
-                            affectedvarloc + 1, causevarloc + 1
-                        ] = sigthreshold_array[causevar_index][
-                            affectedvar_index
-                        ]
-
-                # Write to CSV files
-                weightarray_dir = os.path.join(datadir, weightarray_name, box)
-                config_setup.ensure_existence(weightarray_dir)
-                weightfilename = os.path.join(
-                    weightarray_dir, "weight_array.csv"
+                # Process auxdata of all pairs of the box at once and return
+                # weight arrays as well as significance relative weight
+                # arrays
+
+                # TODO: Confirm whether correlation test absolutes correlations before sending to auxfile
+                # Otherwise, the allow null must be used much more wisely
+                header, fields = resultstore.read_auxfields(
+                    store, test_string, boxindex
                 )
-                np.savetxt(
-                    weightfilename, weights_matrix, delimiter=",", fmt="%s"
+                causevarindexes, affectedvarindexes = np.nonzero(
+                    np.any(fields != b"", axis=2)
                 )
-
-                delayarray_dir = os.path.join(datadir, delayarray_name, box)
-                config_setup.ensure_existence(delayarray_dir)
-                delayfilename = os.path.join(delayarray_dir, "delay_array.csv")
-                np.savetxt(
-                    delayfilename, delay_matrix, delimiter=",", fmt="%s"
+                results = process_auxfields(
+                    header,
+                    fields[causevarindexes, affectedvarindexes],
+                    bias_correct=bias_correct,
+                    mi_scale=mi_scale,
                 )
 
-                dirparts = getfolders(datadir)
-                if "sigtested" in dirparts:
-
-                    dirparts[dirparts.index("sigtested")] = "nosigtest"
-                    nosigtest_savedir = dirparts[0]
-                    for pathpart in dirparts[1:]:
-                        nosigtest_savedir = os.path.join(
-                            nosigtest_savedir, pathpart
+                # Write results to appropriate entries in arrays, with
+                # affectedvars in rows and causevars in columns
+                matrices = np.zeros(
+                    (len(results), len(variables), len(variables))
+                )
+                matrices[
+                    :, varlocs[affectedvarindexes], varlocs[causevarindexes]
+                ] = results
+                (
+                    weights_matrix,
+                    nosigtest_weights_matrix,
+                    sigweights_matrix,
+                    delay_matrix,
+                    sigthresh_matrix,
+                ) = matrices
+
+                boxarrays = [
+                    (weightarray_name, "weight_array", weights_matrix),
+                    (delayarray_name, "delay_array", delay_matrix),
+                ]
+                nosigtest_boxarrays = []
+
+                if nosigtest_store is not None:
+                    boxarrays += [
+                        (
+                            sigweightarray_name,
+                            "sigweight_array",
+                            sigweights_matrix,
+                        ),
+                        (
+                            sigthresholdarray_name,
+                            "sigthreshold_array",
+                            sigthresh_matrix,
+                        ),
+                    ]
+                    nosigtest_boxarrays += [
+                        (
+                            weightarray_name,
+                            "weight_array",
+                            nosigtest_weights_matrix,
+                        ),
+                        (delayarray_name, "delay_array", delay_matrix),
+                    ]
+
+                if generate_diffs:
+                    # Differences are taken relative to the previous box
+                    # TODO: Investigate effect of taking absolute of differences
+                    boxarrays.append(
+                        (
+                            difweightarray_name,
+                            "dif_weight_array",
+                            box_difference(
+                                base_weights_matrix, weights_matrix
+                            ),
                         )
-
-                    nosigtest_weightarray_dir = os.path.join(
-                        nosigtest_savedir, weightarray_name, box
-                    )
-                    config_setup.ensure_existence(nosigtest_weightarray_dir)
-
-                    nosigtest_delayarray_dir = os.path.join(
-                        nosigtest_savedir, delayarray_name, box
-                    )
-                    config_setup.ensure_existence(nosigtest_delayarray_dir)
-
-                    delayfilename = os.path.join(
-                        nosigtest_delayarray_dir, "delay_array.csv"
                     )
-                    np.savetxt(
-                        delayfilename, delay_matrix, delimiter=",", fmt="%s"
-                    )
-
-                    weightfilename = os.path.join(
-                        nosigtest_weightarray_dir, "weight_array.csv"
-                    )
-                    np.savetxt(
-                        weightfilename,
-                        nosigtest_weights_matrix,
-                        delimiter=",",
-                        fmt="%s",
-                    )
-
-                    sigweightarray_dir = os.path.join(
-                        datadir, sigweightarray_name, box
-                    )
-                    config_setup.ensure_existence(sigweightarray_dir)
-                    sigweightfilename = os.path.join(
-                        sigweightarray_dir, "sigweight_array.csv"
-                    )
-                    np.savetxt(
-                        sigweightfilename,
-                        sigweights_matrix,
-                        delimiter=",",
-                        fmt="%s",
-                    )
-
-                    sigthresholdarray_dir = os.path.join(
-                        datadir, sigthresholdarray_name, box
-                    )
-                    config_setup.ensure_existence(sigthresholdarray_dir)
-                    sigthresholdfilename = os.path.join(
-                        sigthresholdarray_dir, "sigthreshold_array.csv"
-                    )
-                    np.savetxt(
-                        sigthresholdfilename,
-                        sigthresh_matrix,
-                        delimiter=",",
-                        fmt="%s",
-                    )
-
-            if generate_diffs:
-                boxes = list(boxes)
-                boxes.sort()
-
-                for boxindex, box in enumerate(boxes):
-
-                    difweights_matrix = np.zeros(
-                        (len(variables) + 1, len(variables) + 1)
-                    ).astype(object)
-
-                    difweights_matrix[0, 0] = ""
-                    difweights_matrix[0, 1:] = variables
-                    difweights_matrix[1:, 0] = variables
+                    if nosigtest_store is not None:
+                        nosigtest_boxarrays.append(
+                            (
+                                difweightarray_name,
+                                "dif_weight_array",
+                                box_difference(
+                                    base_nosigtest_weights_matrix,
+                                    nosigtest_weights_matrix,
+                                ),
+                            )
+                        )
 
-                    if boxindex > 0:
+                base_weights_matrix = weights_matrix
+                base_nosigtest_weights_matrix = nosigtest_weights_matrix
 
-                        base_weight_array_dir = os.path.join(
-                            datadir, weightarray_name, boxes[boxindex - 1]
-                        )  # Already one behind
-                        base_weight_array_filename = os.path.join(
-                            base_weight_array_dir, "weight_array.csv"
-                        )
-                        final_weight_array_dir = os.path.join(
-                            datadir, weightarray_name, box
+                for arraystore, arraydir, arrays in [
+                    (store, datadir, boxarrays),
+                    (nosigtest_store, nosigtest_savedir, nosigtest_boxarrays),
+                ]:
+                    for arrayname, filename, matrix in arrays:
+                        resultstore.write_array(
+                            arraystore, arrayname, boxindex, matrix
                         )
-                        final_weight_array_filename = os.path.join(
-                            final_weight_array_dir, "weight_array.csv"
-                        )
-
-                        with open(base_weight_array_filename, "r") as f:
-                            num_cols = len(f.readline().split(","))
-                            f.seek(0)
-                            base_weight_matrix = np.genfromtxt(
-                                f,
-                                usecols=range(1, num_cols),
-                                skip_header=1,
-                                delimiter=",",
+                        # Write to CSV files
+                        if writeoutput:
+                            writecsv_array(
+                                arraydir,
+                                arrayname,
+                                box,
+                                filename + ".csv",
+                                matrix,
+                                variables,
                             )
-                            f.close()
-
-                        with open(final_weight_array_filename, "r") as f:
-                            num_cols = len(f.readline().split(","))
-                            f.seek(0)
-                            final_weight_matrix = np.genfromtxt(
-                                f,
-                                usecols=range(1, num_cols),
-                                skip_header=1,
-                                delimiter=",",
-                            )
-                            f.close()
 
-                        # Calculate difference and save to file
-                        # TODO: Investigate effect of taking absolute of differences
-                        difweights_matrix[1:, 1:] = abs(
-                            final_weight_matrix
-                        ) - abs(base_weight_matrix)
+    return None
 
-                    difweightarray_dir = os.path.join(
-                        datadir, difweightarray_name, box
-                    )
-                    config_setup.ensure_existence(difweightarray_dir)
-                    difweightfilename = os.path.join(
-                        difweightarray_dir, "dif_weight_array.csv"
-                    )
-                    np.savetxt(
-                        difweightfilename,
-                        difweights_matrix,
-                        delimiter=",",
-                        fmt="%s",
-                    )
 
-                    if "sigtested" in getfolders(datadir):
+def box_difference(base_matrix, final_matrix):
+    """Returns the difference in absolute values between the arrays of a box
+    and the box before it, or zeros for the first box.
 
-                        nosigtest_difweights_matrix = np.zeros(
-                            (len(variables) + 1, len(variables) + 1)
-                        ).astype(object)
+    """
 
-                        nosigtest_difweights_matrix[0, 0] = ""
-                        nosigtest_difweights_matrix[0, 1:] = variables
-                        nosigtest_difweights_matrix[1:, 0] = variables
+    if base_matrix is None:
+        return np.zeros_like(final_matrix)
 
-                        if boxindex > 0:
+    return abs(final_matrix) - abs(base_matrix)
 
-                            nosigtest_base_weight_array_dir = os.path.join(
-                                nosigtest_savedir,
-                                weightarray_name,
-                                boxes[boxindex - 1],
-                            )
-                            nosigtest_base_weight_array_filename = os.path.join(
-                                nosigtest_base_weight_array_dir,
-                                "weight_array.csv",
-                            )
-                            nosigtest_final_weight_array_dir = os.path.join(
-                                nosigtest_savedir, weightarray_name, box
-                            )
-                            nosigtest_final_weight_array_filename = os.path.join(
-                                nosigtest_final_weight_array_dir,
-                                "weight_array.csv",
-                            )
 
-                            with open(
-                                nosigtest_base_weight_array_filename, "r"
-                            ) as f:
-                                num_cols = len(f.readline().split(","))
-                                f.seek(0)
-                                nosigtest_base_weight_matrix = np.genfromtxt(
-                                    f,
-                                    usecols=range(1, num_cols),
-                                    skip_header=1,
-                                    delimiter=",",
-                                )
-                                f.close()
-
-                            with open(
-                                nosigtest_final_weight_array_filename, "r"
-                            ) as f:
-                                num_cols = len(f.readline().split(","))
-                                f.seek(0)
-                                nosigtest_final_weight_matrix = np.genfromtxt(
-                                    f,
-                                    usecols=range(1, num_cols),
-                                    skip_header=1,
-                                    delimiter=",",
-                                )
-                                f.close()
-
-                            # Calculate difference and save to file
-                            # TODO: Investigate effect of taking absolute of differences
-                            nosigtest_difweights_matrix[1:, 1:] = abs(
-                                nosigtest_final_weight_matrix
-                            ) - abs(nosigtest_base_weight_matrix)
-
-                        nosigtest_difweightarray_dir = os.path.join(
-                            nosigtest_savedir, difweightarray_name, box
-                        )
-                        config_setup.ensure_existence(
-                            nosigtest_difweightarray_dir
-                        )
-                        nosigtest_difweightfilename = os.path.join(
-                            nosigtest_difweightarray_dir,
-                            "dif_weight_array.csv",
-                        )
-                        np.savetxt(
-                            nosigtest_difweightfilename,
-                            nosigtest_difweights_matrix,
-                            delimiter=",",
-                            fmt="%s",
-                        )
+def writecsv_array(datadir, arrayname, box, filename, matrix, variables):
+    """Writes an array of a box to CSV file, with the variable names added in
+    the first row and column.
 
-    return None
+    """
+
+    labelled_matrix = np.empty(
+        (len(variables) + 1, len(variables) + 1), dtype=object
+    )
+    labelled_matrix[0, 0] = ""
+    labelled_matrix[0, 1:] = variables
+    labelled_matrix[1:, 0] = variables
+    labelled_matrix[1:, 1:] = matrix
+
+    arraydir = config_setup.ensure_existence(
+        os.path.join(datadir, arrayname, box)
+    )
+    np.savetxt(
+        os.path.join(arraydir, filename),
+        labelled_matrix,
+        delimiter=",",
+        fmt="%s",
+    )
 
 
 def create_signtested_directionalarrays(datadir, writeoutput):
@@ -782,10 +802,12 @@ def create_signtested_directionalarrays(datadir, writeoutput):
     return None
 
 
-def extract_trends(datadir, writeoutput):
+def extract_trends(datadir, writeoutput, stores=None):
     """
-    datadir is the location of the weight_array and delay_array folders for the
-    specific case that is under investigation
+    datadir is the location of the result store with the weight and delay
+    arrays for the specific case that is under investigation
+
+    stores are the result stores handed over in memory, if any
 
     tsfilename is the file name of the original time series data file
     used to generate each case and is only used for generating a list of
@@ -811,90 +833,54 @@ def extract_trends(datadir, writeoutput):
         "sigthreshold_arrays": "sigthreshold_trend",
     }
 
-    boxfilenames = {
-        "weight_absolute_arrays": "weight_array",
-        "weight_directional_arrays": "weight_array",
-        "signtested_weight_directional_arrays": "weight_array",
-        "weight_arrays": "weight_array",
-        "sigweight_absolute_arrays": "sigweight_array",
-        "sigweight_directional_arrays": "sigweight_array",
-        "signtested_sigweight_directional_arrays": "sigweight_array",
-        "sigweight_arrays": "sigweight_array",
-        "delay_absolute_arrays": "delay_array",
-        "delay_directional_arrays": "delay_array",
-        "delay_arrays": "delay_array",
-        "sigthreshold_absolute_arrays": "sigthreshold_array",
-        "sigthreshold_directional_arrays": "sigthreshold_array",
-        "sigthreshold_arrays": "sigthreshold_array",
-    }
-
-    directories = next(os.walk(datadir))[1]
+    if not resultstore.has_store(datadir, stores):
+        return None
 
     test_strings = namesdict.keys()
 
     savedir = change_dirtype(datadir, "weightdata", "trends")
 
-    for test_string in test_strings:
+    store = resultstore.read_store(datadir, stores=stores)
+    try:
+        # Causevars and affectedvars both follow the variables of the store
+        variables = resultstore.get_variables(store)
+        boxindexes = resultstore.get_boxindexes(store)
 
-        if test_string in directories:
-
-            trendname = namesdict[test_string]
+        for test_string in test_strings:
 
-            arraydataframes = []
+            # Trends are only written to CSV files
+            if writeoutput and resultstore.has_array(store, test_string):
 
-            boxes = next(os.walk(os.path.join(datadir, test_string)))[1]
-            for box in boxes:
-                boxdir = os.path.join(datadir, test_string, box)
+                trendname = namesdict[test_string]
 
-                # Read the contents of the test_string array
-                arraydf = pd.read_csv(
-                    os.path.join(boxdir, boxfilenames[test_string] + ".csv")
+                # Arrays of all boxes with affectedvars in rows and causevars
+                # in columns, stacked along the first axis
+                arrays = resultstore.read_arrays(
+                    store, test_string, boxindexes
                 )
 
-                arraydataframes.append(arraydf)
-
-            # Causevars is the first line of the array being read
-            # Affectedvars is the first column of the array being read
-
-            arraydf = arraydataframes[0]
-
-            causevars = [
-                arraydf.columns[1:][i]
-                for i in range(0, len(arraydf.columns[1:]))
-            ]
-            affectedvars = [
-                arraydf[arraydf.columns[0]][i]
-                for i in range(0, len(arraydf[arraydf.columns[0]]))
-            ]
-
-            for causevar in causevars:
-                # Create array with trends for specific causevar
-                trend_array = np.zeros(
-                    (len(affectedvars), len(boxes) + 1), dtype=object
-                )
-                # Initialize array with affectedvar labels in first row
-                trend_array[:, 0] = affectedvars
-
-                for affectedvarindex in range(len(affectedvars)):
-                    trendvalues = []
-                    for arraydf in arraydataframes:
-                        trendvalues.append(arraydf[causevar][affectedvarindex])
-                    trend_array[affectedvarindex:, 1:] = trendvalues
-
-                # Write to CSV file
-                if writeoutput:
+                # Write to CSV file, where the trends of a causevar have a row for every box and
+                # a column for every affectedvar
+                for causevarindex, causevar in enumerate(variables):
                     trend_dir = os.path.join(savedir, causevar)
                     config_setup.ensure_existence(trend_dir)
 
                     trendfilename = os.path.join(trend_dir, trendname + ".csv")
                     np.savetxt(
-                        trendfilename, trend_array.T, delimiter=",", fmt="%s"
+                        trendfilename,
+                        arrays[:, :, causevarindex],
+                        delimiter=",",
+                        fmt="%s",
+                        header=",".join(variables),
+                        comments="",
                     )
+    finally:
+        resultstore.close_store(store, stores)
 
     return None
 
 
-def result_reconstruction(mode, case, writeoutput):
+def result_reconstruction(mode, case, writeoutput, stores=None):
     """Reconstructs the weight_array and delay_array for different weight types
     from data generated by run_weightcalc process.
 
@@ -903,6 +889,8 @@ def result_reconstruction(mode, case, writeoutput):
 
     The results are written to the same folders where the files are found.
 
+    If the result stores of the weight calculation are handed over in memory
+    in stores, the arrays are added to these stores instead.
 
     """
 
@@ -922,7 +910,7 @@ def result_reconstruction(mode, case, writeoutput):
     scenariosdir = os.path.join(saveloc, "weightdata", case)
 
     # Get list of all scenarios
-    scenarios = next(os.walk(scenariosdir))[1]
+    scenarios = config_setup.get_subdirs(scenariosdir, stores)
 
     for scenario in scenarios:
         print(scenario)
@@ -934,15 +922,15 @@ def result_reconstruction(mode, case, writeoutput):
         )
 
         methodsdir = os.path.join(scenariosdir, scenario)
-        methods = next(os.walk(methodsdir))[1]
+        methods = config_setup.get_subdirs(methodsdir, stores)
         for method in methods:
             print(method)
             sigtypesdir = os.path.join(methodsdir, method)
-            sigtypes = next(os.walk(sigtypesdir))[1]
+            sigtypes = config_setup.get_subdirs(sigtypesdir, stores)
             for sigtype in sigtypes:
                 print(sigtype)
                 embedtypesdir = os.path.join(sigtypesdir, sigtype)
-                embedtypes = next(os.walk(embedtypesdir))[1]
+                embedtypes = config_setup.get_subdirs(embedtypesdir, stores)
                 for embedtype in embedtypes:
                     print(embedtype)
                     datadir = os.path.join(embedtypesdir, embedtype)
@@ -952,6 +940,8 @@ def result_reconstruction(mode, case, writeoutput):
                         resultreconstructiondata.bias_correction,
                         resultreconstructiondata.mi_scale,
                         weightcalcdata.generate_diffs,
+                        writeoutput,
+                        stores,
                     )
                     # Provide directional array version tested with absolute
                     # weight sign
@@ -960,13 +950,55 @@ def result_reconstruction(mode, case, writeoutput):
     return None
 
 
-def trend_extraction(mode, case, writeoutput):
+def trend_extraction(mode, case, writeoutput, stores=None):
     """Extracts dynamic trend of weights and delays out of weight_array
     and delay_array results between multiple boxes generated by the
     run_createarrays process for transient cases.
 
     The results are written to the trends results directory.
 
+    The arrays are read from the result stores handed over in memory in
+    stores, if provided.
+
+    """
+
+    saveloc, _, _, _ = config_setup.runsetup(mode, case)
+
+    # Directory where subdirectories for scenarios will be stored
+    scenariosdir = os.path.join(saveloc, "weightdata", case)
+
+    # Get list of all scenarios
+    scenarios = config_setup.get_subdirs(scenariosdir, stores)
+
+    for scenario in scenarios:
+        print(scenario)
+
+        methodsdir = os.path.join(scenariosdir, scenario)
+        methods = config_setup.get_subdirs(methodsdir, stores)
+        for method in methods:
+            print(method)
+            sigtypesdir = os.path.join(methodsdir, method)
+            sigtypes = config_setup.get_subdirs(sigtypesdir, stores)
+            for sigtype in sigtypes:
+                print(sigtype)
+                embedtypesdir = os.path.join(sigtypesdir, sigtype)
+                embedtypes = config_setup.get_subdirs(embedtypesdir, stores)
+                for embedtype in embedtypes:
+                    print(embedtype)
+                    datadir = os.path.join(embedtypesdir, embedtype)
+                    extract_trends(datadir, writeoutput, stores)
+
+    return None
+
+
+def csv_export(mode, case):
+    """Exports the weight and auxiliary data in the result stores of all
+    scenarios, methods and significance and embedding types of a case to
+    CSV files.
+
+    The files are written to the same folders as the result stores, with a
+    file for each data type, box and causevar.
+
     """
 
     saveloc, _, _, _ = config_setup.runsetup(mode, case)
@@ -993,7 +1025,8 @@ def trend_extraction(mode, case, writeoutput):
                 for embedtype in embedtypes:
                     print(embedtype)
                     datadir = os.path.join(embedtypesdir, embedtype)
-                    extract_trends(datadir, writeoutput)
+                    if resultstore.has_store(datadir):
+                        resultstore.export_csv(datadir)
 
     return None
 
@@ -1023,6 +1056,182 @@ def csv_to_h5(saveloc, raw_tsdata, scenario, case, overwrite=True):
     return datapath
 
 
+def count_samples(raw_tsdata):
+    """Counts the samples in a time series data file, excluding the header
+    and empty lines.
+
+    """
+    with open(raw_tsdata, "rb") as f:
+        return sum(1 for line in f if line.strip()) - 1
+
+
+def convert_partition(
+    raw_tsdata, datafile, timestampfile, firstrow, samples, chunkrows
+):
+    """Converts a time series data file in chunks of rows into the rows of
+    the binary files of ingest_tsdata following firstrow.
+
+    """
+    inputdata = np.load(datafile, mmap_mode="r+")
+    timestamps = np.load(timestampfile, mmap_mode="r+")
+    variables = list(pd.read_csv(raw_tsdata, nrows=0).keys())
+    variables.remove("Time")
+
+    row = firstrow
+    for chunk in pd.read_csv(raw_tsdata, chunksize=chunkrows):
+        timestamps[row : row + len(chunk)] = np.asarray(
+            pd.to_datetime(chunk["Time"], unit="s"), dtype="datetime64[s]"
+        ).view(np.int64)
+        inputdata[row : row + len(chunk)] = chunk[variables]
+        row += len(chunk)
+    if row - firstrow != samples:
+        raise ValueError(
+            "Unexpected number of samples in {}".format(raw_tsdata)
+        )
+
+    inputdata.flush()
+    timestamps.flush()
+
+    return variables
+
+
+def ingest_tsdata(raw_tsdata, datadir, chunkrows=100000, processes=1):
+    """Reads time series data in the standard CSV format from binary files
+    in datadir, converting the CSV files to these files first if they do not
+    exist or were converted from earlier versions of the CSV files.
+
+    The data can be partitioned over several CSV files with the same
+    variables, which are converted in parallel and joined in the given
+    order. The values are stored with the samples of every variable
+    contiguous, and are memory-mapped, so that only the parts used are read
+    from disk.
+
+    Parameters
+    ----------
+        raw_tsdata : path or list of paths
+            Time series data files with the times in seconds in the first
+            column, labelled "Time".
+        datadir : path
+            Directory in which the binary files are stored.
+        chunkrows : int
+            Number of rows of a CSV file converted at once.
+        processes : int
+            Number of CSV files converted in parallel.
+
+    Returns
+    -------
+        variables : list
+            Names of the variables.
+        timestamps : numpy.ndarray
+            The times in whole seconds.
+        inputdata : numpy.memmap
+            Read-only array of floats with a variable in every column.
+
+    """
+    if isinstance(raw_tsdata, str):
+        raw_tsdata = [raw_tsdata]
+
+    datadir = config_setup.ensure_existence(datadir, make=True)
+    infofile = os.path.join(datadir, "source.json")
+    datafile = os.path.join(datadir, "data.npy")
+    timestampfile = os.path.join(datadir, "timestamps.npy")
+
+    sources = []
+    for partition in raw_tsdata:
+        sourcestat = os.stat(partition)
+        sources.append(
+            {
+                "file": os.path.abspath(partition),
+                "size": sourcestat.st_size,
+                "mtime_ns": sourcestat.st_mtime_ns,
+            }
+        )
+
+    try:
+        with open(infofile) as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        info = None
+
+    if info is None or info["source"] != sources:
+        logging.info("Converting {} to binary format".format(raw_tsdata))
+
+        variables = list(pd.read_csv(raw_tsdata[0], nrows=0).keys())
+        variables.remove("Time")
+
+        if processes > 1 and len(raw_tsdata) > 1:
+            pool = multiprocessing.Pool(min(processes, len(raw_tsdata)))
+            starmap = pool.starmap
+        else:
+            pool = None
+            starmap = itertools.starmap
+
+        try:
+            # Count the samples first, so that every partition can be
+            # written to its own rows
+            if pool is not None:
+                samples = pool.map(count_samples, raw_tsdata)
+            else:
+                samples = list(map(count_samples, raw_tsdata))
+            firstrows = np.cumsum([0] + samples[:-1])
+
+            np.lib.format.open_memmap(
+                datafile + ".tmp.npy",
+                mode="w+",
+                dtype=np.float64,
+                shape=(sum(samples), len(variables)),
+                fortran_order=True,
+            )
+            np.lib.format.open_memmap(
+                timestampfile + ".tmp.npy",
+                mode="w+",
+                dtype=np.int64,
+                shape=(sum(samples),),
+            )
+
+            partition_variables = starmap(
+                convert_partition,
+                [
+                    (
+                        partition,
+                        datafile + ".tmp.npy",
+                        timestampfile + ".tmp.npy",
+                        firstrow,
+                        partition_samples,
+                        chunkrows,
+                    )
+                    for partition, firstrow, partition_samples in zip(
+                        raw_tsdata, firstrows, samples
+                    )
+                ],
+            )
+            for partition, converted in zip(raw_tsdata, partition_variables):
+                if converted != variables:
+                    raise ValueError(
+                        "Variables of {} differ from {}".format(
+                            partition, raw_tsdata[0]
+                        )
+                    )
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        os.replace(datafile + ".tmp.npy", datafile)
+        os.replace(timestampfile + ".tmp.npy", timestampfile)
+        # The information on the sources is written last, so that it is only
+        # found if the conversion is complete
+        info = {"source": sources, "variables": variables}
+        with open(infofile, "w") as f:
+            json.dump(info, f)
+
+    return (
+        info["variables"],
+        np.load(timestampfile),
+        np.load(datafile, mmap_mode="r"),
+    )
+
+
 def read_timestamps(raw_tsdata):
     timestamps = []
     with open(raw_tsdata) as f:
@@ -1177,6 +1386,30 @@ def bandgap(min_freq, max_freq, vardata):
     return cut_vardata
 
 
+def bandgap_inputdata(inputdata, low_freq, high_freq):
+    """Bandgap filters every variable in the columns of inputdata.
+
+    One sample less is returned if the number of samples is odd.
+
+    """
+    # TODO: add two buffer indices to the start and end to eliminate ringing
+    # Compensate for the fact that there is one less entry returned if the
+    # number of samples is odd
+    if bool(inputdata.shape[0] % 2):
+        inputdata_bandgapfiltered = np.zeros(
+            (inputdata.shape[0] - 1, inputdata.shape[1])
+        )
+    else:
+        inputdata_bandgapfiltered = np.zeros_like(inputdata)
+
+    for varindex in range(inputdata.shape[1]):
+        vardata = inputdata[:, varindex]
+        bandgapped_vardata = bandgap(low_freq, high_freq, vardata)
+        inputdata_bandgapfiltered[:, varindex] = bandgapped_vardata
+
+    return inputdata_bandgapfiltered
+
+
 def bandgapfilter_data(
     raw_tsdata,
     normalised_tsdata,
@@ -1193,52 +1426,23 @@ def bandgapfilter_data(
 
      """
 
-    # TODO: add two buffer indices to the start and end to eliminate ringing
     # Header and time from main source file
     headerline = np.genfromtxt(raw_tsdata, delimiter=",", dtype="string")[0, :]
     time = np.genfromtxt(raw_tsdata, delimiter=",")[1:, 0]
-    time = time[:, np.newaxis]
 
-    # Compensate for the fact that there is one less entry returned if the
-    # number of samples is odd
-    if bool(normalised_tsdata.shape[0] % 2):
-        inputdata_bandgapfiltered = np.zeros(
-            (normalised_tsdata.shape[0] - 1, normalised_tsdata.shape[1])
-        )
-    else:
-        inputdata_bandgapfiltered = np.zeros_like(normalised_tsdata)
-
-    for varindex in range(len(variables)):
-        vardata = normalised_tsdata[:, varindex]
-        bandgapped_vardata = bandgap(low_freq, high_freq, vardata)
-        inputdata_bandgapfiltered[:, varindex] = bandgapped_vardata
-
-    if bool(normalised_tsdata.shape[0] % 2):
-        # Only write from the second time entry as there is one less datapoint
-        # TODO: Currently it seems to exclude the last instead? Confirm
-        datalines = np.concatenate(
-            (time[:-1], inputdata_bandgapfiltered), axis=1
-        )
-    else:
-        datalines = np.concatenate((time, inputdata_bandgapfiltered), axis=1)
-
-    # Define export directories and filenames
-    datadir = config_setup.ensure_existence(
-        os.path.join(saveloc, "bandgappeddata"), make=True
+    inputdata_bandgapfiltered = bandgap_inputdata(
+        normalised_tsdata, low_freq, high_freq
     )
 
-    filename_template = os.path.join(datadir, "{}_{}_{}_{}_{}.csv")
-
-    def filename(name, lowfreq, highfreq):
-        return filename_template.format(
-            case, scenario, name, lowfreq, highfreq
-        )
-
-    # Store the normalised data in similar format as original data
-    writecsv(
-        filename("bandgapped_data", str(low_freq), str(high_freq)),
-        datalines,
+    # Only write from the second time entry as there is one less datapoint
+    # TODO: Currently it seems to exclude the last instead? Confirm
+    write_timestamped_data(
+        preprocessed_filename(
+            saveloc, case, scenario, "bandgapped", low_freq, high_freq
+        ),
         headerline,
+        time,
+        inputdata_bandgapfiltered,
     )
 
     return inputdata_bandgapfiltered
@@ -1299,8 +1503,6 @@ def skogestad_scale(data_raw, variables, scalingvalues):
     if scalingvalues is None:
         raise ValueError("Scaling values not defined")
 
-    data_skogestadscaled = np.zeros_like(data_raw)
-
     scalingvalues["scale_factor"] = list(
         map(
             skogestad_scale_select,
@@ -1311,66 +1513,68 @@ def skogestad_scale(data_raw, variables, scalingvalues):
         )
     )
 
-    # Loop through variables
     # The variables are aligned with the columns in raw_data
-    for index, var in enumerate(variables):
-        factor = scalingvalues.loc[var]["scale_factor"]
-        nominalval = scalingvalues.loc[var]["nominal"]
-        data_skogestadscaled[:, index] = (
-            data_raw[:, index] - nominalval
-        ) / factor
-
-    return data_skogestadscaled
-
-
-def write_normdata(saveloc, case, scenario, headerline, datalines):
-
-    # Define export directories and filenames
-    datadir = config_setup.ensure_existence(
-        os.path.join(saveloc, "normdata"), make=True
-    )
+    varscaling = scalingvalues.loc[list(variables)]
+    nominalvals = np.asarray(varscaling["nominal"], dtype=float)
+    factors = np.asarray(varscaling["scale_factor"], dtype=float)
 
-    filename_template = os.path.join(datadir, "{}_{}_{}.csv")
+    return (data_raw - nominalvals) / factors
 
-    def filename(name):
-        return filename_template.format(case, scenario, name)
 
-    # Store the normalised data in similar format as original data
-    writecsv(filename("normalised_data"), datalines, headerline)
+def preprocessed_filename(saveloc, case, scenario, step, *parameters):
+    """Returns the name of the CSV file that the data of a preprocessing step
+    is written to, which is either 'normalised', 'bandgapped' or 'detrended'.
 
-    return None
+    Parameters of the step are added to the name.
 
-
-def write_detrenddata(saveloc, case, scenario, headerline, datalines):
+    """
+    dirname, name = {
+        "normalised": ("normdata", "normalised_data"),
+        "bandgapped": ("bandgappeddata", "bandgapped_data"),
+        "detrended": ("detrenddata", "detrended_data"),
+    }[step]
 
     # Define export directories and filenames
     datadir = config_setup.ensure_existence(
-        os.path.join(saveloc, "detrenddata"), make=True
+        os.path.join(saveloc, dirname), make=True
     )
 
-    filename_template = os.path.join(datadir, "{}_{}_{}.csv")
+    return os.path.join(
+        datadir,
+        "_".join(
+            [case, scenario, name]
+            + [str(parameter) for parameter in parameters]
+        )
+        + ".csv",
+    )
 
-    def filename(name):
-        return filename_template.format(case, scenario, name)
 
-    # Store the detrended data in similar format as original data
-    writecsv(filename("detrended_data"), datalines, headerline)
+def write_timestamped_data(filename, headerline, timestamps, data):
+    """Writes data in similar format as the original data, with the
+    timestamps in the first column.
 
-    return None
+    The rows are written in blocks, so that the timestamps are never joined to
+    the complete data set in memory.
 
+    """
+    blocksize = 10000
+    with open(filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(headerline)
+        for start in range(0, len(data), blocksize):
+            block = data[start : start + blocksize]
+            writer.writerows(
+                np.concatenate(
+                    (
+                        timestamps[start : start + len(block), np.newaxis],
+                        block,
+                    ),
+                    axis=1,
+                )
+            )
 
-def normalise_data(
-    headerline,
-    timestamps,
-    inputdata_raw,
-    variables,
-    saveloc,
-    case,
-    scenario,
-    method,
-    weight_methods,
-    scalingvalues,
-):
+
+def normalise_inputdata(inputdata_raw, variables, method, scalingvalues):
 
     if method == "standardise":
         inputdata_normalised = sklearn.preprocessing.scale(
@@ -1394,18 +1598,50 @@ def normalise_data(
     else:
         raise NameError("Normalisation method not recognized")
 
-    datalines = np.concatenate(
-        (timestamps[:, np.newaxis], inputdata_normalised), axis=1
+    return inputdata_normalised
+
+
+def standardise_parameters(inputdata_raw):
+    """Returns the means and standard deviations of the variables that the
+    'standardise' normalisation uses, with standard deviations of constant
+    variables replaced by one.
+
+    """
+    means = np.nanmean(inputdata_raw, axis=0)
+    scales = np.nanstd(inputdata_raw, axis=0)
+    scales[scales < 10 * np.finfo(scales.dtype).eps] = 1.0
+
+    return means, scales
+
+
+def normalise_data(
+    headerline,
+    timestamps,
+    inputdata_raw,
+    variables,
+    saveloc,
+    case,
+    scenario,
+    method,
+    weight_methods,
+    scalingvalues,
+):
+
+    inputdata_normalised = normalise_inputdata(
+        inputdata_raw, variables, method, scalingvalues
     )
 
-    write_normdata(saveloc, case, scenario, headerline, datalines)
+    write_timestamped_data(
+        preprocessed_filename(saveloc, case, scenario, "normalised"),
+        headerline,
+        timestamps,
+        inputdata_normalised,
+    )
 
     return inputdata_normalised
 
 
-def detrend_data(
-    headerline, timestamps, inputdata, saveloc, case, scenario, method
-):
+def detrend_inputdata(inputdata, method):
 
     if method == "first_differences":
         inputdata_detrended = detrend_first_differences(inputdata)
@@ -1421,15 +1657,192 @@ def detrend_data(
     else:
         raise NameError("Detrending method not recognized")
 
-    datalines = np.concatenate(
-        (timestamps[:, np.newaxis], inputdata_detrended), axis=1
-    )
+    return inputdata_detrended
+
+
+def detrend_data(
+    headerline, timestamps, inputdata, saveloc, case, scenario, method
+):
 
-    write_detrenddata(saveloc, case, scenario, headerline, datalines)
+    inputdata_detrended = detrend_inputdata(inputdata, method)
+
+    write_timestamped_data(
+        preprocessed_filename(saveloc, case, scenario, "detrended"),
+        headerline,
+        timestamps,
+        inputdata_detrended,
+    )
 
     return inputdata_detrended
 
 
+def preprocess_data(
+    inputdata_raw,
+    variables,
+    normalise,
+    scalingvalues,
+    bandgap_freqs,
+    detrend,
+    sub_sampling_interval,
+    outputs=(),
+    rows=None,
+    chunksize=2 ** 22,
+):
+    """Normalises, bandgap filters, detrends and sub-samples the data in a
+    single pass over blocks of variables.
+
+    If only some rows of the sub-sampled data are kept, and the data are
+    neither filtered nor detrended with a linear model, only the raw samples
+    of these rows are preprocessed. First differences also read the raw
+    sample preceding every range of rows, while the standardisation uses the
+    means and standard deviations of the complete records.
+
+    Parameters
+    ----------
+        inputdata_raw : numpy.ndarray
+            The raw data with a variable in every column.
+        variables : list
+            Names of the variables in the columns.
+        normalise : str or bool
+            Normalisation method as accepted by normalise_inputdata.
+        scalingvalues : pandas.DataFrame or None
+            Scaling limits used by the 'skogestad' normalisation.
+        bandgap_freqs : tuple or None
+            The low and high frequencies of the bandgap filter, or None if
+            the data should not be filtered.
+        detrend : str or bool
+            Detrending method as accepted by detrend_inputdata.
+        sub_sampling_interval : int
+            Interval of the samples that are kept.
+        outputs : iterable
+            Steps for which the complete intermediate data are returned.
+            Any of 'normalised', 'bandgapped' and 'detrended'.
+        rows : list or None
+            Ranges of the rows of the sub-sampled data that are kept, as
+            tuples of start and end index. All rows are kept by default.
+        chunksize : int
+            Approximate number of values preprocessed together.
+
+    Returns
+    -------
+        inputdata : numpy.ndarray
+            The preprocessed data, with variables contiguous in memory. The
+            kept rows follow each other directly.
+        intermediate : dict
+            The intermediate data of the requested outputs keyed by step.
+
+    """
+    samples, varnum = inputdata_raw.shape
+    # Detrending drops the samples with missing values in any variable
+    dropna = bool(detrend) and np.isnan(inputdata_raw).any()
+    if dropna:
+        varstep = varnum
+    else:
+        varstep = max(1, chunksize // max(samples, 1))
+
+    # Samples are read directly at the sub-sampled rows if no step depends
+    # on other samples
+    pointwise = (
+        (normalise != "standardise")
+        and (bandgap_freqs is None)
+        and not detrend
+        and not outputs
+    )
+    # Otherwise only the kept ranges of rows are preprocessed, if no step
+    # depends on more than the preceding sample
+    local = (
+        (rows is not None)
+        and not pointwise
+        and (bandgap_freqs is None)
+        and (detrend in [False, "first_differences"])
+        and not (outputs or dropna)
+    )
+    if rows is not None:
+        rowindexes = np.concatenate(
+            [np.arange(0)] + [np.arange(start, end) for start, end in rows]
+        )
+    elif pointwise:
+        rowindexes = slice(None)
+
+    inputdata = None
+    intermediate = {}
+
+    def keep(step, columns, data):
+        if step in outputs:
+            if step not in intermediate:
+                intermediate[step] = np.empty(
+                    (len(data), varnum), dtype=data.dtype
+                )
+            intermediate[step][:, columns] = data
+
+    for start in range(0, varnum, varstep):
+        columns = slice(start, start + varstep)
+
+        if pointwise:
+            data = normalise_inputdata(
+                inputdata_raw[0::sub_sampling_interval, columns][rowindexes],
+                variables[columns],
+                normalise,
+                scalingvalues,
+            )
+        elif local:
+            if normalise == "standardise":
+                means, scales = standardise_parameters(
+                    inputdata_raw[:, columns]
+                )
+            blocks = [inputdata_raw[0:0, columns]]
+            for start, end in rows:
+                # Raw rows of the range, including the preceding sample that
+                # first differences are taken with
+                rawstart = start * sub_sampling_interval
+                rawend = (end - 1) * sub_sampling_interval + 1
+                margin = min(rawstart, 1) if detrend else 0
+                block = inputdata_raw[rawstart - margin : rawend, columns]
+                if normalise == "standardise":
+                    block = (block - means) / scales
+                else:
+                    block = normalise_inputdata(
+                        block, variables[columns], normalise, scalingvalues
+                    )
+                block = detrend_inputdata(block, detrend)
+                blocks.append(block[margin::sub_sampling_interval])
+            data = np.concatenate(blocks)
+        else:
+            data = normalise_inputdata(
+                inputdata_raw[:, columns],
+                variables[columns],
+                normalise,
+                scalingvalues,
+            )
+            keep("normalised", columns, data)
+
+            if bandgap_freqs is not None:
+                data = bandgap_inputdata(data, *bandgap_freqs)
+                keep("bandgapped", columns, data)
+
+            # Detrending should be performed after normalisation and band gap
+            # filtering
+            data = detrend_inputdata(data, detrend)
+            keep("detrended", columns, data)
+
+            # TODO: Use proper pandas.tseries.resample techniques
+            # if it will really add any functionality
+            data = data[0::sub_sampling_interval]
+            if rows is not None:
+                data = data[rowindexes]
+
+        if inputdata is None:
+            # Variables are stored in columns that are contiguous in memory,
+            # so that the data windows of a variable in every box can be
+            # passed on without copying
+            inputdata = np.empty(
+                (len(data), varnum), dtype=data.dtype, order="F"
+            )
+        inputdata[:, columns] = data
+
+    return inputdata, intermediate
+
+
 def subtract_mean(inputdata_raw):
     """Subtracts mean from input data."""
 
@@ -1594,44 +2007,47 @@ def get_box_endates(clean_df, window, overlap, freq):
 
     # Calculate the minimum timedelta between start of boxes
     min_timedelta = pd.Timedelta(freq) * overlap
+    if min_timedelta <= pd.Timedelta(0):
+        raise ValueError("Box overlap must be a positive number of steps")
 
     clean_df = clean_df.resample(freq).mean()  # Resamples at desired frequency
 
-    # Any aggregate function that returns nan when a nan occurs in window is suitable
-    rolling_clean_df = clean_df.rolling(
-        window=window, min_periods=window
-    ).mean()
-    rolling_clean_df.dropna(
-        inplace=True
-    )  # All indexes that remain have window continous samples at freq
-
-    end_indexes = [rolling_clean_df.index[0]]  # Initialise with first index
-    next_box_index = 0
-    next_box_exists = True
-    gc.disable()
-    while next_box_exists:
-        logging.info("Bins identified: " + str(len(end_indexes)))
-        # Get current list of differences
-        index_diffs = (
-            rolling_clean_df.index - rolling_clean_df.index[next_box_index]
+    # A box can end at every sample that completes window continous samples
+    # without nan in any variable
+    complete = np.asarray(clean_df.notna().all(axis=1), dtype=np.int64)
+    completecount = np.concatenate([[0], np.cumsum(complete)])
+    continous = (completecount[window:] - completecount[:-window]) == window
+    candidate_dates = clean_df.index[window - 1 :][continous]
+
+    if len(candidate_dates) == 0:
+        raise ValueError("No continous box of the window size in data")
+
+    # Each next box ends at the first candidate at least the minimum
+    # timedelta after the end of the previous box
+    timestamps = np.asarray(candidate_dates, dtype="datetime64[ns]").view(
+        np.int64
+    )
+    end_positions = [0]
+    while True:
+        next_position = np.searchsorted(
+            timestamps, timestamps[end_positions[-1]] + min_timedelta.value
         )
-        # Get index of first entry that is within outside the minimum overlap range
-        try:
-            next_box_index = next(
-                index
-                for index, timedelta in enumerate(index_diffs)
-                if timedelta >= pd.Timedelta(min_timedelta)
-            )
-            # Append this end_index
-            end_indexes.append(rolling_clean_df.index[next_box_index])
-        except:
-            next_box_exists = False
-    gc.enable()
+        if next_position == len(timestamps):
+            break
+        end_positions.append(next_position)
+    logging.info("Bins identified: " + str(len(end_positions)))
 
-    return end_indexes
+    return list(candidate_dates[end_positions])
 
 
 def get_continous_boxes(clean_df, window, overlap, freq):
+    """Gets the boxes of clean_df that are continous over window, see
+    get_box_endates.
+
+    Returns the start and end indexes of the rows of clean_df in each box,
+    along with the box dates.
+
+    """
 
     box_end_dates = get_box_endates(clean_df, window, overlap, freq)
     boxdates = [
@@ -1645,16 +2061,121 @@ def get_continous_boxes(clean_df, window, overlap, freq):
         for box_end_date in box_end_dates
     ]
 
-    boxes = [
-        clean_df[
-            (box_end_date - (pd.Timedelta(freq) * (window - 1))) : box_end_date
-        ]
+    # Rows from the start date up to and including the end date of each box
+    boxbounds = [
+        (
+            clean_df.index.searchsorted(
+                box_end_date - (pd.Timedelta(freq) * (window - 1))
+            ),
+            clean_df.index.searchsorted(box_end_date, side="right"),
+        )
         for box_end_date in box_end_dates
     ]
 
-    array_boxes = [np.asarray(box) for box in boxes]
+    return boxbounds, boxdates
 
-    return array_boxes, boxdates
+
+class BoxViews(object):
+    """Provides the boxes of a data set as views of the rows of a single
+    array.
+
+    A view is only created when its box is accessed, so overlapping boxes
+    share the memory of the array and boxes that are not analysed cost
+    nothing.
+
+    """
+
+    def __init__(self, data, boxbounds):
+        self.data = data
+        self.boxbounds = list(boxbounds)
+
+    def __len__(self):
+        return len(self.boxbounds)
+
+    def __getitem__(self, boxindex):
+        start, end = self.boxbounds[boxindex]
+        return self.data[start:end]
+
+
+def get_box_rows(boxbounds, boxindexes):
+    """Returns the ranges of rows covered by the selected boxes, in order and
+    with overlapping ranges merged.
+
+    """
+    rows = []
+    for start, end in sorted(boxbounds[boxindex] for boxindex in boxindexes):
+        if rows and start <= rows[-1][1]:
+            rows[-1] = (rows[-1][0], max(rows[-1][1], end))
+        else:
+            rows.append((start, end))
+    return rows
+
+
+def get_analysis_bounds(boxbounds, startindex, size, sample_delays):
+    """Returns the bounds of the rows of every box that are read by the
+    analyses, which compare the samples of the box starting at startindex
+    with the samples shifted by each of the sample_delays.
+
+    Also returns the index in these rows that corresponds to startindex. The
+    boxes are kept unchanged if a shifted window starts before the box, as
+    the negative indexes count from the end of the box instead.
+
+    """
+    first = startindex + min(0, min(sample_delays))
+    last = startindex + size + max(0, max(sample_delays))
+    if first < 0:
+        return list(boxbounds), startindex
+
+    analysisbounds = [
+        (start + first, max(start + first, min(end, start + last)))
+        for start, end in boxbounds
+    ]
+
+    return analysisbounds, startindex - first
+
+
+def compact_boxbounds(boxbounds, rows):
+    """Returns the bounds of the boxes in data of which only the ranges of
+    rows are kept, with the kept rows following each other directly.
+
+    The bounds of boxes that are not kept completely are None.
+
+    """
+    compactbounds = []
+    for start, end in boxbounds:
+        offset = 0
+        bounds = None
+        for rowstart, rowend in rows:
+            if rowstart <= start and end <= rowend:
+                bounds = (offset + start - rowstart, offset + end - rowstart)
+                break
+            offset += rowend - rowstart
+        compactbounds.append(bounds)
+    return compactbounds
+
+
+def split_tsdata_bounds(samples, samplerate, boxsize, boxnum):
+    """Returns the start and end indexes of the boxes that split_tsdata
+    divides a dataset with the number of samples into.
+
+    """
+
+    # Convert boxsize to number of samples
+    boxsizesamples = int(round(boxsize / samplerate))
+    #    print "Box size in samples: ", boxsizesamples
+    # Calculate starting index for each box
+
+    if boxnum == 1:
+        return [(0, samples)]
+
+    # Boxes are spread evenly between the start and end of the dataset
+    boxstartindex = np.round(
+        np.linspace(0, samples - boxsizesamples, int(boxnum))
+    ).astype(int)
+
+    return [
+        (int(start), int(start) + boxsizesamples) for start in boxstartindex
+    ]
 
 
 def split_tsdata(inputdata, samplerate, boxsize, boxnum):
@@ -1674,35 +2195,16 @@ def split_tsdata(inputdata, samplerate, boxsize, boxnum):
 
 
     """
-    # Get total number of samples
-    samples = len(inputdata)
-    #    print "Number of samples: ", samples
-    # Convert boxsize to number of samples
-    boxsizesamples = int(round(boxsize / samplerate))
-    #    print "Box size in samples: ", boxsizesamples
-    # Calculate starting index for each box
 
     if boxnum == 1:
-        boxes = [inputdata]
+        return [inputdata]
 
-    else:
-        boxstartindex = np.empty((1, boxnum))[0]
-        boxstartindex[:] = np.NAN
-        boxstartindex[0] = 0
-        boxstartindex[-1] = samples - boxsizesamples
-        samplesbetween = (float(samples - boxsizesamples)) / float(boxnum - 1)
-        boxstartindex[1:-1] = [
-            round(samplesbetween * index) for index in range(1, boxnum - 1)
-        ]
-        boxes = [
-            inputdata[
-                int(boxstartindex[i]) : int(boxstartindex[i])
-                + int(boxsizesamples)
-            ]
-            for i in range(int(boxnum))
-        ]
-
-    return boxes
+    return [
+        inputdata[start:end]
+        for start, end in split_tsdata_bounds(
+            len(inputdata), samplerate, boxsize, boxnum
+        )
+    ]
 
 
 def calc_signalent(vardata, weightcalcdata):
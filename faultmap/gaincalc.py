@@ -21,11 +21,14 @@ amplitude adjusted Fourier transform method (iAAFT).
 """
 
 # Standard libraries
+import copy
 import csv
+import hashlib
 import json
 import logging
 import multiprocessing
 import os
+import shutil
 import time
 
 import numpy as np
@@ -33,7 +36,7 @@ import pandas as pd
 
 from faultmap import data_processing, config_setup
 from test import datagen
-from faultmap import gaincalc_oneset
+from faultmap import gaincalc_oneset, resultstore
 from faultmap.gaincalculators import CorrWeightcalc, TransentWeightcalc
 
 
@@ -93,6 +96,11 @@ class WeightcalcData(object):
         self.scenarios = self.caseconfig["scenarios"]
         # Get methods
         self.methods = self.caseconfig["methods"]
+        # Get estimator backends per method, JIDT is used by default
+        if "backends" in self.caseconfig:
+            self.backends = self.caseconfig["backends"]
+        else:
+            self.backends = {}
 
         self.do_multiprocessing = do_multiprocessing
         self.use_gpu = use_gpu
@@ -104,6 +112,24 @@ class WeightcalcData(object):
         # Flag for calculating FFT of all signals
         self.fftcalc = fftcalc
 
+        # Data of every preprocessing step keyed by the data source and the
+        # settings of all steps up to it, so that settings and scenarios
+        # with the same preprocessing share the results
+        self.preprocessed = {}
+        # Keys of the data last written to the output files of each scenario
+        self.preprocessed_outputs = {}
+
+    def __getstate__(self):
+        # Worker processes only analyse the boxes of the current settings,
+        # the preprocessed data of other settings and the timestamps used for
+        # writing results are kept in the parent process
+        state = self.__dict__.copy()
+        state["preprocessed"] = {}
+        state["preprocessed_outputs"] = {}
+        state["timestamps"] = None
+        state["boxdates"] = None
+        return state
+
     def scenariodata(self, scenario):
         """Retrieves data particular to each scenario for the case being
         investigated.
@@ -137,6 +163,29 @@ class WeightcalcData(object):
         else:
             self.transient = False
             logging.info("Defaulting to single time region analysis")
+        # Calculate the correlations of all boxes from sums over the full
+        # data set instead of every box individually
+        if "sliding_correlation" in self.caseconfig[settings_name]:
+            self.sliding_correlation = self.caseconfig[settings_name][
+                "sliding_correlation"
+            ]
+        else:
+            self.sliding_correlation = False
+        # Derive the transfer entropies and mutual information of all boxes
+        # from local values estimated once over the complete records
+        if "local_estimates" in self.caseconfig[settings_name]:
+            self.local_estimates = self.caseconfig[settings_name][
+                "local_estimates"
+            ]
+        else:
+            self.local_estimates = False
+        # Only the native backend derives estimates from local values, so
+        # that the complete records are only needed if it is used
+        self.local_profiles_used = self.local_estimates and any(
+            (method[:16] == "transfer_entropy")
+            and (self.backends.get(method, "jidt") == "native")
+            for method in self.methods
+        )
         if "normalise" in self.caseconfig[settings_name]:
             self.normalise = self.caseconfig[settings_name]["normalise"]
         else:
@@ -186,104 +235,30 @@ class WeightcalcData(object):
             else:
                 self.kernel_width = None
 
-        if self.datatype == "file":
-            # Get path to time series data input file in standard format
-            # described in documentation under "Input data formats"
-            raw_tsdata = os.path.join(
-                self.casedir, "data", self.caseconfig[scenario]["data"]
-            )
-
-            # Retrieve connection matrix
-            if self.connections_used:
-                # Get connection (adjacency) matrix
-                connection_loc = os.path.join(
-                    self.casedir,
-                    "connections",
-                    self.caseconfig[scenario]["connections"],
-                )
-                (
-                    self.connectionmatrix,
-                    _,
-                ) = data_processing.read_connectionmatrix(connection_loc)
-
-            # Read data into Pandas dataframe
-            raw_df = pd.read_csv(raw_tsdata)
-            raw_df["Time"] = pd.to_datetime(raw_df["Time"], unit="s")
-            raw_df.set_index("Time", inplace=True)
-
-            self.variables = list(raw_df.keys())
-            self.timestamps = np.asarray(
-                raw_df.index.astype(np.int64) // 10 ** 9
-            )
-            self.headerline = ["Time"] + [var for var in self.variables]
-
-            self.inputdata_raw = np.asarray(raw_df)
-
-            # Convert timeseries data in CSV file to H5 data format
-            # datapath = data_processing.csv_to_h5(self.saveloc, raw_tsdata,
-            #                                      scenario, self.casename)
-            # Read variables from orignal CSV file
-            # self.variables = data_processing.read_variables(raw_tsdata)
-            # self.timestamps = data_processing.read_timestamps(raw_tsdata)
-            # # Get inputdata from H5 table created
-            # self.inputdata_raw = np.array(h5py.File(os.path.join(
-            #     datapath, scenario + '.h5'), 'r')[scenario])
-            # self.headerline = np.genfromtxt(raw_tsdata, delimiter=',',
-            #                                 dtype='str')[0, :]
-
-        elif self.datatype == "function":
-            raw_tsdata_gen = self.caseconfig[scenario]["datagen"]
-            if self.connections_used:
-                connectionloc = self.caseconfig[scenario]["connections"]
-                # Get the variables and connection matrix
-                self.variables, self.connectionmatrix = getattr(
-                    datagen, connectionloc
-                )()
-            # TODO: Store function arguments in scenario config file
-            params = self.caseconfig[settings_name]["datagen_params"]
-            # Get inputdata
-            self.inputdata_raw = getattr(datagen, raw_tsdata_gen)(params)
-            self.inputdata_raw = np.asarray(self.inputdata_raw)
-
-            self.timestamps = np.arange(
-                0,
-                len(self.inputdata_raw[:, 0]) * self.sampling_rate,
-                self.sampling_rate,
-            )
+        if self.transient:
+            self.boxsize = self.caseconfig[settings_name]["boxsize"]
+            if self.transient_method == "legacy":
+                self.boxnum = self.caseconfig[settings_name]["boxnum"]
+            elif self.transient_method == "robust":
+                self.boxoverlap = self.caseconfig[settings_name]["boxoverlap"]
 
-            self.headerline = ["Time"]
-            [self.headerline.append(variable) for variable in self.variables]
+        try:
+            self.transient_method
+        except:
+            self.transient_method = None
 
-        # Perform normalisation
-        # Retrieve scaling limits from file
-        if self.normalise == "skogestad":
-            # Get scaling parameters
-            if "scalelimits" in self.caseconfig[scenario]:
-                scaling_loc = os.path.join(
-                    self.casedir,
-                    "scalelimits",
-                    self.caseconfig[scenario]["scalelimits"],
-                )
-                scalingvalues = data_processing.read_scalelimits(scaling_loc)
+        # Select which of the boxes to evaluate
+        if self.transient:
+            if "boxindexes" in self.caseconfig[scenario]:
+                if self.caseconfig[scenario]["boxindexes"] == "range":
+                    self.boxindexes = range(
+                        self.caseconfig[scenario]["boxindexes_start"],
+                        self.caseconfig[scenario]["boxindexes_end"] + 1,
+                    )
+                else:
+                    self.boxindexes = self.caseconfig[scenario]["boxindexes"]
             else:
-                raise NameError(
-                    "Scale limits reference missing from " "configuration file"
-                )
-        else:
-            scalingvalues = None
-
-        self.inputdata_normstep = data_processing.normalise_data(
-            self.headerline,
-            self.timestamps,
-            self.inputdata_raw,
-            self.variables,
-            self.saveloc,
-            self.casename,
-            scenario,
-            self.normalise,
-            self.methods,
-            scalingvalues,
-        )
+                self.boxindexes = "all"
 
         # Get delay type
         if "delaytype" in self.caseconfig[settings_name]:
@@ -328,6 +303,20 @@ class WeightcalcData(object):
 
             self.delays = [(val * self.delayinterval) for val in delay_range]
 
+        # Calculate delays in indexes, which determine the rows of the boxes
+        # that are analysed
+        if self.delaytype == "datapoints":
+            self.sample_delays = self.delays
+        elif self.delaytype == "intervals":
+            self.sample_delays = [
+                int(round(delay / self.sampling_rate)) for delay in self.delays
+            ]
+
+        if not self.transient:
+            self.boxnum = 1  # Only a single box will be used
+
+        datakey = self.preprocess(scenario, settings_name)
+
         if "causevarindexes" in self.caseconfig[scenario]:
             self.causevarindexes = self.caseconfig[scenario]["causevarindexes"]
         else:
@@ -343,86 +332,416 @@ class WeightcalcData(object):
         if self.affectedvarindexes == "all":
             self.affectedvarindexes = range(len(self.variables))
 
+        if not self.transient:
+            self.boxsize = self.samples * self.sampling_rate
+            # This box should now return the same size
+            # as the original data file - but it does not play a role at all
+            # in the actual box determination for the case of boxnum = 1
+
+        if self.transient_method == "robust":
+            boxkey = datakey + (
+                self.transient_method,
+                self.boxsize,
+                self.boxoverlap,
+                self.sampling_rate,
+            )
+        else:
+            boxkey = datakey + (
+                self.transient_method,
+                self.boxsize,
+                self.boxnum,
+                self.sampling_rate,
+            )
+        boxbounds, self.boxdates = self.cached(boxkey, self.calc_boxes)
+        # The bounds refer to the rows kept of the preprocessed data, which
+        # only include the rows of the selected boxes read by the analyses
+        if self.keptrows is None:
+            self.boxbounds = boxbounds
+        else:
+            (
+                analysisbounds,
+                self.startindex,
+            ) = data_processing.get_analysis_bounds(
+                boxbounds, self.startindex, self.testsize, self.sample_delays
+            )
+            self.boxbounds = data_processing.compact_boxbounds(
+                analysisbounds, self.keptrows
+            )
+        self.boxes = data_processing.BoxViews(self.inputdata, self.boxbounds)
+        if self.transient_method == "robust":
+            self.boxnum = len(self.boxdates)
+
+        if self.unwritten((scenario, "boxdates"), ("boxdates", boxkey)):
+            data_processing.write_boxdates(
+                self.boxdates, self.saveloc, self.casename, scenario
+            )
+
+        # Select which of the boxes to evaluate
+        if self.transient:
+            if self.boxindexes == "all":
+                self.boxindexes = range(self.boxnum)
+        else:
+            self.boxindexes = [0]
+
+        if len(self.boxindexes) > 1:
+            self.generate_diffs = True
+        else:
+            self.generate_diffs = False
+
+        # Calculate delays in time units
+        if self.delaytype == "datapoints":
+            self.actual_delays = [
+                (delay * self.sampling_rate * self.sub_sampling_interval)
+                for delay in self.delays
+            ]
+        elif self.delaytype == "intervals":
+            self.actual_delays = [
+                delay * self.sampling_rate for delay in self.sample_delays
+            ]
+
+        # Create descriptive dictionary for later use
+        # This will need to be approached slightly differently to allow for
+        # different formats under the same "plant"
+        #        self.descriptions = data_processing.descriptive_dictionary(
+        #            os.path.join(self.casedir, 'data', 'tag_descriptions.csv'))
+
+    def cached(self, key, calculate):
+        """Returns the preprocessed data stored under key, calculating and
+        storing it first if required.
+
+        """
+        if key not in self.preprocessed:
+            self.preprocessed[key] = calculate()
+        return self.preprocessed[key]
+
+    def unwritten(self, output, key):
+        """Checks whether an output of the preprocessing still has to be
+        written with the data stored under key.
+
+        Output files already written with the same data for other scenarios
+        are copied instead. Writing the output is assumed to follow a positive
+        answer.
+
+        """
+        if self.preprocessed_outputs.get(output) == key:
+            return False
+        sources = [
+            source
+            for source, sourcekey in self.preprocessed_outputs.items()
+            if sourcekey == key
+        ]
+        self.preprocessed_outputs[output] = key
+        if isinstance(output, str) and sources:
+            shutil.copyfile(sources[0], output)
+            return False
+        return True
+
+    def preprocess(self, scenario, settings_name):
+        """Reads or generates the data of a scenario and applies the
+        normalisation, bandgap filtering, detrending and sub-sampling of the
+        settings.
+
+        Only the preprocessed data are kept, and reused by later settings and
+        scenarios with the same data and preprocessing. The intermediate data
+        of the steps listed in the preprocessed_output setting are written
+        to file, where the files of the scenario do not hold them yet.
+
+        Returns the key of the preprocessed data.
+
+        """
+        if self.datatype == "file":
+            # Get path to time series data input file in standard format
+            # described in documentation under "Input data formats"
+            # The data may be partitioned over a list of files
+            datafiles = self.caseconfig[scenario]["data"]
+            if isinstance(datafiles, str):
+                datafiles = [datafiles]
+            raw_tsdata = [
+                os.path.join(self.casedir, "data", datafile)
+                for datafile in datafiles
+            ]
+
+            # Retrieve connection matrix
+            if self.connections_used:
+                # Get connection (adjacency) matrix
+                connection_loc = os.path.join(
+                    self.casedir,
+                    "connections",
+                    self.caseconfig[scenario]["connections"],
+                )
+                (
+                    self.connectionmatrix,
+                    _,
+                ) = data_processing.read_connectionmatrix(connection_loc)
+
+            # The data files are converted to binary files once, which are
+            # memory-mapped on every read. Partitioned data are identified by
+            # a digest of the paths of all partitions.
+            binaryname = os.path.splitext(datafiles[0])[0]
+            if len(raw_tsdata) > 1:
+                partitions = "\n".join(
+                    os.path.abspath(datafile) for datafile in raw_tsdata
+                )
+                digest = hashlib.sha1(partitions.encode()).hexdigest()
+                binaryname += "-" + digest[:16]
+            binarydir = os.path.join(
+                self.saveloc, "data", self.casename, binaryname
+            )
+            if self.do_multiprocessing:
+                processes = multiprocessing.cpu_count()
+            else:
+                processes = 1
+
+            def read_data():
+                return data_processing.ingest_tsdata(
+                    raw_tsdata, binarydir, processes=processes
+                )
+
+            datakey = (tuple(raw_tsdata),)
+
+        elif self.datatype == "function":
+            raw_tsdata_gen = self.caseconfig[scenario]["datagen"]
+            if self.connections_used:
+                connectionloc = self.caseconfig[scenario]["connections"]
+                # Get the variables and connection matrix
+                self.variables, self.connectionmatrix = getattr(
+                    datagen, connectionloc
+                )()
+            # TODO: Store function arguments in scenario config file
+            params = self.caseconfig[settings_name]["datagen_params"]
+
+            def read_data():
+                # Get inputdata
+                inputdata_raw = getattr(datagen, raw_tsdata_gen)(params)
+                inputdata_raw = np.asarray(inputdata_raw)
+
+                timestamps = np.arange(
+                    0,
+                    len(inputdata_raw[:, 0]) * self.sampling_rate,
+                    self.sampling_rate,
+                )
+
+                return self.variables, timestamps, inputdata_raw
+
+            # Generated data may be random, so that a new data set is
+            # generated on every call. Every data set is a separate source,
+            # so that only the data of the current call are kept.
+            datakey = ((raw_tsdata_gen, object()),)
+
+        # Perform normalisation
+        # Retrieve scaling limits from file
+        if self.normalise == "skogestad":
+            # Get scaling parameters
+            if "scalelimits" in self.caseconfig[scenario]:
+                scaling_loc = os.path.join(
+                    self.casedir,
+                    "scalelimits",
+                    self.caseconfig[scenario]["scalelimits"],
+                )
+                scalingvalues = data_processing.read_scalelimits(scaling_loc)
+            else:
+                raise NameError(
+                    "Scale limits reference missing from " "configuration file"
+                )
+        else:
+            scaling_loc = None
+            scalingvalues = None
+        datakey += (self.normalise, scaling_loc)
+        stepkeys = {"normalised": datakey}
+
         if "bandgap_filtering" in self.caseconfig[scenario]:
             bandgap_filtering = self.caseconfig[scenario]["bandgap_filtering"]
         else:
             bandgap_filtering = False
         if bandgap_filtering:
-            low_freq = self.caseconfig[scenario]["low_freq"]
-            high_freq = self.caseconfig[scenario]["high_freq"]
-            self.inputdata_bandgapfiltered = data_processing.bandgapfilter_data(
-                raw_tsdata,
-                self.inputdata_normstep,
-                self.variables,
-                low_freq,
-                high_freq,
-                self.saveloc,
-                self.casename,
-                scenario,
+            bandgap_freqs = (
+                self.caseconfig[scenario]["low_freq"],
+                self.caseconfig[scenario]["high_freq"],
             )
-            self.inputdata_originalrate = self.inputdata_bandgapfiltered
+            datakey += bandgap_freqs
+            stepkeys["bandgapped"] = datakey
         else:
-            self.inputdata_originalrate = self.inputdata_normstep
+            bandgap_freqs = None
 
         # Perform detrending
         # Detrending should be performed after normalisation and band gap filtering
-
-        self.inputdata_originalrate = data_processing.detrend_data(
-            self.headerline,
-            self.timestamps,
-            self.inputdata_originalrate,
-            self.saveloc,
-            self.casename,
-            scenario,
-            self.detrend,
+        datakey += (self.detrend,)
+        stepkeys["detrended"] = datakey
+
+        # Intermediate data written to file
+        # The variables are read from the normalised data by noderank
+        if "preprocessed_output" in self.caseconfig[settings_name]:
+            preprocessed_output = self.caseconfig[settings_name][
+                "preprocessed_output"
+            ]
+        else:
+            preprocessed_output = ["normalised"]
+
+        filenames = {}
+        for step in preprocessed_output:
+            if step not in stepkeys:
+                continue
+            if step == "bandgapped":
+                parameters = bandgap_freqs
+            else:
+                parameters = ()
+            filename = data_processing.preprocessed_filename(
+                self.saveloc, self.casename, scenario, step, *parameters
+            )
+            if self.unwritten(filename, (step, stepkeys[step])):
+                filenames[step] = filename
+        # FFT the data and write back in format that can be analysed in
+        # TOPCAT in a plane plot
+        fftcalc = self.fftcalc and self.unwritten(
+            (scenario, "fft"),
+            ("fft", datakey, self.sampling_rate, self.sampling_unit),
         )
+        outputs = set(filenames)
+        if fftcalc:
+            outputs.add("detrended")
 
         # Subsample data if required
         # Get sub_sampling interval
         self.sub_sampling_interval = self.caseconfig[settings_name][
             "sub_sampling_interval"
         ]
-        # TODO: Use proper pandas.tseries.resample techniques
-        # if it will really add any functionality
         # TODO: Investigate use of forward-backward Kalman filters
-        self.inputdata = self.inputdata_originalrate[
-            0 :: self.sub_sampling_interval
-        ]
-
-        if self.transient:
-            self.boxsize = self.caseconfig[settings_name]["boxsize"]
-            if self.transient_method == "legacy":
-                self.boxnum = self.caseconfig[settings_name]["boxnum"]
-            elif self.transient_method == "robust":
-                self.boxoverlap = self.caseconfig[settings_name]["boxoverlap"]
+        datakey += (self.sub_sampling_interval,)
+
+        # Only the rows of the selected boxes that are read by the analyses
+        # are kept if the boxes only depend on the number of samples, while
+        # the local profiles use the complete records
+        select_rows = (
+            self.transient_method in ["legacy", None]
+        ) and not self.local_profiles_used
+        if select_rows:
+            if not self.transient:
+                boxindexes = [0]
+            elif self.boxindexes == "all":
+                boxindexes = range(self.boxnum)
+            else:
+                boxindexes = self.boxindexes
+            datakey += (
+                tuple(boxindexes),
+                self.boxsize if self.transient else None,
+                self.boxnum,
+                self.sampling_rate,
+                self.startindex,
+                self.testsize,
+                tuple(self.sample_delays),
+            )
 
+        if datakey in self.preprocessed and not outputs:
+            (
+                self.variables,
+                self.timestamps,
+                self.inputdata,
+                self.samples,
+                self.keptrows,
+            ) = self.preprocessed[datakey]
         else:
-            self.boxnum = 1  # Only a single box will be used
-            self.boxsize = self.inputdata.shape[0] * self.sampling_rate
-            # This box should now return the same size
-            # as the original data file - but it does not play a role at all
-            # in the actual box determination for the case of boxnum = 1
+            # Only the data of a single source is kept
+            if any(key[0] != datakey[0] for key in self.preprocessed):
+                self.preprocessed.clear()
+
+            self.variables, self.timestamps, inputdata_raw = read_data()
+
+            # Number of samples after preprocessing, which is only
+            # known beforehand if detrending does not drop samples with
+            # missing values
+            if select_rows and not (
+                self.detrend and np.isnan(inputdata_raw).any()
+            ):
+                samples = len(inputdata_raw)
+                if bandgap_freqs is not None:
+                    samples -= samples % 2
+                self.samples = len(
+                    range(0, samples, self.sub_sampling_interval)
+                )
+                if self.transient:
+                    boxbounds = data_processing.split_tsdata_bounds(
+                        self.samples,
+                        self.sampling_rate * self.sub_sampling_interval,
+                        self.boxsize,
+                        self.boxnum,
+                    )
+                else:
+                    boxbounds = [(0, self.samples)]
+                analysisbounds, _ = data_processing.get_analysis_bounds(
+                    boxbounds,
+                    self.startindex,
+                    self.testsize,
+                    self.sample_delays,
+                )
+                self.keptrows = data_processing.get_box_rows(
+                    analysisbounds, boxindexes
+                )
+            else:
+                self.keptrows = None
 
-        try:
-            self.transient_method
-        except:
-            self.transient_method = None
+            self.inputdata, intermediate = data_processing.preprocess_data(
+                inputdata_raw,
+                self.variables,
+                self.normalise,
+                scalingvalues,
+                bandgap_freqs,
+                self.detrend,
+                self.sub_sampling_interval,
+                outputs,
+                self.keptrows,
+            )
+            del inputdata_raw
+            if self.keptrows is None:
+                self.samples = len(self.inputdata)
+            self.preprocessed[datakey] = (
+                self.variables,
+                self.timestamps,
+                self.inputdata,
+                self.samples,
+                self.keptrows,
+            )
+
+        self.headerline = ["Time"] + [var for var in self.variables]
+
+        if outputs:
+            for step, filename in filenames.items():
+                data_processing.write_timestamped_data(
+                    filename,
+                    self.headerline,
+                    self.timestamps,
+                    intermediate[step],
+                )
+
+            if fftcalc:
+                data_processing.fft_calculation(
+                    self.headerline,
+                    intermediate["detrended"],
+                    self.variables,
+                    self.sampling_rate,
+                    self.sampling_unit,
+                    self.saveloc,
+                    self.casename,
+                    scenario,
+                )
 
+            del intermediate
+
+        return datakey
+
+    def calc_boxes(self):
+        """Returns the bounds and the start and end dates of the boxes."""
         if self.transient_method == "legacy" or self.transient_method is None:
             # Get box start and end dates
-            self.boxdates = data_processing.split_tsdata(
+            boxdates = data_processing.split_tsdata(
                 self.timestamps,
                 self.sampling_rate * self.sub_sampling_interval,
                 self.boxsize,
                 self.boxnum,
             )
-            data_processing.write_boxdates(
-                self.boxdates, self.saveloc, self.casename, scenario
-            )
 
             # Generate boxes to use
-            self.boxes = data_processing.split_tsdata(
-                self.inputdata,
+            boxbounds = data_processing.split_tsdata_bounds(
+                self.samples,
                 self.sampling_rate * self.sub_sampling_interval,
                 self.boxsize,
                 self.boxnum,
@@ -437,74 +756,11 @@ class WeightcalcData(object):
 
             freq_string = str(self.sampling_rate) + "S"
 
-            self.boxes, self.boxdates = data_processing.get_continous_boxes(
+            boxbounds, boxdates = data_processing.get_continous_boxes(
                 df, self.boxsize, self.boxoverlap, freq_string
             )
 
-            data_processing.write_boxdates(
-                self.boxdates, self.saveloc, self.casename, scenario
-            )
-
-            self.boxnum = len(self.boxdates)
-
-        # Select which of the boxes to evaluate
-        if self.transient:
-            if "boxindexes" in self.caseconfig[scenario]:
-                if self.caseconfig[scenario]["boxindexes"] == "range":
-                    self.boxindexes = range(
-                        self.caseconfig[scenario]["boxindexes_start"],
-                        self.caseconfig[scenario]["boxindexes_end"] + 1,
-                    )
-                else:
-                    self.boxindexes = self.caseconfig[scenario]["boxindexes"]
-            else:
-                self.boxindexes = "all"
-            if self.boxindexes == "all":
-                self.boxindexes = range(self.boxnum)
-        else:
-            self.boxindexes = [0]
-
-        if len(self.boxindexes) > 1:
-            self.generate_diffs = True
-        else:
-            self.generate_diffs = False
-
-        # Calculate delays in indexes as well as time units
-        if self.delaytype == "datapoints":
-            self.actual_delays = [
-                (delay * self.sampling_rate * self.sub_sampling_interval)
-                for delay in self.delays
-            ]
-            self.sample_delays = self.delays
-        elif self.delaytype == "intervals":
-            self.actual_delays = [
-                int(round(delay / self.sampling_rate)) * self.sampling_rate
-                for delay in self.delays
-            ]
-            self.sample_delays = [
-                int(round(delay / self.sampling_rate)) for delay in self.delays
-            ]
-
-        # Create descriptive dictionary for later use
-        # This will need to be approached slightly differently to allow for
-        # different formats under the same "plant"
-        #        self.descriptions = data_processing.descriptive_dictionary(
-        #            os.path.join(self.casedir, 'data', 'tag_descriptions.csv'))
-
-        # FFT the data and write back in format that can be analysed in
-        # TOPCAT in a plane plot
-
-        if self.fftcalc:
-            data_processing.fft_calculation(
-                self.headerline,
-                self.inputdata_originalrate,
-                self.variables,
-                self.sampling_rate,
-                self.sampling_unit,
-                self.saveloc,
-                self.casename,
-                scenario,
-            )
+        return boxbounds, boxdates
 
 
 def writecsv_weightcalc(filename, items, header):
@@ -515,9 +771,12 @@ def writecsv_weightcalc(filename, items, header):
         csv.writer(f).writerows(items)
 
 
-def calc_weights(weightcalcdata, method, scenario, writeoutput):
-    """Determines the maximum weight between two variables by searching through
-    a specified set of delays.
+def setup_weights(weightcalcdata, method, scenario, writeoutput):
+    """Prepares the weight calculation of a method for all boxes.
+
+    Returns a dictionary with the data shared by all pairs analysed with the
+    method. This includes the weight calculator, of which a copy is prepared
+    for each box with prepare_weights.
 
     Parameters
     ----------
@@ -528,18 +787,31 @@ def calc_weights(weightcalcdata, method, scenario, writeoutput):
         'transfer_entropy_kernel'
         'transfer_entropy_kraskov'
 
+    The estimator backend of each transfer entropy method can be selected in
+    the optional 'backends' dictionary of the case config, for example
+    {"transfer_entropy_kraskov": "native"} to use the ksg module instead of
+    JIDT.
+
     TODO: Fix partial correlation method to make use of time delays
 
     """
 
+    backend = weightcalcdata.backends.get(method, "jidt")
+
     if method == "cross_correlation":
         weightcalculator = CorrWeightcalc(weightcalcdata)
     elif method == "transfer_entropy_kernel":
-        weightcalculator = TransentWeightcalc(weightcalcdata, "kernel")
+        weightcalculator = TransentWeightcalc(
+            weightcalcdata, "kernel", backend
+        )
     elif method == "transfer_entropy_kraskov":
-        weightcalculator = TransentWeightcalc(weightcalcdata, "kraskov")
+        weightcalculator = TransentWeightcalc(
+            weightcalcdata, "kraskov", backend
+        )
     elif method == "transfer_entropy_discrete":
-        weightcalculator = TransentWeightcalc(weightcalcdata, "discrete")
+        weightcalculator = TransentWeightcalc(
+            weightcalcdata, "discrete", backend
+        )
     # elif method == 'partial_correlation':
     #     weightcalculator = PartialCorrWeightcalc(weightcalcdata)
     else:
@@ -583,29 +855,9 @@ def calc_weights(weightcalcdata, method, scenario, writeoutput):
     for affected_delindex in affected_dellist:
         newconnectionmatrix[affected_delindex, :] = np.zeros(vardims)
 
-    # Initiate headerline for weightstore file
-    # Create "Delay" as header for first row
-    headerline = ["Delay"]
-    for affectedvarindex in weightcalcdata.affectedvarindexes:
-        affectedvarname = weightcalcdata.variables[affectedvarindex]
-        headerline.append(affectedvarname)
-
-    # Define filename structure for CSV file containing weights between
-    # a specific causevar and all the subsequent affectedvars
-    def filename(weightname, boxindex, causevar):
-        boxstring = "box{:03d}".format(boxindex)
-
-        filedir = config_setup.ensure_existence(
-            os.path.join(weightstoredir, weightname, boxstring), make=True
-        )
-
-        filename = "{}.csv".format(causevar)
-
-        return os.path.join(filedir, filename)
-
-    # Store the weight calculation results in similar format as original data
-
     # Define weightstoredir up to the method level
+    # The weight calculation results are kept in a result store in this
+    # directory
     weightstoredir = config_setup.ensure_existence(
         os.path.join(
             weightcalcdata.saveloc,
@@ -619,6 +871,12 @@ def calc_weights(weightcalcdata, method, scenario, writeoutput):
         make=True,
     )
 
+    # Local values are kept with the result store for time-resolved analysis
+    if writeoutput and weightcalcdata.local_estimates:
+        weightcalculator.localdir = os.path.join(
+            weightstoredir, "local_estimates"
+        )
+
     if weightcalcdata.single_entropies:
         # Initiate headerline for single signal entropies storage file
         signalent_headerline = weightcalcdata.variables
@@ -637,12 +895,14 @@ def calc_weights(weightcalcdata, method, scenario, writeoutput):
             signalentstoredir, "{}_{}_{}_box{:03d}.csv"
         )
 
+    # Calculate single signal entropies - do not worry about
+    # delays, but still do it according to different boxes
     for boxindex in weightcalcdata.boxindexes:
-        box = weightcalcdata.boxes[boxindex]
-
-        # Calculate single signal entropies - do not worry about
-        # delays, but still do it according to different boxes
         if weightcalcdata.single_entropies:
+            # Boxes are views into the input data, which are only kept while
+            # they are used
+            box = weightcalcdata.boxes[boxindex]
+
             # Calculate single signal entropies of all variables
             # and save output in similar format to
             # standard weight calculation results
@@ -670,33 +930,267 @@ def calc_weights(weightcalcdata, method, scenario, writeoutput):
                 signalent_headerline,
             )
 
-        # Start parallelising code here
-        # Create one process for each causevarindex
+    return {
+        "weightcalcdata": weightcalcdata,
+        "method": method,
+        "startindex": startindex,
+        "size": size,
+        "newconnectionmatrix": newconnectionmatrix,
+        "weightstoredir": weightstoredir,
+        "writeoutput": writeoutput,
+        "weightcalculator": weightcalculator,
+    }
 
-        ###########################################################
 
-        non_iter_args = [
-            weightcalcdata,
-            weightcalculator,
-            box,
-            startindex,
-            size,
-            newconnectionmatrix,
-            method,
+def prepare_weights(context, boxindex):
+    """Returns a copy of the weight calculator of a method prepared for a
+    box.
+
+    """
+
+    weightcalcdata = context["weightcalcdata"]
+
+    # Calculate all box level results that can be shared among the
+    # individual variable pairs
+    # Boxes are analysed concurrently, so each gets its own calculator
+    boxcalculator = copy.copy(context["weightcalculator"])
+    boxcalculator.prepare_box(
+        weightcalcdata, weightcalcdata.boxes[boxindex], boxindex
+    )
+
+    return boxcalculator
+
+
+def finish_weights(context, boxindex, causevarindex, pair_results, store):
+    """Merges the results of all pairs of a causevar in a box and writes them
+    to the result store.
+
+    """
+
+    # Only the data header of the calculator is needed for merging, so the
+    # box does not have to be prepared
+    gaincalc_oneset.calc_weights_oneset(
+        context["weightcalcdata"],
+        context["weightcalculator"],
+        context["weightcalcdata"].boxes[boxindex],
+        context["startindex"],
+        context["size"],
+        context["newconnectionmatrix"],
+        context["method"],
+        boxindex,
+        store,
+        causevarindex,
+        pair_results,
+    )
+
+
+def schedule_weights(weightcalcdata, contexts, journalheaders, writeoutput):
+    """Determines the work units of all methods and boxes that still need to
+    be analysed.
+
+    Transfer entropy calculations resume from the pair results recorded in
+    the journal of each box if its header matches, other methods start a new
+    journal.
+
+    Returns the (cost, task) tuples of the work units, the pair results and
+    number of pairs outstanding for each causevar in each box, the number of
+    causevars outstanding for each box and the journal of each box.
+
+    """
+
+    tasks = []
+    pending_causevars = {}
+    pending_boxes = {}
+    journals = {}
+    for contextindex, context in enumerate(contexts):
+        cost = gaincalc_oneset.estimate_cost(weightcalcdata, context["method"])
+        for boxindex in weightcalcdata.boxindexes:
+            journal = gaincalc_oneset.journal_filename(
+                context["weightstoredir"], boxindex
+            )
+            journals[contextindex, boxindex] = journal
+            # Only transfer entropy calculations are resumed, other methods
+            # start from scratch
+            if context["method"][:16] == "transfer_entropy":
+                calculated = gaincalc_oneset.read_journal(
+                    journal, journalheaders[contextindex], writeoutput
+                )
+            else:
+                calculated = {}
+                if writeoutput:
+                    gaincalc_oneset.start_journal(
+                        journal, journalheaders[contextindex]
+                    )
+
+            pending_boxes[contextindex, boxindex] = len(
+                weightcalcdata.causevarindexes
+            )
+            for causevarindex in weightcalcdata.causevarindexes:
+                causevar = weightcalcdata.variables[causevarindex]
+                affectedvarindexes = (
+                    gaincalc_oneset.get_pending_affectedvarindexes(
+                        weightcalcdata,
+                        context["newconnectionmatrix"],
+                        calculated,
+                        causevarindex,
+                    )
+                )
+                # Results recorded by an interrupted earlier run
+                pair_results = {
+                    affectedvarindex: calculated[
+                        causevar, weightcalcdata.variables[affectedvarindex]
+                    ]
+                    for affectedvarindex in weightcalcdata.affectedvarindexes
+                    if (causevar, weightcalcdata.variables[affectedvarindex])
+                    in calculated
+                }
+                if pair_results:
+                    print(
+                        "Affected variable results in existence: "
+                        + str(len(pair_results))
+                    )
+                pending_causevars[contextindex, boxindex, causevarindex] = [
+                    pair_results,
+                    len(affectedvarindexes),
+                ]
+                for affectedvarindex in affectedvarindexes:
+                    tasks.append(
+                        (
+                            cost,
+                            (
+                                contextindex,
+                                boxindex,
+                                causevarindex,
+                                affectedvarindex,
+                            ),
+                        )
+                    )
+
+    return tasks, pending_causevars, pending_boxes, journals
+
+
+def calc_weights_methods(
+    weightcalcdata, methods, scenario, writeoutput, pool=None, stores=None
+):
+    """Determines the weights of several methods for all boxes.
+
+    Every pair of every method and box forms a separate work unit. All work
+    units are scheduled together, in order of decreasing estimated cost, and
+    spread over the workers of the pool if provided. Boxes are prepared when
+    their first pair is analysed and released once all of their pairs have
+    been analysed. The result of each pair is appended to the journal of its
+    box as soon as it is available, while the results of each causevar are
+    merged and written to the result store of the method once all of its
+    pairs have been analysed.
+
+    If stores handed over in memory are provided, the result stores are kept
+    open in them for the stages that follow.
+
+    """
+
+    contexts = []
+    for method in methods:
+        logging.info("Method: " + method)
+        contexts.append(
+            setup_weights(weightcalcdata, method, scenario, writeoutput)
+        )
+
+    # Result store of each method
+    methodstores = {}
+    if writeoutput or (stores is not None):
+        for contextindex, context in enumerate(contexts):
+            methodstores[contextindex] = resultstore.open_store(
+                context["weightstoredir"],
+                weightcalcdata.variables,
+                len(weightcalcdata.boxes),
+                weightcalcdata.actual_delays,
+                stores,
+            )
+
+    # Results are only resumed for the same delays, testsize and result
+    # store, as a recreated store no longer holds the results merged so far
+    journalheaders = {
+        contextindex: {
+            "store": (
+                resultstore.get_store_id(methodstores[contextindex])
+                if contextindex in methodstores
+                else None
+            ),
+            "delays": list(weightcalcdata.sample_delays),
+            "testsize": weightcalcdata.testsize,
+        }
+        for contextindex in range(len(contexts))
+    }
+
+    def complete(contextindex, boxindex, causevarindex):
+        pair_results, _ = pending_causevars.pop(
+            (contextindex, boxindex, causevarindex)
+        )
+        finish_weights(
+            contexts[contextindex],
             boxindex,
-            filename,
-            headerline,
-            writeoutput,
-        ]
+            causevarindex,
+            pair_results,
+            methodstores.get(contextindex),
+        )
+        pending_boxes[contextindex, boxindex] -= 1
+        if pending_boxes[contextindex, boxindex] == 0:
+            runner.release_box(contextindex, boxindex)
 
-        # Run the script that will handle multiprocessing
-        gaincalc_oneset.run(non_iter_args, weightcalcdata.do_multiprocessing)
+    runner = gaincalc_oneset.TaskRunner(contexts, prepare_weights, pool)
+    try:
+        (
+            tasks,
+            pending_causevars,
+            pending_boxes,
+            journals,
+        ) = schedule_weights(
+            weightcalcdata, contexts, journalheaders, writeoutput
+        )
 
-        ########################################################
+        # Causevars without any pairs left to analyse
+        for key, (_, remaining) in list(pending_causevars.items()):
+            if remaining == 0:
+                complete(*key)
+
+        for task, result in runner.run_tasks(tasks):
+            contextindex, boxindex, causevarindex, affectedvarindex = task
+            if writeoutput:
+                gaincalc_oneset.append_journal(
+                    journals[contextindex, boxindex],
+                    weightcalcdata.variables[causevarindex],
+                    weightcalcdata.variables[affectedvarindex],
+                    result,
+                )
+            pending = pending_causevars[contextindex, boxindex, causevarindex]
+            pending[0][affectedvarindex] = result
+            pending[1] -= 1
+            if pending[1] == 0:
+                complete(contextindex, boxindex, causevarindex)
+    finally:
+        runner.close()
+        for store in methodstores.values():
+            resultstore.close_store(store, stores)
 
     return None
 
 
+def calc_weights(weightcalcdata, method, scenario, writeoutput, pool=None):
+    """Determines the maximum weight between two variables by searching through
+    a specified set of delays.
+
+    The pairs of all boxes are analysed in parallel by the workers of the
+    pool if provided.
+
+    See setup_weights for the supported methods.
+
+    """
+
+    return calc_weights_methods(
+        weightcalcdata, [method], scenario, writeoutput, pool
+    )
+
+
 def weightcalc(
     mode,
     case,
@@ -705,6 +1199,7 @@ def weightcalc(
     fftcalc=False,
     do_multiprocessing=False,
     use_gpu=False,
+    stores=None,
 ):
     """Reports the maximum weight as well as associated delay
     obtained by shifting the affected variable behind the causal variable a
@@ -729,6 +1224,10 @@ def weightcalc(
             Indicates whether the weight calculation operations should run in
             parallel processing mode where all available CPU cores
             are utilized.
+        stores : resultstore.InMemoryStores, optional
+            Result stores handed over in memory to the stages that follow.
+            The weight data are kept in these stores, and are only written to
+            disk when they are closed if writeoutput is True.
 
     Notes
     -----
@@ -741,21 +1240,44 @@ def weightcalc(
         mode, case, single_entropies, fftcalc, do_multiprocessing, use_gpu
     )
 
-    for scenario in weightcalcdata.scenarios:
-        logging.info("Running scenario {}".format(scenario))
-        # Update scenario-specific fields of weightcalcdata object
-        weightcalcdata.scenariodata(scenario)
-        for settings_name in weightcalcdata.settings_set:
-            weightcalcdata.setsettings(scenario, settings_name)
-            logging.info("Now running settings {}".format(settings_name))
-
-            for method in weightcalcdata.methods:
-                logging.info("Method: " + method)
-
+    # A single pool of workers is used for the whole run
+    if do_multiprocessing:
+        # Only start the JVM in the workers if JIDT is used
+        start_jvm = any(
+            (method[:16] == "transfer_entropy")
+            and (weightcalcdata.backends.get(method, "jidt") == "jidt")
+            for method in weightcalcdata.methods
+        )
+        pool = gaincalc_oneset.create_pool(
+            weightcalcdata.infodynamicsloc, start_jvm
+        )
+    else:
+        pool = None
+
+    try:
+        for scenario in weightcalcdata.scenarios:
+            logging.info("Running scenario {}".format(scenario))
+            # Update scenario-specific fields of weightcalcdata object
+            weightcalcdata.scenariodata(scenario)
+            for settings_name in weightcalcdata.settings_set:
+                weightcalcdata.setsettings(scenario, settings_name)
+                logging.info("Now running settings {}".format(settings_name))
+
+                # All methods are scheduled together
                 start_time = time.clock()
-                calc_weights(weightcalcdata, method, scenario, writeoutput)
+                calc_weights_methods(
+                    weightcalcdata,
+                    weightcalcdata.methods,
+                    scenario,
+                    writeoutput,
+                    pool,
+                    stores,
+                )
                 end_time = time.clock()
                 print(end_time - start_time)
+    finally:
+        if pool is not None:
+            gaincalc_oneset.close_pool(pool)
 
 
 if __name__ == "__main__":
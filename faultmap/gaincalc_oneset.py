@@ -1,37 +1,379 @@
 # -*- coding: utf-8 -*-
 """Calculates weight and auxilliary data for each causevar and writes to files.
 
-All weight data file output writers are now called at this level, making the
-process interruption tolerant up to a single causevar analysis.
+All weight data are written to the result store at this level. The result
+of every pair is appended to a journal of its box as soon as it is available,
+making the process interruption tolerant up to a single pair analysis.
 
 """
 
-import csv
+import json
 import logging
 import os
-from functools import partial
+import pickle
+import queue
+import shutil
+import tempfile
+import uuid
 
 import numpy as np
-import pathos
-from pathos.multiprocessing import ProcessingPool as Pool
+from pathos.helpers import mp
 
+from faultmap import config_setup, gaincalculators, resultstore, transentropy
 
-def writecsv_weightcalc(filename, datalines, header):
-    """CSV writer customized for writing weights."""
+# Directory through which the state shared by the work units of a run is
+# handed to the workers of the pool, see share_state
+_statedir = None
+# States loaded by a worker process, keyed by name
+_states = {}
 
-    with open(filename, "w", newline="") as f:
-        csv.writer(f).writerow(header)
-        csv.writer(f).writerows(datalines)
 
+def init_worker(infodynamicsloc, start_jvm, statedir):
+    """Initialises a worker process of the weight calculation pool.
 
-def readcsv_weightcalc(filename):
-    """CSV reader customized for reading weights."""
+    Starts the JVM once for the lifetime of the worker if any of the
+    weight calculators require JIDT.
 
-    with open(filename) as f:
-        header = next(csv.reader(f))[:]
-        values = np.genfromtxt(f, delimiter=",", dtype=str)
+    """
 
-    return values, header
+    global _statedir
+
+    _statedir = statedir
+
+    if start_jvm:
+        transentropy.check_jvm(infodynamicsloc)
+
+
+def create_pool(infodynamicsloc, start_jvm):
+    """Creates the pool of worker processes used for all weight calculations
+    of a weightcalc run.
+
+    Workers stay alive for all scenarios, settings, methods and boxes, so that
+    interpreter and JVM startup costs are only incurred once per worker.
+    The caller is responsible for shutting down the pool with close_pool.
+
+    """
+
+    global _statedir
+
+    _statedir = tempfile.mkdtemp(prefix="faultmap_")
+
+    return mp.Pool(
+        processes=mp.cpu_count(),
+        initializer=init_worker,
+        initargs=(infodynamicsloc, start_jvm, _statedir),
+    )
+
+
+def close_pool(pool):
+    """Waits for all outstanding work and shuts down the worker pool along
+    with the manager process serving the caches shared by its workers.
+
+    """
+
+    global _statedir
+
+    pool.close()
+    pool.join()
+    gaincalculators.close_cache_manager()
+    shutil.rmtree(_statedir, ignore_errors=True)
+    _statedir = None
+
+
+def share_state(name, state):
+    """Makes state available to the workers of the pool under name.
+
+    The state is written to the state directory once, and loaded by every
+    worker on first use with load_state, rather than sent along with every
+    chunk of work units.
+
+    """
+
+    filename = os.path.join(_statedir, name + ".pkl")
+    with open(filename + ".tmp", "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(filename + ".tmp", filename)
+
+
+def release_state(name):
+    """Removes a state shared with share_state once no work units use it."""
+
+    try:
+        os.remove(os.path.join(_statedir, name + ".pkl"))
+    except FileNotFoundError:
+        pass
+
+
+def load_state(name):
+    """Returns the state shared under name in a worker process, loading it
+    on first use.
+
+    States released by the parent process are dropped whenever a new state
+    is loaded.
+
+    """
+
+    try:
+        return _states[name]
+    except KeyError:
+        pass
+
+    for loaded in list(_states):
+        if not os.path.exists(os.path.join(_statedir, loaded + ".pkl")):
+            del _states[loaded]
+
+    with open(os.path.join(_statedir, name + ".pkl"), "rb") as f:
+        _states[name] = pickle.load(f)
+
+    return _states[name]
+
+
+def journal_filename(weightstoredir, boxindex):
+    """Returns the location of the journal of pair results of a box."""
+
+    journaldir = config_setup.ensure_existence(
+        os.path.join(weightstoredir, "journal"), make=True
+    )
+
+    return os.path.join(journaldir, "box{:03d}.jsonl".format(boxindex + 1))
+
+
+def to_json(value):
+    """Converts values in pair results that are not supported by json."""
+
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+
+    return str(value)
+
+
+def read_journal(journalfile, header, writeoutput=True):
+    """Reads the pair results recorded in a journal.
+
+    The header describes the settings and result store that the results
+    belong to. Results are only read if the journal starts with the same
+    header, otherwise a new journal with this header is started.
+
+    Returns a dictionary of calc_weights_onepair results keyed by
+    (causevar, affectedvar). A record that was only partially written when
+    an earlier run was interrupted is removed from the journal.
+
+    If writeoutput is False, the journal is only read and never modified.
+
+    """
+
+    records = {}
+
+    # Compared in the form it is recorded in
+    header = json.loads(json.dumps(header, default=to_json))
+
+    if os.path.exists(journalfile):
+        with open(journalfile, "rb") as f:
+            firstline = f.readline()
+        if (
+            firstline.endswith(b"\n")
+            and json.loads(firstline).get("header") == header
+        ):
+            with open(journalfile, "r+b" if writeoutput else "rb") as f:
+                end = len(f.readline())
+                for line in f:
+                    # Records are only complete once terminated
+                    if not line.endswith(b"\n"):
+                        break
+                    record = json.loads(line)
+                    records[
+                        record["causevar"], record["affectedvar"]
+                    ] = record["result"]
+                    end += len(line)
+                if writeoutput:
+                    f.truncate(end)
+            return records
+
+    if writeoutput:
+        start_journal(journalfile, header)
+
+    return records
+
+
+def start_journal(journalfile, header):
+    """Starts a new journal with a header, replacing any earlier journal."""
+
+    with open(journalfile, "w") as f:
+        f.write(json.dumps({"header": header}, default=to_json) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def append_journal(journalfile, causevar, affectedvar, result):
+    """Appends the result of a pair to a journal.
+
+    The record is flushed to disk before returning, so that it survives an
+    interruption of the run.
+
+    """
+
+    record = json.dumps(
+        {"causevar": causevar, "affectedvar": affectedvar, "result": result},
+        default=to_json,
+    )
+
+    with open(journalfile, "a") as f:
+        f.write(record + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def calc_weights_onepair(
+    weightcalcdata,
+    weightcalculator,
+    box,
+    startindex,
+    size,
+    method,
+    boxindex,
+    causevarindex,
+    affectedvarindex,
+):
+    """Calculates the weights between a causevar and an affectedvar of a box
+    for all delays, including the significance tests of the report.
+
+    Returns a dictionary with the weights, mutual information (transfer
+    entropy methods only) and significance thresholds over all delays, as
+    well as the auxiliary data rows of the report. All except the auxiliary
+    data contain a directional and absolute list for methods with
+    twodimensional weights.
+
+    """
+
+    causevar = weightcalcdata.variables[causevarindex]
+    affectedvar = weightcalcdata.variables[affectedvarindex]
+
+    weightlist = []
+    directional_weightlist = []
+    absolute_weightlist = []
+    sigthreshlist = []
+    directional_sigthreshlist = []
+    absolute_sigthreshlist = []
+    sigfwd_list = []
+    sigbwd_list = []
+    propfwd_list = []
+    propbwd_list = []
+    mifwd_list = []
+    mibwd_list = []
+
+    for delay_index, delay in enumerate(weightcalcdata.sample_delays):
+        logging.info("Now testing delay: " + str(delay))
+
+        causevardata = box[:, causevarindex][startindex : startindex + size]
+
+        affectedvardata = box[:, affectedvarindex][
+            startindex + delay : startindex + size + delay
+        ]
+
+        weight, auxdata = weightcalculator.calcweight(
+            causevardata,
+            affectedvardata,
+            weightcalcdata,
+            causevarindex,
+            affectedvarindex,
+            delay_index,
+        )
+
+        # Calculate significance thresholds at each data point
+        if weightcalcdata.allthresh:
+            sigthreshold = weightcalculator.calcsigthresh(
+                weightcalcdata, affectedvar, causevar, box, delay
+            )
+
+        if len(weight) > 1:
+            # If weight contains directional as well as
+            # absolute weights, write to separate lists
+            directional_weightlist.append(weight[0])
+            absolute_weightlist.append(weight[1])
+            # Same approach with significance thresholds
+            if weightcalcdata.allthresh:
+                directional_sigthreshlist.append(sigthreshold[0])
+                absolute_sigthreshlist.append(sigthreshold[1])
+
+        else:
+            weightlist.append(weight[0])
+            if weightcalcdata.allthresh:
+                sigthreshlist.append(sigthreshold[0])
+
+        if auxdata is not None:
+            if len(auxdata) > 1:
+                # This means we have auxdata for both the forward and
+                # backward calculation
+                [auxdata_fwd, auxdata_bwd] = auxdata
+                [
+                    significance_fwd,
+                    properties_fwd,
+                    mi_fwd,
+                ] = auxdata_fwd  # mi_fwd and mi_bwd should be the same
+                [
+                    significance_bwd,
+                    properties_bwd,
+                    mi_bwd,
+                ] = auxdata_bwd
+                sigfwd_list.append(significance_fwd)
+                sigbwd_list.append(significance_bwd)
+                propfwd_list.append(properties_fwd)
+                propbwd_list.append(properties_bwd)
+                mifwd_list.append(mi_fwd)
+                mibwd_list.append(mi_bwd)
+
+    if len(weight) > 1:
+        proplist = [propfwd_list, propbwd_list]
+        milist = [mifwd_list, mibwd_list]
+        weightlist = [directional_weightlist, absolute_weightlist]
+        sigthreshlist = [directional_sigthreshlist, absolute_sigthreshlist]
+    else:
+        proplist = None
+        milist = None
+
+    # Generate report according to each method
+    if proplist is None:
+        auxdata = weightcalculator.report(
+            weightcalcdata,
+            causevarindex,
+            affectedvarindex,
+            weightlist,
+            box,
+            proplist,
+        )
+    else:
+        auxdata = weightcalculator.report(
+            weightcalcdata,
+            causevarindex,
+            affectedvarindex,
+            weightlist,
+            box,
+            proplist,
+            milist,
+        )
+
+    # Only JIDT estimates transfer observations, and as pairs are analysed
+    # by different worker processes, the totals are reported per pair
+    if (method[:16] == "transfer_entropy") and (
+        weightcalculator.backend == "jidt"
+    ):
+        logging.info(
+            "Observations transferred to JIDT by this process: "
+            + str(transentropy.marshalling_stats["arrays"])
+            + " arrays, "
+            + str(transentropy.marshalling_stats["bytes"])
+            + " bytes, of which "
+            + str(transentropy.marshalling_stats["copied_bytes"])
+            + " bytes had to be made contiguous first"
+        )
+
+    return {
+        "twodimensions": len(weight) > 1,
+        "weightlist": weightlist,
+        "milist": milist,
+        "sigthreshlist": sigthreshlist,
+        "auxdata": auxdata,
+    }
 
 
 def calc_weights_oneset(
@@ -43,11 +385,19 @@ def calc_weights_oneset(
     newconnectionmatrix,
     method,
     boxindex,
-    filename,
-    headerline,
-    writeoutput,
+    store,
     causevarindex,
+    pair_results=None,
 ):
+    """Calculates the weights between a causevar and all affectedvars of a
+    box and writes the results to the result store, if provided.
+
+    Results of pairs that have already been calculated elsewhere can be
+    provided in pair_results, a dictionary of calc_weights_onepair results
+    keyed by affectedvarindex. The results of the causevar are written once,
+    after the results of all pairs are available.
+
+    """
 
     causevar = weightcalcdata.variables[causevarindex]
 
@@ -67,82 +417,37 @@ def calc_weights_oneset(
 
     mis_directional_name = "mis_directional"
     mis_absolute_name = "mis_absolute"
-    mis_neutral_name = "mis"
 
     auxdirectional_name = "auxdata_directional"
     auxabsolute_name = "auxdata_absolute"
     auxneutral_name = "auxdata"
 
     # Provide names for the significance threshold file types
-    if weightcalcdata.allthresh:
-        sig_directional_name = "sigthresh_directional"
-        sig_absolute_name = "sigthresh_absolute"
-        sig_neutral_name = "sigthresh"
-
-    # Initiate datalines with delays
-    datalines_directional = np.asarray(weightcalcdata.actual_delays)
-    datalines_directional = datalines_directional[:, np.newaxis]
-    datalines_absolute = datalines_directional.copy()
-    datalines_neutral = datalines_directional.copy()
-
-    # Datalines needed to store mutual information
-    mis_datalines_directional = datalines_directional.copy()
-    mis_datalines_absolute = datalines_directional.copy()
-    mis_datalines_neutral = datalines_directional.copy()
-
-    # Datalines needed to store significance threshold values
-    # for each variable combination
-    datalines_sigthresh_directional = datalines_directional.copy()
-    datalines_sigthresh_absolute = datalines_directional.copy()
-    datalines_sigthresh_neutral = datalines_directional.copy()
-
-    # Initiate empty auxdata lists
-    auxdata_directional = []
-    auxdata_absolute = []
-    auxdata_neutral = []
-
-    if method[:16] == "transfer_entropy":
-        if os.path.exists(
-            filename(auxdirectional_name, boxindex + 1, causevar)
-        ):
-            auxdata_directional = list(
-                np.genfromtxt(
-                    filename(auxdirectional_name, boxindex + 1, causevar),
-                    delimiter=",",
-                    dtype=str,
-                )[1:, :]
-            )
-            auxdata_absolute = list(
-                np.genfromtxt(
-                    filename(auxdirectional_name, boxindex + 1, causevar),
-                    delimiter=",",
-                    dtype=str,
-                )[1:, :]
-            )
-
-            datalines_directional, _ = readcsv_weightcalc(
-                filename(directional_name, boxindex + 1, causevar)
-            )
-
-            datalines_absolute, _ = readcsv_weightcalc(
-                filename(absolute_name, boxindex + 1, causevar)
-            )
-
-            mis_datalines_directional, _ = readcsv_weightcalc(
-                filename(mis_directional_name, boxindex + 1, causevar)
-            )
-
-            mis_datalines_absolute, _ = readcsv_weightcalc(
-                filename(mis_absolute_name, boxindex + 1, causevar)
-            )
-
-            if weightcalcdata.allthresh:
-                datalines_sigthresh_directional = readcsv_weightcalc(
-                    filename(sig_directional_name, boxindex + 1, causevar)
-                )
-                datalines_sigthresh_absolute = readcsv_weightcalc(
-                    filename(sig_absolute_name, boxindex + 1, causevar)
-                )
+    sig_directional_name = "sigthresh_directional"
+    sig_absolute_name = "sigthresh_absolute"
+    sig_neutral_name = "sigthresh"
+
+    # Collect the values over all delays of each data type for all
+    # affectedvars, keyed by affectedvarindex
+    columns = {
+        directional_name: {},
+        absolute_name: {},
+        neutral_name: {},
+        mis_directional_name: {},
+        mis_absolute_name: {},
+        sig_directional_name: {},
+        sig_absolute_name: {},
+        sig_neutral_name: {},
+    }
+
+    # Initiate empty auxdata dictionaries
+    auxdata = {
+        auxdirectional_name: {},
+        auxabsolute_name: {},
+        auxneutral_name: {},
+    }
+
+    twodimensions = None
 
     for affectedvarindex in weightcalcdata.affectedvarindexes:
         affectedvar = weightcalcdata.variables[affectedvarindex]
@@ -156,380 +461,353 @@ def calc_weights_oneset(
             + str(boxindex + 1)
         )
 
-        exists = False
-        do_test = not (
-            newconnectionmatrix[affectedvarindex, causevarindex] == 0
-        )
-        # Test if the affectedvar has already been calculated
-        if (method[:16] == "transfer_entropy") and do_test:
-            testlocation = filename(
-                auxdirectional_name, boxindex + 1, causevar
+        if newconnectionmatrix[affectedvarindex, causevarindex] == 0:
+            continue
+
+        if pair_results is not None:
+            pair_result = pair_results[affectedvarindex]
+        else:
+            pair_result = calc_weights_onepair(
+                weightcalcdata,
+                weightcalculator,
+                box,
+                startindex,
+                size,
+                method,
+                boxindex,
+                causevarindex,
+                affectedvarindex,
             )
-            if os.path.exists(testlocation):
-                # Open CSV file and read names of second affected vars
-                auxdatafile = np.genfromtxt(
-                    testlocation,
-                    delimiter=",",
-                    usecols=np.arange(0, 2),
-                    dtype=str,
-                )
-                affectedvars = auxdatafile[:, 1]
-                if affectedvar in affectedvars:
-                    print("Affected variable results in existence")
-                    exists = True
-
-        if do_test and (exists is False):
-            weightlist = []
-            directional_weightlist = []
-            absolute_weightlist = []
-            sigthreshlist = []
-            directional_sigthreshlist = []
-            absolute_sigthreshlist = []
-            sigfwd_list = []
-            sigbwd_list = []
-            propfwd_list = []
-            propbwd_list = []
-            mifwd_list = []
-            mibwd_list = []
-
-            for delay in weightcalcdata.sample_delays:
-                logging.info("Now testing delay: " + str(delay))
-
-                causevardata = box[:, causevarindex][
-                    startindex : startindex + size
-                ]
-
-                affectedvardata = box[:, affectedvarindex][
-                    startindex + delay : startindex + size + delay
-                ]
-
-                weight, auxdata = weightcalculator.calcweight(
-                    causevardata,
-                    affectedvardata,
-                    weightcalcdata,
-                    causevarindex,
-                    affectedvarindex,
-                )
 
-                # Calculate significance thresholds at each data point
-                if weightcalcdata.allthresh:
-                    sigthreshold = weightcalculator.calcsigthresh(
-                        weightcalcdata, affectedvar, causevar, box, delay
-                    )
-
-                if len(weight) > 1:
-                    # If weight contains directional as well as
-                    # absolute weights, write to separate lists
-                    directional_weightlist.append(weight[0])
-                    absolute_weightlist.append(weight[1])
-                    # Same approach with significance thresholds
-                    if weightcalcdata.allthresh:
-                        directional_sigthreshlist.append(sigthreshold[0])
-                        absolute_sigthreshlist.append(sigthreshold[1])
-
-                else:
-                    weightlist.append(weight[0])
-                    if weightcalcdata.allthresh:
-                        sigthreshlist.append(sigthreshold[0])
-
-                if auxdata is not None:
-                    if len(auxdata) > 1:
-                        # This means we have auxdata for both the forward and
-                        # backward calculation
-                        [auxdata_fwd, auxdata_bwd] = auxdata
-                        [
-                            significance_fwd,
-                            properties_fwd,
-                            mi_fwd,
-                        ] = auxdata_fwd  # mi_fwd and mi_bwd should be the same
-                        [
-                            significance_bwd,
-                            properties_bwd,
-                            mi_bwd,
-                        ] = auxdata_bwd
-                        sigfwd_list.append(significance_fwd)
-                        sigbwd_list.append(significance_bwd)
-                        propfwd_list.append(properties_fwd)
-                        propbwd_list.append(properties_bwd)
-                        mifwd_list.append(mi_fwd)
-                        mibwd_list.append(mi_bwd)
-
-            if len(weight) > 1:
-
-                twodimensions = True
-
-                proplist = [propfwd_list, propbwd_list]
-                milist = [mifwd_list, mibwd_list]
-                siglist = [sigfwd_list, sigbwd_list]
-                weightlist = [directional_weightlist, absolute_weightlist]
-
-                # Combine weight data
-                weights_thisvar_directional = np.asarray(weightlist[0])
-                weights_thisvar_directional = weights_thisvar_directional[
-                    :, np.newaxis
-                ]
-
-                mis_thisvar_directional = np.asarray(milist[0])
-                mis_thisvar_directional = mis_thisvar_directional[
-                    :, np.newaxis
-                ]
-
-                datalines_directional = np.concatenate(
-                    (datalines_directional, weights_thisvar_directional),
-                    axis=1,
-                )
+        weightlist = pair_result["weightlist"]
+        milist = pair_result["milist"]
+        sigthreshlist = pair_result["sigthreshlist"]
+        twodimensions = pair_result["twodimensions"]
 
-                mis_datalines_directional = np.concatenate(
-                    (mis_datalines_directional, mis_thisvar_directional),
-                    axis=1,
-                )
+        if twodimensions:
+            columns[directional_name][affectedvarindex] = weightlist[0]
+            columns[absolute_name][affectedvarindex] = weightlist[1]
+            columns[mis_directional_name][affectedvarindex] = milist[0]
+            columns[mis_absolute_name][affectedvarindex] = milist[1]
 
-                weights_thisvar_absolute = np.asarray(weightlist[1])
-                weights_thisvar_absolute = weights_thisvar_absolute[
-                    :, np.newaxis
-                ]
+            (
+                auxdata[auxdirectional_name][affectedvarindex],
+                auxdata[auxabsolute_name][affectedvarindex],
+            ) = pair_result["auxdata"]
 
-                mis_thisvar_absolute = np.asarray(milist[1])
-                mis_thisvar_absolute = mis_thisvar_absolute[:, np.newaxis]
+            if weightcalcdata.allthresh:
+                sigthresh_directional, sigthresh_absolute = sigthreshlist
+                columns[sig_directional_name][
+                    affectedvarindex
+                ] = sigthresh_directional
+                columns[sig_absolute_name][
+                    affectedvarindex
+                ] = sigthresh_absolute
+
+        else:
+            columns[neutral_name][affectedvarindex] = weightlist
+            auxdata[auxneutral_name][affectedvarindex] = pair_result["auxdata"]
 
-                datalines_absolute = np.concatenate(
-                    (datalines_absolute, weights_thisvar_absolute), axis=1
-                )
+            if weightcalcdata.allthresh:
+                columns[sig_neutral_name][affectedvarindex] = sigthreshlist
+
+    # Nothing is written if none of the affectedvars have been tested
+    if (twodimensions is not None) and (store is not None):
+        if twodimensions:
+            datanames = [
+                directional_name,
+                absolute_name,
+                mis_directional_name,
+                mis_absolute_name,
+            ]
+            auxnames = [auxdirectional_name, auxabsolute_name]
+            if weightcalcdata.allthresh:
+                datanames += [sig_directional_name, sig_absolute_name]
+        else:
+            datanames = [neutral_name]
+            auxnames = [auxneutral_name]
+            if weightcalcdata.allthresh:
+                datanames.append(sig_neutral_name)
 
-                mis_datalines_absolute = np.concatenate(
-                    (mis_datalines_absolute, mis_thisvar_absolute), axis=1
-                )
+        for dataname in datanames:
+            resultstore.write_weights(
+                store, dataname, boxindex, causevarindex, columns[dataname]
+            )
 
-                # Write all the auxiliary weight data
-                # Generate and store report files according to each method
-                (
-                    auxdata_thisvar_directional,
-                    auxdata_thisvar_absolute,
-                ) = weightcalculator.report(
-                    weightcalcdata,
-                    causevarindex,
-                    affectedvarindex,
-                    weightlist,
-                    box,
-                    proplist,
-                    milist,
-                )
+        for auxname in auxnames:
+            resultstore.write_auxdata(
+                store,
+                auxname,
+                weightcalculator.data_header,
+                boxindex,
+                causevarindex,
+                auxdata[auxname],
+            )
 
-                auxdata_directional.append(auxdata_thisvar_directional)
-                auxdata_absolute.append(auxdata_thisvar_absolute)
-
-                # Do the same for the significance threshold
-                if weightcalcdata.allthresh:
-                    sigthreshlist = [
-                        directional_sigthreshlist,
-                        absolute_sigthreshlist,
-                    ]
-
-                    sigthresh_thisvar_directional = np.asarray(
-                        sigthreshlist[0]
-                    )
-                    sigthresh_thisvar_directional = sigthresh_thisvar_directional[
-                        :, np.newaxis
-                    ]
-
-                    datalines_sigthresh_directional = np.concatenate(
-                        (
-                            datalines_sigthresh_directional,
-                            sigthresh_thisvar_directional,
-                        ),
-                        axis=1,
-                    )
-
-                    sigthresh_thisvar_absolute = np.asarray(sigthreshlist[1])
-                    sigthresh_thisvar_absolute = sigthresh_thisvar_absolute[
-                        :, np.newaxis
-                    ]
-
-                    datalines_sigthresh_absolute = np.concatenate(
-                        (
-                            datalines_sigthresh_absolute,
-                            sigthresh_thisvar_absolute,
-                        ),
-                        axis=1,
-                    )
-
-            else:
-
-                twodimensions = False
-
-                weights_thisvar_neutral = np.asarray(weightlist)
-                weights_thisvar_neutral = weights_thisvar_neutral[
-                    :, np.newaxis
-                ]
-
-                datalines_neutral = np.concatenate(
-                    (datalines_neutral, weights_thisvar_neutral), axis=1
-                )
+        # Written to disk for every causevar, so that the store can still
+        # be opened to resume from the journals if the run is interrupted
+        store.flush()
 
-                # Write all the auxilliary weight data
-                # Generate and store report files according to each method
-                proplist = None
-
-                auxdata_thisvar_neutral = weightcalculator.report(
-                    weightcalcdata,
-                    causevarindex,
-                    affectedvarindex,
-                    weightlist,
-                    box,
-                    proplist,
-                )
+    print(
+        "Done analysing causal variable: "
+        + causevar
+        + " ["
+        + str(causevarindex + 1)
+        + "/"
+        + str(len(weightcalcdata.causevarindexes))
+        + "]"
+    )
 
-                auxdata_neutral.append(auxdata_thisvar_neutral)
+    return None
 
-                # Write the significance thresholds to file
-                if weightcalcdata.allthresh:
-                    sigthresh_thisvar_neutral = np.asarray(sigthreshlist)
-                    sigthresh_thisvar_neutral = sigthresh_thisvar_neutral[
-                        :, np.newaxis
-                    ]
 
-                    datalines_sigthresh_neutral = np.concatenate(
-                        (
-                            datalines_sigthresh_neutral,
-                            sigthresh_thisvar_neutral,
-                        ),
-                        axis=1,
-                    )
+def get_pending_affectedvarindexes(
+    weightcalcdata, newconnectionmatrix, calculated, causevarindex
+):
+    """Returns the indexes of the affectedvars of causevar in a box that
+    still need to be analysed.
 
-        if (
-            not (newconnectionmatrix[affectedvarindex, causevarindex] == 0)
-            and (exists is False)
-            and (writeoutput is True)
-        ):
+    Pairs without a connection, or with results already recorded by an
+    interrupted earlier run, are skipped. calculated holds the
+    (causevar, affectedvar) name tuples of the recorded results, as returned
+    by read_journal.
 
-            if twodimensions:
-                writecsv_weightcalc(
-                    filename(directional_name, boxindex + 1, causevar),
-                    datalines_directional,
-                    headerline,
-                )
+    """
 
-                writecsv_weightcalc(
-                    filename(absolute_name, boxindex + 1, causevar),
-                    datalines_absolute,
-                    headerline,
-                )
+    causevar = weightcalcdata.variables[causevarindex]
 
-                # Write mutual information over multiple delays to file just as for transfer entropy
-                writecsv_weightcalc(
-                    filename(mis_directional_name, boxindex + 1, causevar),
-                    mis_datalines_directional,
-                    headerline,
-                )
+    return [
+        affectedvarindex
+        for affectedvarindex in weightcalcdata.affectedvarindexes
+        if newconnectionmatrix[affectedvarindex, causevarindex] != 0
+        and (causevar, weightcalcdata.variables[affectedvarindex])
+        not in calculated
+    ]
 
-                writecsv_weightcalc(
-                    filename(mis_absolute_name, boxindex + 1, causevar),
-                    mis_datalines_absolute,
-                    headerline,
-                )
 
-                writecsv_weightcalc(
-                    filename(auxdirectional_name, boxindex + 1, causevar),
-                    auxdata_directional,
-                    weightcalculator.data_header,
-                )
+# Relative cost of estimating a single weight per delay and sample
+METHOD_COSTS = {
+    "cross_correlation": 1,
+    "partial_correlation": 1,
+    "transfer_entropy_discrete": 10,
+    "transfer_entropy_kernel": 1000,
+    "transfer_entropy_kraskov": 1000,
+}
 
-                writecsv_weightcalc(
-                    filename(auxabsolute_name, boxindex + 1, causevar),
-                    auxdata_absolute,
-                    weightcalculator.data_header,
-                )
 
-                if weightcalcdata.allthresh:
-                    writecsv_weightcalc(
-                        filename(sig_directional_name, boxindex + 1, causevar),
-                        datalines_sigthresh_directional,
-                        headerline,
-                    )
-
-                    writecsv_weightcalc(
-                        filename(sig_absolute_name, boxindex + 1, causevar),
-                        datalines_sigthresh_absolute,
-                        headerline,
-                    )
-
-            else:
-                writecsv_weightcalc(
-                    filename(neutral_name, boxindex + 1, causevar),
-                    datalines_neutral,
-                    headerline,
-                )
+def estimate_cost(weightcalcdata, method):
+    """Estimates the relative cost of analysing a single pair with a method
+    for the current settings.
 
-                writecsv_weightcalc(
-                    filename(auxneutral_name, boxindex + 1, causevar),
-                    auxdata_neutral,
-                    weightcalculator.data_header,
-                )
+    Only used to order work units, so the values are only meaningful relative
+    to each other.
 
-                if weightcalcdata.allthresh:
-                    writecsv_weightcalc(
-                        filename(sig_neutral_name, boxindex + 1, causevar),
-                        datalines_sigthresh_neutral,
-                        headerline,
-                    )
+    """
 
-    print(
-        "Done analysing causal variable: "
-        + causevar
-        + " ["
-        + str(causevarindex + 1)
-        + "/"
-        + str(len(weightcalcdata.causevarindexes))
-        + "]"
+    cost = (
+        len(weightcalcdata.sample_delays)
+        * weightcalcdata.testsize
+        * METHOD_COSTS.get(method, 1)
     )
 
-    return None
+    # Auto-embedding searches over embeddings of both signals of each
+    # estimate
+    if (method == "transfer_entropy_kraskov") and (
+        weightcalcdata.additional_parameters.get("auto_embed", False)
+    ):
+        cost *= 10
 
+    # Significance testing requires estimates on surrogate data as well
+    if weightcalcdata.sigtest:
+        cost *= 2
 
-def run(non_iter_args, do_multiprocessing):
-    [
-        weightcalcdata,
-        weightcalculator,
-        box,
-        startindex,
-        size,
-        newconnectionmatrix,
-        method,
-        boxindex,
-        filename,
-        headerline,
-        writeoutput,
-    ] = non_iter_args
-
-    partial_gaincalc_oneset = partial(
-        calc_weights_oneset,
-        weightcalcdata,
+    return cost
+
+
+def run_pair_task(contexts, weightcalculator, task):
+    """Analyses a single (method, box, causevar, affectedvar) work unit.
+
+    The task holds the index of the method context in contexts, which
+    contains the data shared by all work units of the method as prepared by
+    gaincalc.setup_weights, and weightcalculator is prepared for the box of
+    the task.
+
+    Returns the task along with the calc_weights_onepair result.
+
+    """
+
+    contextindex, boxindex, causevarindex, affectedvarindex = task
+    context = contexts[contextindex]
+
+    result = calc_weights_onepair(
+        context["weightcalcdata"],
         weightcalculator,
-        box,
-        startindex,
-        size,
-        newconnectionmatrix,
-        method,
+        context["weightcalcdata"].boxes[boxindex],
+        context["startindex"],
+        context["size"],
+        context["method"],
         boxindex,
-        filename,
-        headerline,
-        writeoutput,
+        causevarindex,
+        affectedvarindex,
     )
 
-    if do_multiprocessing:
-        pool = Pool(processes=pathos.multiprocessing.cpu_count())
-        pool.map(partial_gaincalc_oneset, weightcalcdata.causevarindexes)
+    return task, result
 
-        # Current solution to no close and join methods on ProcessingPool
-        # https://github.com/uqfoundation/pathos/issues/46
 
-        s = pathos.multiprocessing.__STATE["pool"]
-        s.close()
-        s.join()
-        pathos.multiprocessing.__STATE["pool"] = None
+def run_shared_tasks(run, chunk):
+    """Analyses a chunk of work units in a worker process, using the state
+    shared by the parent process for the run and the boxes of the tasks.
 
-    else:
-        for causevarindex in weightcalcdata.causevarindexes:
-            partial_gaincalc_oneset(causevarindex)
+    Returns a list of the run_pair_task results.
 
-    return None
+    """
+
+    contexts = load_state(run)
+
+    return [
+        run_pair_task(
+            contexts, load_state(box_state_name(run, task[0], task[1])), task
+        )
+        for task in chunk
+    ]
+
+
+def box_state_name(run, contextindex, boxindex):
+    return "{}_{}_{}".format(run, contextindex, boxindex)
+
+
+class TaskRunner(object):
+    """Runs the work units of all methods and boxes of a run, either
+    sequentially or spread over the workers of a pool.
+
+    The method contexts shared by all work units are handed to every worker
+    once per run, and the weight calculator of a box once per worker that
+    analyses any of its pairs, see share_state. Only the indexes of the work
+    units are sent with every chunk.
+
+    Boxes are prepared with prepare(context, boxindex) when their first work
+    unit is dispatched, and have to be released with release_box once all of
+    their pairs have been analysed, so that only the boxes in flight hold
+    box level data.
+
+    """
+
+    def __init__(self, contexts, prepare, pool=None):
+        self.contexts = contexts
+        self.prepare = prepare
+        self.pool = pool
+        self.calculators = {}
+        self.run = "run{}".format(uuid.uuid4().hex)
+
+        if self.pool is not None:
+            share_state(self.run, self.contexts)
+
+    def get_calculator(self, contextindex, boxindex):
+        """Returns the weight calculator of a box, preparing it first if
+        required.
+
+        """
+
+        key = (contextindex, boxindex)
+        if key not in self.calculators:
+            self.calculators[key] = self.prepare(
+                self.contexts[contextindex], boxindex
+            )
+            if self.pool is not None:
+                share_state(
+                    box_state_name(self.run, *key), self.calculators[key]
+                )
+
+        return self.calculators[key]
+
+    def release_box(self, contextindex, boxindex):
+        """Releases the box specific data of a box that has been prepared."""
+
+        weightcalculator = self.calculators.pop((contextindex, boxindex), None)
+        if weightcalculator is None:
+            return
+
+        weightcalculator.finish_box()
+        if self.pool is not None:
+            release_state(box_state_name(self.run, contextindex, boxindex))
+
+    def close(self):
+        """Releases all boxes still prepared and the state of the run."""
+
+        for key in list(self.calculators):
+            self.release_box(*key)
+        if self.pool is not None:
+            release_state(self.run)
+
+    def run_tasks(self, tasks):
+        """Analyses work units in order of decreasing estimated cost, so that
+        the longest work units do not hold up the end of the run.
+
+        tasks is a list of (cost, task) tuples, with the tasks as expected by
+        run_pair_task.
+
+        Returns an iterator over the (task, result) tuples in order of
+        completion.
+
+        """
+
+        # Sorting is stable, so equally expensive tasks keep their order,
+        # which analyses the boxes of a method one after the other
+        ordered = [
+            task for _, task in sorted(tasks, key=lambda item: -item[0])
+        ]
+
+        if self.pool is None:
+            for task in ordered:
+                yield run_pair_task(
+                    self.contexts, self.get_calculator(*task[:2]), task
+                )
+            return
+
+        # Chunks are small enough for the chunks in flight to cover about two
+        # boxes, while several chunks per worker balance the load
+        processes = mp.cpu_count()
+        boxes = len(set(task[:2] for task in ordered))
+        chunksize = max(
+            1,
+            min(
+                len(ordered) // (4 * processes),
+                len(ordered) // (max(1, boxes) * processes),
+            ),
+        )
+        chunks = iter(
+            [
+                ordered[start : start + chunksize]
+                for start in range(0, len(ordered), chunksize)
+            ]
+        )
+
+        # Results and errors of the chunks in order of completion
+        results = queue.Queue()
+
+        def submit():
+            chunk = next(chunks, None)
+            if chunk is None:
+                return 0
+            for contextindex, boxindex, _, _ in chunk:
+                self.get_calculator(contextindex, boxindex)
+            self.pool.apply_async(
+                run_shared_tasks,
+                (self.run, chunk),
+                callback=results.put,
+                error_callback=results.put,
+            )
+            return 1
+
+        inflight = 0
+        for _ in range(2 * processes):
+            inflight += submit()
+
+        while inflight:
+            chunkresults = results.get()
+            inflight -= 1
+            if isinstance(chunkresults, BaseException):
+                raise chunkresults
+            inflight += submit()
+            for taskresult in chunkresults:
+                yield taskresult
@@ -5,10 +5,97 @@ used by the gaincalc module.
 """
 # Standard libraries
 import logging
+import os
 
 import numpy as np
+from pathos.helpers import mp
 
-from faultmap import data_processing, transentropy
+from faultmap import data_processing, ksg, transentropy
+
+# Manager process serving the caches shared among worker processes
+# Created on first use only and shut down with close_cache_manager
+_manager = None
+
+
+def create_cache(do_multiprocessing):
+    """Creates a dictionary that can be used as a cache by all causevar
+    tasks of a box.
+
+    If multiprocessing is used, the dictionary is served by a manager process
+    so that all worker processes read from and write to the same cache.
+
+    """
+
+    global _manager
+
+    if not do_multiprocessing:
+        return {}
+
+    if _manager is None:
+        _manager = mp.Manager()
+
+    return _manager.dict()
+
+
+def close_cache_manager():
+    """Shuts down the manager process serving the shared caches, if any.
+
+    All caches created with multiprocessing become unusable afterwards.
+
+    """
+
+    global _manager
+
+    if _manager is not None:
+        _manager.shutdown()
+        _manager = None
+
+
+class SurrogateBank(object):
+    """Stores the surrogates of the causal data of every causevar for the
+    box currently being analysed.
+
+    The surrogates only depend on the causal data, which is the same for all
+    affected variables and delays, so they are generated once per causevar
+    and reused by all significance threshold calculations of the box.
+
+    Surrogates are drawn from a random generator seeded with the box and
+    causevar indexes, so that the same surrogates are used no matter which
+    worker process analyses a pair, or how many times they are generated.
+
+    """
+
+    def __init__(self, surr_method, boxindex=None):
+        self.surr_method = surr_method
+        self.seed = [] if boxindex is None else [boxindex]
+        self.surrogates = {}
+
+    def get(self, weightcalcdata, causevar, box, trials):
+        """Returns an array of shape (trials, testsize) containing surrogates
+        of the causal data of causevar.
+
+        Surrogates are only generated if fewer than trials are stored. The
+        first surrogates do not depend on the number of trials.
+
+        """
+
+        surrogates = self.surrogates.get(causevar)
+
+        if (surrogates is None) or (len(surrogates) < trials):
+            causevarindex = weightcalcdata.variables.index(causevar)
+            causevardata = box[:, causevarindex][
+                weightcalcdata.startindex : weightcalcdata.startindex
+                + weightcalcdata.testsize
+            ]
+            surrogates = data_processing.gen_surrogates(
+                causevardata,
+                self.surr_method,
+                trials,
+                np.random.default_rng(self.seed + [causevarindex]),
+            )
+            self.surrogates[causevar] = surrogates
+
+        return surrogates[:trials]
 
 
 class CorrWeightcalc(object):
@@ -52,13 +139,286 @@ class CorrWeightcalc(object):
         if weightcalcdata.sigtest:
             self.thresh_method = weightcalcdata.thresh_method
             self.surr_method = weightcalcdata.surr_method
+            self.surrogate_bank = SurrogateBank(self.surr_method)
+
+        # Covariance tensor of the box currently being analysed, indexed as
+        # [delay_index, causevarindex, affectedvarindex]
+        self.corr_tensor = None
+
+        # Covariance tensors of all boxes calculated at once from sums over
+        # the full data set, shared by the calculators of the boxes and
+        # released as each box is prepared
+        if weightcalcdata.sliding_correlation:
+            self.box_corr_tensors = {}
+        else:
+            self.box_corr_tensors = None
+
+    @staticmethod
+    def calc_covariance_tensor(box, startindex, size, sample_delays):
+        """Calculates the covariance between every pair of variables in a box
+        for all delays in a single batched pass.
+
+        The causal data window is fixed while the affected data window is
+        shifted by each delay, exactly as done for individual pairs in
+        calc_weights_oneset.
+
+        Parameters
+        ----------
+            box : numpy.ndarray
+                Samples by variables array of the box under investigation.
+            startindex : int
+                Index of the first sample of the causal data window.
+            size : int
+                Number of samples in each data window.
+            sample_delays : list of int
+                Delays to evaluate in number of samples.
+
+        Returns
+        -------
+            cov_tensor : numpy.ndarray
+                Array of shape (delays, variables, variables) where entry
+                [d, i, j] is the covariance between variable i and variable j
+                shifted by sample_delays[d].
+
+        """
+
+        return CorrWeightcalc.calc_lagged_covariances(
+            box[startindex : startindex + size, :],
+            box,
+            startindex,
+            sample_delays,
+        )
+
+    @staticmethod
+    def calc_lagged_covariances(
+        causaldata, affecteddata, startindex, sample_delays
+    ):
+        """Calculates the covariance between a set of causal data windows and
+        a set of affected data series shifted by each delay.
+
+        Parameters
+        ----------
+            causaldata : numpy.ndarray
+                Samples by signals array of causal data windows.
+            affecteddata : numpy.ndarray
+                Samples by signals array of full affected data series.
+            startindex : int
+                Index in the affected data series that corresponds to the
+                first sample of the causal data windows.
+            sample_delays : list of int
+                Delays to evaluate in number of samples.
+
+        Returns
+        -------
+            cov_tensor : numpy.ndarray
+                Array of shape (delays, causal signals, affected signals).
+
+        """
+
+        size = causaldata.shape[0]
+
+        causaldata = causaldata - causaldata.mean(axis=0)
+
+        cov_tensor = np.zeros(
+            (len(sample_delays), causaldata.shape[1], affecteddata.shape[1])
+        )
 
-    def calcweight(self, causevardata, affectedvardata, *_):
+        for delay_index, delay in enumerate(sample_delays):
+            shifteddata = affecteddata[
+                startindex + delay : startindex + size + delay, :
+            ]
+            shifteddata = shifteddata - shifteddata.mean(axis=0)
+            # Same unbiased normalisation as np.cov
+            cov_tensor[delay_index] = np.dot(causaldata.T, shifteddata) / (
+                size - 1
+            )
+
+        return cov_tensor
+
+    @staticmethod
+    def calc_sliding_covariances(data, windowstarts, size, sample_delays):
+        """Calculates the covariance tensors of many data windows of the
+        same size from sums over the full data set.
+
+        The lagged cross-products of the data are summed once between
+        consecutive window boundaries. The sums over each window, and from
+        these its covariances, then follow from the differences of their
+        cumulative sums at the window boundaries. Overlapping windows
+        therefore cost about as much as a single pass over the data, rather
+        than a pass per window.
+
+        Parameters
+        ----------
+            data : numpy.ndarray
+                Samples by variables array of the full data set.
+            windowstarts : list of int
+                Index of the first sample of the causal data window of each
+                box in data.
+            size : int
+                Number of samples in each data window.
+            sample_delays : list of int
+                Delays to evaluate in number of samples.
+
+        Returns
+        -------
+            cov_tensors : numpy.ndarray
+                Array of shape (windows, delays, variables, variables) where
+                entry [w, d, i, j] is the covariance in window w between
+                variable i and variable j shifted by sample_delays[d], as
+                calculated by calc_covariance_tensor.
+
+        """
+
+        data = np.asarray(data, dtype=float)
+        vardims = data.shape[1]
+
+        # Only the rows read by the windows at any delay are summed, so that
+        # bad data outside the windows does not affect the results
+        read = np.zeros(len(data), dtype=bool)
+        for windowstart in windowstarts:
+            read[
+                max(0, windowstart + min(0, min(sample_delays))) : windowstart
+                + size
+                + max(0, max(sample_delays))
+            ] = True
+
+        # NaN in a window would spread through the cumulative sums to all
+        # later windows, so such data is analysed window by window
+        if np.isnan(data[read]).any():
+            return np.array(
+                [
+                    CorrWeightcalc.calc_covariance_tensor(
+                        data, windowstart, size, sample_delays
+                    )
+                    for windowstart in windowstarts
+                ]
+            )
+
+        # Removing the mean leaves the covariances unchanged but limits the
+        # cancellation when cumulative sums are subtracted
+        data = data - data[read].mean(axis=0)
+        data[~read] = 0.0
+
+        windowstarts = np.asarray(windowstarts, dtype=int)
+        windowends = windowstarts + size
+        boundaries = np.unique(np.concatenate([windowstarts, windowends]))
+        startlocs = np.searchsorted(boundaries, windowstarts)
+        endlocs = np.searchsorted(boundaries, windowends)
+
+        # Only segments between boundaries that lie in a window contribute
+        # to the differences of the cumulative sums
+        coverage = np.zeros(len(boundaries), dtype=int)
+        np.add.at(coverage, startlocs, 1)
+        np.add.at(coverage, endlocs, -1)
+        segments = np.flatnonzero(np.cumsum(coverage)[:-1] > 0)
+
+        cumdata = np.concatenate(
+            [np.zeros((1, vardims)), np.cumsum(data, axis=0)]
+        )
+        causal_sums = cumdata[windowends] - cumdata[windowstarts]
+
+        cov_tensors = np.zeros(
+            (len(windowstarts), len(sample_delays), vardims, vardims)
+        )
+
+        for delay_index, delay in enumerate(sample_delays):
+            segment_products = np.zeros((len(boundaries), vardims, vardims))
+            for segment in segments:
+                first, last = boundaries[segment], boundaries[segment + 1]
+                segment_products[segment + 1] = np.dot(
+                    data[first:last].T,
+                    data[first + delay : last + delay],
+                )
+            cumproducts = np.cumsum(segment_products, axis=0)
+
+            products = cumproducts[endlocs] - cumproducts[startlocs]
+            affected_sums = (
+                cumdata[windowends + delay] - cumdata[windowstarts + delay]
+            )
+            # Same unbiased normalisation as np.cov
+            cov_tensors[:, delay_index] = (
+                products
+                - (causal_sums[:, :, None] * affected_sums[:, None, :] / size)
+            ) / (size - 1)
+
+        return cov_tensors
+
+    def prepare_box(self, weightcalcdata, box, boxindex=None):
+        """Calculates the covariance tensor for all variable pairs and delays
+        of a box before the individual pairs are analysed.
+
+        With sliding correlation, the covariance tensors of all boxes to be
+        analysed are calculated together when the first box is prepared.
+
+        Also starts a new surrogate bank for the box. All box specific data
+        is newly assigned rather than modified, so that copies of the
+        calculator can be prepared for different boxes.
+
+        """
+
+        if (self.box_corr_tensors is not None) and (boxindex is not None):
+            if not self.box_corr_tensors:
+                cov_tensors = self.calc_sliding_covariances(
+                    weightcalcdata.inputdata,
+                    [
+                        weightcalcdata.boxbounds[index][0]
+                        + weightcalcdata.startindex
+                        for index in weightcalcdata.boxindexes
+                    ],
+                    weightcalcdata.testsize,
+                    weightcalcdata.sample_delays,
+                )
+                self.box_corr_tensors.update(
+                    zip(weightcalcdata.boxindexes, cov_tensors)
+                )
+            self.corr_tensor = self.box_corr_tensors.pop(boxindex)
+            # The tensors of the other boxes are left to the calculator
+            # this one was copied from, so that they are not sent along
+            # with this box
+            self.box_corr_tensors = None
+        else:
+            self.corr_tensor = self.calc_covariance_tensor(
+                box,
+                weightcalcdata.startindex,
+                weightcalcdata.testsize,
+                weightcalcdata.sample_delays,
+            )
+
+        if weightcalcdata.sigtest:
+            self.surrogate_bank = SurrogateBank(self.surr_method, boxindex)
+
+    def finish_box(self):
+        """Releases box specific data after all pairs of the box have been
+        analysed.
+
+        """
+
+        self.corr_tensor = None
+
+    def calcweight(
+        self,
+        causevardata,
+        affectedvardata,
+        weightcalcdata=None,
+        causevarindex=None,
+        affectedvarindex=None,
+        delay_index=None,
+    ):
         """Calculates the correlation between two vectors containing
         timer series data.
 
+        If the covariance tensor of the current box is available and the
+        variable and delay indexes are provided, the value is read from the
+        tensor instead of being recalculated.
+
         """
 
+        if (self.corr_tensor is not None) and (delay_index is not None):
+            corrval = self.corr_tensor[
+                delay_index, causevarindex, affectedvarindex
+            ]
+            return [corrval], None
+
         # corrval = np.corrcoef(causevardata.T, affectedvardata.T)[1, 0]
         # TODO: Provide the option of scaling the correlation measure
         # Un-normalised measure
@@ -89,47 +449,25 @@ class CorrWeightcalc(object):
         # The causal (or source) data is replaced by surrogate data,
         # while the affected (or destination) data remains unchanged.
 
-        # Generate surrogate causal data
-        thresh_causevardata = box[:, weightcalcdata.variables.index(causevar)][
-            weightcalcdata.startindex : weightcalcdata.startindex
-            + weightcalcdata.testsize
-        ]
-
-        # Get the causal data in the correct format
-        # for surrogate generation
-        original_causal = np.zeros((1, len(thresh_causevardata)))
-        original_causal[0, :] = thresh_causevardata
+        # Get surrogate causal data
+        surr_tsdata = self.surrogate_bank.get(
+            weightcalcdata, causevar, box, trials
+        )
 
-        if self.surr_method == "iAAFT":
-            surr_tsdata = [
-                data_processing.gen_iaaft_surrogates(original_causal, 10)
-                for n in range(trials)
-            ]
-        elif self.surr_method == "random_shuffle":
-            surr_tsdata = [
-                data_processing.shuffle_data(thresh_causevardata)
-                for n in range(trials)
-            ]
+        # Compute the weightlists of all trials by evaluating all delays
+        # in a single batched calculation
+        affectedvarindex = weightcalcdata.variables.index(affectedvar)
+        surr_weights = self.calc_lagged_covariances(
+            surr_tsdata.T,
+            box[:, affectedvarindex : affectedvarindex + 1],
+            weightcalcdata.startindex,
+            weightcalcdata.sample_delays,
+        )[:, :, 0].T
 
         surr_corr_list = []
         surr_dirindex_list = []
         for n in range(trials):
-            # Compute the weightlist for every trial by evaluating all delays
-            surr_weightlist = []
-            for delay_index in weightcalcdata.sample_delays:
-                thresh_affectedvardata = box[
-                    :, weightcalcdata.variables.index(affectedvar)
-                ][
-                    weightcalcdata.startindex
-                    + delay_index : weightcalcdata.startindex
-                    + weightcalcdata.testsize
-                    + delay_index
-                ]
-                surr_weightlist.append(
-                    self.calcweight(
-                        surr_tsdata[n][0, :], thresh_affectedvardata
-                    )[0][0]
-                )
+            surr_weightlist = list(surr_weights[n])
 
             _, maxcorr, _, _, _, directionindex, _ = self.select_weights(
                 weightcalcdata, causevar, affectedvar, surr_weightlist
@@ -481,7 +819,7 @@ class TransentWeightcalc(object):
 
     """
 
-    def __init__(self, weightcalcdata, estimator):
+    def __init__(self, weightcalcdata, estimator, backend="jidt"):
         self.data_header = [
             "causevar",
             "affectedvar",
@@ -509,10 +847,19 @@ class TransentWeightcalc(object):
         ]
 
         self.estimator = estimator
+        # The native backend only provides the Kraskov estimator
+        if backend == "native" and self.estimator != "kraskov":
+            raise ValueError(
+                "Native backend only supports the Kraskov estimator"
+            )
+        elif backend not in ["jidt", "native"]:
+            raise ValueError("Estimator backend not recognized")
+        self.backend = backend
         self.infodynamicsloc = weightcalcdata.infodynamicsloc
         if weightcalcdata.sigtest:
             self.thresh_method = weightcalcdata.thresh_method
             self.surr_method = weightcalcdata.surr_method
+            self.surrogate_bank = SurrogateBank(self.surr_method)
 
         if self.estimator == "kraskov":
             parameters_dict = weightcalcdata.additional_parameters
@@ -531,32 +878,329 @@ class TransentWeightcalc(object):
         ):
             self.parameters["kernel_width"] = weightcalcdata.kernel_width
 
-    def calcweight(self, causevardata, affectedvardata, *_):
-        """"Calculates the transfer entropy between two vectors containing
-        timer series data.
+        # Mutual information is symmetric in source and destination unless
+        # a time difference is specified. Its significance is not, as JIDT
+        # only permutes the source, so estimates are only shared between
+        # both directions if no significance is tested.
+        self.symmetric_mi = not self.parameters.get(
+            "delay", 0
+        ) and not self.parameters.get("test_signifiance", False)
+
+        # Estimates of the box currently being analysed that other pairs of
+        # the box can reuse, which are only those without a delay between
+        # the source and destination. Keys consist of the estimator
+        # settings, the measure and the source and destination variable
+        # indexes.
+        self.estimate_cache = create_cache(weightcalcdata.do_multiprocessing)
+        self.cachekey_settings = (
+            self.estimator,
+            self.backend,
+            repr(sorted(self.parameters.items())),
+        )
+
+        # Estimates of all boxes derived from local values that are
+        # estimated once over the complete records of a pair, shared by the
+        # calculators of all boxes and keyed like the estimate cache
+        self.local_profiles = None
+        if weightcalcdata.local_estimates:
+            if self.backend == "native":
+                self.local_profiles = create_cache(
+                    weightcalcdata.do_multiprocessing
+                )
+            else:
+                logging.info(
+                    "Local estimates are only available with the native "
+                    "backend"
+                )
+        # Native estimates of all delays of the pair currently being
+        # analysed, kept by every worker process for itself
+        self.delay_profile = None
+        # Directory where the local values are written to, if at all
+        self.localdir = None
+        self.box = None
+        self.boxindex = None
+
+    def prepare_box(self, weightcalcdata, box, boxindex=None):
+        """Prepares box specific data before the individual pairs are
+        analysed.
+
+        Starts a new estimate cache and surrogate bank, as estimates and
+        surrogates are only shared among the variable pairs of a single box.
+        All box specific data is newly assigned rather than modified, so that
+        copies of the calculator can be prepared for different boxes.
 
         """
-        # Calculate transfer entropy as the difference
-        # between the forward and backwards entropy
 
-        # Pass special estimator specific parameters in here
+        self.estimate_cache = create_cache(weightcalcdata.do_multiprocessing)
+        self.delay_profile = None
+        if weightcalcdata.sigtest:
+            self.surrogate_bank = SurrogateBank(self.surr_method, boxindex)
+
+        # The native backend estimates the complete delay range of a pair
+        # from the box at once. Boxes with an index are taken from the box
+        # views of weightcalcdata when needed, so that calculators sent to
+        # worker processes do not carry a copy of their box.
+        if self.backend == "native" and boxindex is None:
+            self.box = box
+        self.boxindex = boxindex
+
+    def finish_box(self):
+        """Releases box specific data after all pairs of the box have been
+        analysed.
+
+        """
+
+        self.estimate_cache.clear()
+        self.delay_profile = None
+        self.box = None
+
+    def cached_estimate(self, key, function, *args):
+        """Returns the estimate stored under key in the estimate cache,
+        calculating and storing it with function(*args) if not present.
+
+        Estimates without a key are never cached.
+
+        """
+
+        if key is None:
+            return function(*args)
+
+        key = self.cachekey_settings + key
 
-        transent_fwd, auxdata_fwd = transentropy.calc_infodynamics_te(
+        try:
+            return self.estimate_cache[key]
+        except KeyError:
+            pass
+
+        # Different worker processes may occasionally calculate the same
+        # estimate concurrently, in which case both store the same value
+        estimate = function(*args)
+        self.estimate_cache[key] = estimate
+
+        return estimate
+
+    def calc_transent(self, affecteddata, causaldata):
+        if self.backend == "native":
+            return ksg.calc_native_transent(
+                affecteddata, causaldata, **self.parameters
+            )
+        return transentropy.calc_infodynamics_transent(
             self.infodynamicsloc,
             self.estimator,
-            affectedvardata.T,
-            causevardata.T,
+            affecteddata,
+            causaldata,
             **self.parameters
         )
 
-        transent_bwd, auxdata_bwd = transentropy.calc_infodynamics_te(
+    def calc_mi(self, affecteddata, causaldata):
+        if self.backend == "native":
+            return ksg.calc_native_mi(
+                affecteddata, causaldata, **self.parameters
+            )
+        return transentropy.calc_infodynamics_mi(
             self.infodynamicsloc,
             self.estimator,
-            causevardata.T,
-            affectedvardata.T,
+            affecteddata,
+            causaldata,
+            **self.parameters
+        )
+
+    def get_delay_profile(
+        self, weightcalcdata, causevarindex, affectedvarindex
+    ):
+        """Returns the transfer entropies and mutual information of a pair
+        for all sample delays, which the native backend estimates at once
+        when the pair is first analysed.
+
+        """
+
+        pair = (causevarindex, affectedvarindex)
+        if (self.delay_profile is not None) and (
+            self.delay_profile[0] == pair
+        ):
+            return self.delay_profile[1]
+
+        if (self.local_profiles is not None) and (self.boxindex is not None):
+            profile = self.local_profile(
+                weightcalcdata, causevarindex, affectedvarindex
+            )
+        else:
+            if self.boxindex is None:
+                box = self.box
+            else:
+                box = weightcalcdata.boxes[self.boxindex]
+            profile = ksg.calc_native_delay_profile(
+                box[:, causevarindex],
+                box[:, affectedvarindex],
+                weightcalcdata.startindex,
+                weightcalcdata.testsize,
+                weightcalcdata.sample_delays,
+                **self.parameters
+            )
+
+        self.delay_profile = (pair, profile)
+
+        return profile
+
+    def local_profile(self, weightcalcdata, causevarindex, affectedvarindex):
+        """Returns the estimates of a pair for all sample delays in the
+        current box, derived from local values over the complete records.
+
+        The estimates of all boxes are calculated when the pair is first
+        analysed in any box, see ksg.calc_native_local_profile. If a local
+        directory is set, the local values are also written to a NumPy file
+        per pair that can be memory-mapped for time-resolved analysis.
+
+        """
+
+        key = self.cachekey_settings + (
+            "local",
+            causevarindex,
+            affectedvarindex,
+        )
+        try:
+            return self.local_profiles[key][self.boxindex]
+        except KeyError:
+            pass
+
+        boxindexes = list(weightcalcdata.boxindexes)
+        inputdata = weightcalcdata.inputdata
+
+        local_series = None
+        if self.localdir is not None:
+            causevardir = os.path.join(
+                self.localdir, weightcalcdata.variables[causevarindex]
+            )
+            os.makedirs(causevardir, exist_ok=True)
+            filename = os.path.join(
+                causevardir,
+                weightcalcdata.variables[affectedvarindex] + ".npy",
+            )
+            # Written under a temporary name, as other worker processes may
+            # occasionally write the same pair concurrently
+            tempname = "{}.{}.tmp".format(filename, os.getpid())
+            local_series = np.lib.format.open_memmap(
+                tempname,
+                mode="w+",
+                shape=(4, len(weightcalcdata.sample_delays), len(inputdata)),
+            )
+            local_series[:] = np.nan
+
+        profiles = ksg.calc_native_local_profile(
+            inputdata[:, causevarindex],
+            inputdata[:, affectedvarindex],
+            [
+                weightcalcdata.boxbounds[boxindex][0]
+                + weightcalcdata.startindex
+                for boxindex in boxindexes
+            ],
+            weightcalcdata.testsize,
+            weightcalcdata.sample_delays,
+            local_series,
             **self.parameters
         )
 
+        if local_series is not None:
+            local_series.flush()
+            del local_series
+            os.replace(tempname, filename)
+
+        profiles = dict(zip(boxindexes, profiles))
+        self.local_profiles[key] = profiles
+
+        return profiles[self.boxindex]
+
+    def calcweight(
+        self,
+        causevardata,
+        affectedvardata,
+        weightcalcdata=None,
+        causevarindex=None,
+        affectedvarindex=None,
+        delay_index=None,
+    ):
+        """"Calculates the transfer entropy between two vectors containing
+        timer series data.
+
+        If the variable and delay indexes are provided, the native backend
+        estimates all delays of the pair on first use. Otherwise estimates
+        without a delay are shared through the estimate cache with the
+        reversed pair, and those with a delay are calculated directly.
+
+        """
+        # Calculate transfer entropy as the difference
+        # between the forward and backwards entropy
+
+        # Pass special estimator specific parameters in here
+
+        if (delay_index is not None) and (self.backend == "native"):
+            (
+                estimate_te_fwd,
+                estimate_te_bwd,
+                estimate_mi_fwd,
+                estimate_mi_bwd,
+            ) = self.get_delay_profile(
+                weightcalcdata, causevarindex, affectedvarindex
+            )[
+                delay_index
+            ]
+        else:
+            te_fwd_key = te_bwd_key = mi_fwd_key = mi_bwd_key = None
+            if (delay_index is not None) and (
+                weightcalcdata.sample_delays[delay_index] == 0
+            ):
+                # The backward estimates are the forward estimates of the
+                # reversed pair
+                te_fwd_key = ("te", causevarindex, affectedvarindex)
+                te_bwd_key = ("te", affectedvarindex, causevarindex)
+                mi_fwd_key = ("mi", causevarindex, affectedvarindex)
+                mi_bwd_key = ("mi", affectedvarindex, causevarindex)
+                if self.symmetric_mi:
+                    mi_fwd_key = ("mi",) + tuple(
+                        sorted([causevarindex, affectedvarindex])
+                    )
+
+            estimate_te_fwd = self.cached_estimate(
+                te_fwd_key,
+                self.calc_transent,
+                affectedvardata.T,
+                causevardata.T,
+            )
+            estimate_te_bwd = self.cached_estimate(
+                te_bwd_key,
+                self.calc_transent,
+                causevardata.T,
+                affectedvardata.T,
+            )
+            estimate_mi_fwd = self.cached_estimate(
+                mi_fwd_key, self.calc_mi, affectedvardata.T, causevardata.T
+            )
+            if self.symmetric_mi:
+                estimate_mi_bwd = estimate_mi_fwd
+            else:
+                estimate_mi_bwd = self.cached_estimate(
+                    mi_bwd_key, self.calc_mi, causevardata.T, affectedvardata.T
+                )
+
+        transent_fwd, te_significance_fwd, properties_fwd = estimate_te_fwd
+        transent_bwd, te_significance_bwd, properties_bwd = estimate_te_bwd
+        mi_fwd, mi_significance_fwd = estimate_mi_fwd
+        if self.symmetric_mi:
+            mi_bwd, mi_significance_bwd = mi_fwd, mi_significance_fwd
+        else:
+            mi_bwd, mi_significance_bwd = estimate_mi_bwd
+
+        auxdata_fwd = [
+            [te_significance_fwd, mi_significance_fwd],
+            list(properties_fwd),
+            mi_fwd,
+        ]
+        auxdata_bwd = [
+            [te_significance_bwd, mi_significance_bwd],
+            list(properties_bwd),
+            mi_bwd,
+        ]
+
         transent_directional = transent_fwd - transent_bwd
         transent_absolute = transent_fwd
 
@@ -913,14 +1557,6 @@ class TransentWeightcalc(object):
         # The causal (or source) data is replaced by surrogate data,
         # while the affected (or destination) data remains unchanged.
 
-        # Get the causal data in the correct format
-        # for surrogate generation
-
-        thresh_causevardata = box[:, weightcalcdata.variables.index(causevar)][
-            weightcalcdata.startindex : weightcalcdata.startindex
-            + weightcalcdata.testsize
-        ]
-
         thresh_affectedvardata = box[
             :, weightcalcdata.variables.index(affectedvar)
         ][
@@ -930,27 +1566,17 @@ class TransentWeightcalc(object):
             + delay_index
         ]
 
-        original_causal = np.zeros((1, len(thresh_causevardata)))
-        original_causal[0, :] = thresh_causevardata
-
-        if self.surr_method == "iAAFT":
-            surr_tsdata = [
-                data_processing.gen_iaaft_surrogates(original_causal, 10)
-                for n in range(trials)
-            ]
-
-        elif self.surr_method == "random_shuffle":
-            surr_tsdata = [
-                data_processing.shuffle_data(thresh_causevardata)
-                for n in range(trials)
-            ]
+        # Get surrogate causal data
+        surr_tsdata = self.surrogate_bank.get(
+            weightcalcdata, causevar, box, trials
+        )
 
         surr_te_absolute_list = []
         surr_te_directional_list = []
         for n in range(trials):
 
             [surr_te_directional, surr_te_absolute], _ = self.calcweight(
-                surr_tsdata[n][0, :], thresh_affectedvardata
+                surr_tsdata[n], thresh_affectedvardata
             )
 
             surr_te_absolute_list.append(surr_te_absolute)
@@ -78,27 +78,40 @@ class GraphReduceData(object):
             self.boxes = boxindexes
 
 
-def dographreduce(graphreducedata, scenario, datadir, typename, writeoutput):
+def dographreduce(
+    graphreducedata, scenario, datadir, typename, writeoutput, graphs=None
+):
+    """Reduces the graphs of typename in all boxes.
+
+    The graphs are taken from the graphs handed over in memory by
+    noderankcalc if provided, and read from file otherwise. Returns the
+    reduced graphs in the same format as the graphs handed over.
+
+    """
 
     graph_filename = "{}.gml"
     simplified_graph_filename = "{}_simplified.gml"
     lowedge_graph_filename = "{}_lowedge.gml"
 
+    reduced_graphs = {}
+
     boxesdir = os.path.join(datadir, typename)
-    boxes = next(os.walk(boxesdir))[1]
+    boxes = config_setup.get_subdirs(boxesdir, graphs)
 
     for box in boxes:
         dummiesdir = os.path.join(boxesdir, box)
-        dummytypes = next(os.walk(dummiesdir))[1]
+        dummytypes = config_setup.get_subdirs(dummiesdir, graphs)
         for dummytype in dummytypes:
+            graphdir = os.path.join(dummiesdir, dummytype)
             # Open the original graph
-            original_graph = nx.readwrite.read_gml(
-                os.path.join(
-                    dummiesdir,
-                    dummytype,
-                    graph_filename.format(graphreducedata.graph),
+            if graphs is not None:
+                original_graph = graphs[graphdir][graphreducedata.graph]
+            else:
+                original_graph = nx.readwrite.read_gml(
+                    os.path.join(
+                        graphdir, graph_filename.format(graphreducedata.graph)
+                    )
                 )
-            )
             # Get appropriate weight threshold for deleting edges from graph
             # TODO: Implement elegant way of dealing with empty graphs
             try:
@@ -119,6 +132,15 @@ def dographreduce(graphreducedata, scenario, datadir, typename, writeoutput):
                 graphreducedata.weight_discretion,
             )
 
+            reduced_graphs[graphdir] = {
+                os.path.splitext(
+                    simplified_graph_filename.format(graphreducedata.graph)
+                )[0]: simplified_graph,
+                os.path.splitext(
+                    lowedge_graph_filename.format(graphreducedata.graph)
+                )[0]: lowedge_graph,
+            }
+
             # Write simplified graph to file
             if writeoutput:
                 # Write simplified graph
@@ -141,10 +163,18 @@ def dographreduce(graphreducedata, scenario, datadir, typename, writeoutput):
                         lowedge_graph_filename.format(graphreducedata.graph),
                     ),
                 )
-    return None
+    return reduced_graphs
+
+
+def reducegraph(mode, case, writeoutput, graphs=None):
+    """Reduces the graphs generated by noderankcalc for all scenarios.
 
+    The graphs handed over in memory by noderankcalc are used if provided.
+    Returns the reduced graphs in a dictionary keyed by the directory they are
+    written to, holding the graphs keyed by file name without extension.
+
+    """
 
-def reducegraph(mode, case, writeoutput):
     graphreducedata = GraphReduceData(mode, case)
 
     saveloc, caseconfigdir, casedir, _ = config_setup.runsetup(mode, case)
@@ -159,7 +189,9 @@ def reducegraph(mode, case, writeoutput):
     scenariosdir = os.path.join(saveloc, "noderank", case)
 
     # Get list of all scenarios
-    scenarios = next(os.walk(scenariosdir))[1]
+    scenarios = config_setup.get_subdirs(scenariosdir, graphs)
+
+    reduced_graphs = {}
 
     for scenario in scenarios:
         if scenario in graphreducedata.scenarios:
@@ -174,15 +206,15 @@ def reducegraph(mode, case, writeoutput):
         # the scenario's subdirectories
 
         methodsdir = os.path.join(scenariosdir, scenario)
-        methods = next(os.walk(methodsdir))[1]
+        methods = config_setup.get_subdirs(methodsdir, graphs)
         for method in methods:
             print(method)
             sigtypesdir = os.path.join(methodsdir, method)
-            sigtypes = next(os.walk(sigtypesdir))[1]
+            sigtypes = config_setup.get_subdirs(sigtypesdir, graphs)
             for sigtype in sigtypes:
                 print(sigtype)
                 embedtypesdir = os.path.join(sigtypesdir, sigtype)
-                embedtypes = next(os.walk(embedtypesdir))[1]
+                embedtypes = config_setup.get_subdirs(embedtypesdir, graphs)
                 for embedtype in embedtypes:
                     print(embedtype)
                     datadir = os.path.join(embedtypesdir, embedtype)
@@ -204,15 +236,18 @@ def reducegraph(mode, case, writeoutput):
                     for typename in typenames:
                         print(typename)
                         # Start the methods here
-                        dographreduce(
-                            graphreducedata,
-                            scenario,
-                            datadir,
-                            typename,
-                            writeoutput,
+                        reduced_graphs.update(
+                            dographreduce(
+                                graphreducedata,
+                                scenario,
+                                datadir,
+                                typename,
+                                writeoutput,
+                                graphs,
+                            )
                         )
 
-    return None
+    return reduced_graphs
 
 
 def compute_edge_threshold(graph, percentile):
@@ -0,0 +1,701 @@
+# -*- coding: utf-8 -*-
+"""Native implementation of the Kraskov-Stoegbauer-Grassberger (KSG)
+estimators for transfer entropy and mutual information.
+
+Follows algorithm 1 of Kraskov2004 and its conditional mutual information
+extension (Frenzel2007) as used by the JIDT Kraskov calculators wrapped in
+the transentropy module, but runs on scipy.spatial.cKDTree without a JVM.
+
+Supports the same embedding parameters as setup_infodynamics_te, including
+the maximum AIS auto-embedding criterion.
+
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.special import digamma
+
+
+def add_noise(data, noise_level):
+    """Adds a small amount of Gaussian noise to data to break ties between
+    identical samples, similar to the NOISE_LEVEL_TO_ADD property of JIDT.
+
+    """
+
+    data = np.asarray(data, dtype=float).ravel()
+
+    if noise_level:
+        scale = np.std(data)
+        if scale == 0:
+            scale = 1.0
+        data = data + noise_level * scale * np.random.randn(len(data))
+
+    return data
+
+
+def embed(data, history, tau, endindexes):
+    """Returns the delay embedding vectors of data, with the most recent
+    sample of each vector at the corresponding entry of endindexes.
+
+    """
+
+    return np.column_stack(
+        [data[endindexes - lag * tau] for lag in range(history)]
+    )
+
+
+def kth_neighbour_distances(data, k):
+    """Returns the max-norm distance of every point to its k-th nearest
+    neighbour.
+
+    """
+
+    distances, _ = cKDTree(data).query(data, k=k + 1, p=np.inf)
+
+    return distances[:, -1]
+
+
+def count_neighbours(data, radii, tree=None):
+    """Counts for every point the number of other points that are strictly
+    closer than its radius in max-norm.
+
+    A prebuilt tree of data can be provided to avoid rebuilding it.
+
+    """
+
+    if tree is None:
+        tree = cKDTree(data)
+
+    counts = tree.query_ball_point(
+        data, np.nextafter(radii, 0), p=np.inf, return_length=True
+    )
+
+    return counts - 1
+
+
+def count_mi_neighbours(source, dest, k=4, source_tree=None, dest_tree=None):
+    """Returns the neighbour counts in the source and destination spaces of
+    every observation of a KSG algorithm 1 mutual information estimate.
+
+    """
+
+    eps = kth_neighbour_distances(np.hstack((source, dest)), k)
+
+    n_source = count_neighbours(source, eps, source_tree)
+    n_dest = count_neighbours(dest, eps, dest_tree)
+
+    return n_source, n_dest
+
+
+def count_cmi_neighbours(
+    source, dest, conditional, k=4, dest_cond_tree=None, cond_tree=None
+):
+    """Returns the neighbour counts in the joint source and conditional,
+    joint destination and conditional and conditional spaces of every
+    observation of a KSG algorithm 1 conditional mutual information estimate.
+
+    """
+
+    eps = kth_neighbour_distances(np.hstack((source, dest, conditional)), k)
+
+    n_source_cond = count_neighbours(np.hstack((source, conditional)), eps)
+    n_dest_cond = count_neighbours(
+        np.hstack((dest, conditional)), eps, dest_cond_tree
+    )
+    n_cond = count_neighbours(conditional, eps, cond_tree)
+
+    return n_source_cond, n_dest_cond, n_cond
+
+
+def calc_ksg_mi_embedded(source, dest, k=4, source_tree=None, dest_tree=None):
+    """Calculates the mutual information (nats) between two sets of already
+    embedded observations using KSG algorithm 1.
+
+    Prebuilt neighbour search trees of the source and destination can be
+    provided when either is shared by several estimates.
+
+    """
+
+    samples = source.shape[0]
+    n_source, n_dest = count_mi_neighbours(
+        source, dest, k, source_tree, dest_tree
+    )
+
+    return (
+        digamma(k)
+        + digamma(samples)
+        - np.mean(digamma(n_source + 1) + digamma(n_dest + 1))
+    )
+
+
+def calc_ksg_mi_local(source, dest, k=4):
+    """Calculates the local mutual information (nats) of every observation
+    of two sets of already embedded observations, of which
+    calc_ksg_mi_embedded returns the average.
+
+    """
+
+    samples = source.shape[0]
+    n_source, n_dest = count_mi_neighbours(source, dest, k)
+
+    return (
+        digamma(k)
+        + digamma(samples)
+        - (digamma(n_source + 1) + digamma(n_dest + 1))
+    )
+
+
+def calc_ksg_cmi_embedded(
+    source, dest, conditional, k=4, dest_cond_tree=None, cond_tree=None
+):
+    """Calculates the conditional mutual information (nats) between two sets
+    of already embedded observations given a third using KSG algorithm 1.
+
+    Prebuilt neighbour search trees of the joint destination and conditional
+    space (in that column order) and of the conditional space can be
+    provided when these are shared by several estimates.
+
+    """
+
+    n_source_cond, n_dest_cond, n_cond = count_cmi_neighbours(
+        source, dest, conditional, k, dest_cond_tree, cond_tree
+    )
+
+    return digamma(k) - np.mean(
+        digamma(n_source_cond + 1)
+        + digamma(n_dest_cond + 1)
+        - digamma(n_cond + 1)
+    )
+
+
+def calc_ksg_cmi_local(source, dest, conditional, k=4):
+    """Calculates the local conditional mutual information (nats) of every
+    observation of two sets of already embedded observations given a third,
+    of which calc_ksg_cmi_embedded returns the average.
+
+    """
+
+    n_source_cond, n_dest_cond, n_cond = count_cmi_neighbours(
+        source, dest, conditional, k
+    )
+
+    return digamma(k) - (
+        digamma(n_source_cond + 1)
+        + digamma(n_dest_cond + 1)
+        - digamma(n_cond + 1)
+    )
+
+
+def calc_ksg_ais(data, history, tau, k=4):
+    """Calculates the active information storage (nats) of a single signal
+    for a given embedding.
+
+    """
+
+    endindexes = np.arange((history - 1) * tau, len(data) - 1)
+
+    return calc_ksg_mi_embedded(
+        embed(data, history, tau, endindexes),
+        data[endindexes + 1][:, np.newaxis],
+        k,
+    )
+
+
+def auto_embed(data, k_search_max=5, tau_search_max=5, k=4):
+    """Determines the embedding length and delay that maximises the active
+    information storage of a signal, equivalent to the MAX_CORR_AIS
+    auto-embedding method of JIDT.
+
+    Returns the embedding length and the embedding delay.
+
+    """
+
+    best_ais = -np.inf
+    best_embedding = (1, 1)
+
+    for history in range(1, k_search_max + 1):
+        for tau in range(1, tau_search_max + 1):
+            # The embedding delay has no effect on single sample embeddings
+            if history == 1 and tau > 1:
+                break
+            ais = calc_ksg_ais(data, history, tau, k)
+            if ais > best_ais:
+                best_ais = ais
+                best_embedding = (history, tau)
+
+    return best_embedding
+
+
+def get_window_embeddings(data, **parameters):
+    """Returns the (embedding length, embedding delay) of a signal when used
+    as destination and when used as source, according to the same parameters
+    used by setup_infodynamics_te.
+
+    When auto-embedding, both are determined from the signal itself.
+
+    """
+
+    if parameters.get("auto_embed", False) is True:
+        embedding = auto_embed(
+            data,
+            parameters.get("k_search_max", 5),
+            parameters.get("tau_search_max", 5),
+            parameters.get("kraskov_k", 4),
+        )
+        return embedding, embedding
+
+    dest_embedding = (
+        int(parameters.get("k_history", 1)),
+        int(parameters.get("k_tau", 1)),
+    )
+    source_embedding = (
+        int(parameters.get("l_history", 1)),
+        int(parameters.get("l_tau", 1)),
+    )
+
+    return dest_embedding, source_embedding
+
+
+def get_embedding(affected_data, causal_data, **parameters):
+    """Returns the destination and source embedding parameters
+    (k_history, k_tau, l_history, l_tau, delay) according to the same
+    parameters used by setup_infodynamics_te.
+
+    """
+
+    dest_embedding, _ = get_window_embeddings(affected_data, **parameters)
+    _, source_embedding = get_window_embeddings(causal_data, **parameters)
+
+    delay = int(parameters.get("delay", 1))
+
+    return dest_embedding + source_embedding + (delay,)
+
+
+def prepare_destination(affected_data, k_history, k_tau, starttime):
+    """Embeds the destination from starttime onwards and builds the neighbour
+    search trees of the destination-only subspaces of the transfer entropy
+    estimate.
+
+    The result can be passed to calc_ksg_te for every source that shares the
+    destination and the time range.
+
+    """
+
+    endindexes = np.arange(starttime, len(affected_data) - 1)
+
+    dest_past = embed(affected_data, k_history, k_tau, endindexes)
+    dest_next = affected_data[endindexes + 1][:, np.newaxis]
+
+    return {
+        "endindexes": endindexes,
+        "past": dest_past,
+        "next": dest_next,
+        "next_past_tree": cKDTree(np.hstack((dest_next, dest_past))),
+        "past_tree": cKDTree(dest_past),
+    }
+
+
+def calc_ksg_te(
+    affected_data,
+    causal_data,
+    k_history=1,
+    k_tau=1,
+    l_history=1,
+    l_tau=1,
+    delay=1,
+    k=4,
+    destination=None,
+):
+    """Calculates the transfer entropy (nats) from the causal data to the
+    affected data for a given embedding.
+
+    The source embedding ends delay samples before the next destination
+    value, following the DELAY property of JIDT.
+
+    The destination structures returned by prepare_destination for the same
+    embedding can be provided to avoid rebuilding them.
+
+    """
+
+    if len(causal_data) != len(affected_data):
+        raise ValueError(
+            "The source and destination arrays are of different lengths"
+        )
+
+    if destination is None:
+        destination = prepare_destination(
+            affected_data,
+            k_history,
+            k_tau,
+            get_starttime(k_history, k_tau, l_history, l_tau, delay),
+        )
+
+    source_past = embed(
+        causal_data, l_history, l_tau, destination["endindexes"] + 1 - delay
+    )
+
+    return calc_ksg_cmi_embedded(
+        source_past,
+        destination["next"],
+        destination["past"],
+        k,
+        destination["next_past_tree"],
+        destination["past_tree"],
+    )
+
+
+def calc_ksg_te_local(
+    affected_data,
+    causal_data,
+    k_history=1,
+    k_tau=1,
+    l_history=1,
+    l_tau=1,
+    delay=1,
+    k=4,
+):
+    """Calculates the local transfer entropy (nats) from the causal data to
+    the affected data of every observation, of which calc_ksg_te returns the
+    average for the same embedding.
+
+    The observation at index i of the local values predicts the affected
+    sample at index i + starttime + 1, where starttime is given by
+    get_starttime.
+
+    """
+
+    if len(causal_data) != len(affected_data):
+        raise ValueError(
+            "The source and destination arrays are of different lengths"
+        )
+
+    endindexes = np.arange(
+        get_starttime(k_history, k_tau, l_history, l_tau, delay),
+        len(affected_data) - 1,
+    )
+
+    return calc_ksg_cmi_local(
+        embed(causal_data, l_history, l_tau, endindexes + 1 - delay),
+        affected_data[endindexes + 1][:, np.newaxis],
+        embed(affected_data, k_history, k_tau, endindexes),
+        k,
+    )
+
+
+def get_starttime(k_history, k_tau, l_history, l_tau, delay):
+    """Returns the first time index at which both the destination and source
+    embedding vectors are available.
+
+    """
+
+    return max((k_history - 1) * k_tau, (l_history - 1) * l_tau + delay - 1)
+
+
+def calc_native_transent(affected_data, causal_data, **parameters):
+    """Calculates only the transfer entropy from the causal data to the
+    affected data in bits.
+
+    Returns the same results as transentropy.calc_infodynamics_transent
+    for the Kraskov estimator, with the significance always None.
+
+    """
+
+    noise_level = parameters.get("noise_level", 1e-8)
+    affected_data = add_noise(affected_data, noise_level)
+    causal_data = add_noise(causal_data, noise_level)
+
+    embedding = get_embedding(affected_data, causal_data, **parameters)
+
+    neighbours = parameters.get("kraskov_k", 4)
+
+    transentropy = calc_ksg_te(
+        affected_data, causal_data, *embedding, k=neighbours
+    )
+
+    # Report properties as strings, as read from JIDT calculators
+    properties = [str(value) for value in embedding]
+
+    return transentropy / np.log(2.0), None, properties
+
+
+def calc_native_mi(affected_data, causal_data, **parameters):
+    """Calculates only the mutual information between the causal data and the
+    affected data in bits.
+
+    Returns the same results as transentropy.calc_infodynamics_mi for the
+    Kraskov estimator, with the significance always None.
+
+    """
+
+    if len(causal_data) != len(affected_data):
+        raise ValueError(
+            "The source and destination arrays are of different lengths"
+        )
+
+    noise_level = parameters.get("noise_level", 1e-8)
+    affected_data = add_noise(affected_data, noise_level)
+    causal_data = add_noise(causal_data, noise_level)
+
+    # Time difference between source and destination, as for the TIME_DIFF
+    # property of the JIDT calculator
+    timediff = int(parameters.get("delay", 0))
+    samples = len(affected_data) - timediff
+
+    mutualinfo = calc_ksg_mi_embedded(
+        causal_data[:samples, np.newaxis],
+        affected_data[timediff:, np.newaxis],
+        parameters.get("kraskov_k", 4),
+    )
+
+    return mutualinfo / np.log(2.0), None
+
+
+def calc_native_delay_profile(
+    causal_data, affected_data, startindex, size, sample_delays, **parameters
+):
+    """Calculates the transfer entropy in both directions and the mutual
+    information (bits) between the causal variable window starting at
+    startindex and the affected variable windows shifted by each of the
+    sample delays, as analysed by calc_weights_oneset.
+
+    causal_data and affected_data are the complete records that the windows
+    are taken from. Work that only depends on a single window is done once
+    for the whole delay range. This includes the auto-embedding of each
+    window as well as the embeddings and neighbour search trees of the
+    causal window, which is the destination of every backward estimate.
+
+    Returns a (transent_fwd, transent_bwd, mi_fwd, mi_bwd) tuple for each
+    delay, in the formats returned by calc_native_transent and
+    calc_native_mi.
+
+    """
+
+    noise_level = parameters.get("noise_level", 1e-8)
+    causal_data = add_noise(causal_data, noise_level)
+    affected_data = add_noise(affected_data, noise_level)
+
+    neighbours = parameters.get("kraskov_k", 4)
+    delay = int(parameters.get("delay", 1))
+    # Time difference of the mutual information, see calc_native_mi
+    timediff = int(parameters.get("delay", 0))
+    samples = size - timediff
+
+    causal_window = causal_data[startindex : startindex + size]
+    causal_dest, causal_source = get_window_embeddings(
+        causal_window, **parameters
+    )
+
+    # Backward destination structures, keyed by their start time
+    destinations = {}
+    mi_fwd_tree = cKDTree(causal_window[:samples, np.newaxis])
+    mi_bwd_tree = cKDTree(causal_window[timediff:, np.newaxis])
+
+    profile = []
+    for sample_delay in sample_delays:
+        affected_window = affected_data[
+            startindex + sample_delay : startindex + size + sample_delay
+        ]
+        affected_dest, affected_source = get_window_embeddings(
+            affected_window, **parameters
+        )
+
+        embedding_fwd = affected_dest + causal_source + (delay,)
+        transent_fwd = calc_ksg_te(
+            affected_window, causal_window, *embedding_fwd, k=neighbours
+        )
+
+        embedding_bwd = causal_dest + affected_source + (delay,)
+        starttime = get_starttime(*embedding_bwd)
+        if starttime not in destinations:
+            destinations[starttime] = prepare_destination(
+                causal_window, causal_dest[0], causal_dest[1], starttime
+            )
+        transent_bwd = calc_ksg_te(
+            causal_window,
+            affected_window,
+            *embedding_bwd,
+            k=neighbours,
+            destination=destinations[starttime]
+        )
+
+        mi_fwd = calc_ksg_mi_embedded(
+            causal_window[:samples, np.newaxis],
+            affected_window[timediff:, np.newaxis],
+            neighbours,
+            source_tree=mi_fwd_tree,
+        )
+        if timediff:
+            mi_bwd = calc_ksg_mi_embedded(
+                affected_window[:samples, np.newaxis],
+                causal_window[timediff:, np.newaxis],
+                neighbours,
+                dest_tree=mi_bwd_tree,
+            )
+        else:
+            mi_bwd = mi_fwd
+
+        profile.append(
+            (
+                (
+                    transent_fwd / np.log(2.0),
+                    None,
+                    [str(value) for value in embedding_fwd],
+                ),
+                (
+                    transent_bwd / np.log(2.0),
+                    None,
+                    [str(value) for value in embedding_bwd],
+                ),
+                (mi_fwd / np.log(2.0), None),
+                (mi_bwd / np.log(2.0), None),
+            )
+        )
+
+    return profile
+
+
+def calc_native_local_profile(
+    causal_data,
+    affected_data,
+    windowstarts,
+    size,
+    sample_delays,
+    local_series=None,
+    **parameters
+):
+    """Calculates the estimates of calc_native_delay_profile for the causal
+    variable windows starting at each of windowstarts, from local values
+    estimated once over the complete records.
+
+    For every delay, the local transfer entropies in both directions and the
+    local mutual information are estimated once from all causal samples and
+    affected samples shifted by the delay. The estimate of each window is the
+    average of the local values of its observations, taken from cumulative
+    sums of the local values. This replaces an estimate for every window,
+    which mostly repeats the work of the windows it overlaps with.
+
+    The window estimates are not the same as estimates from each window
+    alone. Neighbours are searched in the complete records rather than only
+    in the window, so that the neighbour counts reflect the global
+    distribution of the data. The digamma of the number of samples in the
+    mutual information refers to the complete records, and auto-embedding is
+    done once on the complete records. Windows that differ from the rest of
+    the record are therefore biased towards the global estimate, while the
+    variance of the window estimates is reduced.
+
+    local_series, if provided, is filled with the local values in bits as an
+    array of shape (4, delays, samples), where the first axis selects the
+    forward and backward transfer entropy and the forward and backward
+    mutual information. The local values of the observations of a window
+    starting at index i of the causal record are placed from index i plus
+    the start time of the embedding onwards, and other entries are left as
+    is.
+
+    Returns a profile as returned by calc_native_delay_profile for each of
+    the windows.
+
+    """
+
+    noise_level = parameters.get("noise_level", 1e-8)
+    causal_data = add_noise(causal_data, noise_level)
+    affected_data = add_noise(affected_data, noise_level)
+
+    neighbours = parameters.get("kraskov_k", 4)
+    delay = int(parameters.get("delay", 1))
+    # Time difference of the mutual information, see calc_native_mi
+    timediff = int(parameters.get("delay", 0))
+    samples = size - timediff
+
+    causal_dest, causal_source = get_window_embeddings(
+        causal_data, **parameters
+    )
+    affected_dest, affected_source = get_window_embeddings(
+        affected_data, **parameters
+    )
+    embedding_fwd = affected_dest + causal_source + (delay,)
+    embedding_bwd = causal_dest + affected_source + (delay,)
+    properties_fwd = [str(value) for value in embedding_fwd]
+    properties_bwd = [str(value) for value in embedding_bwd]
+
+    # Observations of each window in the local values start at the index of
+    # the window and their number follows from the embedding
+    counts = [
+        size - 1 - get_starttime(*embedding_fwd),
+        size - 1 - get_starttime(*embedding_bwd),
+        samples,
+        samples,
+    ]
+    offsets = [get_starttime(*embedding_fwd), get_starttime(*embedding_bwd)]
+    offsets += [0, 0]
+
+    records = len(causal_data)
+    windowstarts = np.asarray(windowstarts, dtype=int)
+    profiles = [[] for _ in windowstarts]
+
+    for delay_index, sample_delay in enumerate(sample_delays):
+        # Causal samples paired with the affected samples shifted by delay
+        first = max(0, -sample_delay)
+        last = min(records, records - sample_delay)
+        causal_pairs = causal_data[first:last]
+        affected_pairs = affected_data[
+            first + sample_delay : last + sample_delay
+        ]
+        pairs = last - first
+
+        local_values = [
+            calc_ksg_te_local(
+                affected_pairs, causal_pairs, *embedding_fwd, k=neighbours
+            ),
+            calc_ksg_te_local(
+                causal_pairs, affected_pairs, *embedding_bwd, k=neighbours
+            ),
+            calc_ksg_mi_local(
+                causal_pairs[: pairs - timediff, np.newaxis],
+                affected_pairs[timediff:, np.newaxis],
+                neighbours,
+            ),
+        ]
+        if timediff:
+            local_values.append(
+                calc_ksg_mi_local(
+                    affected_pairs[: pairs - timediff, np.newaxis],
+                    causal_pairs[timediff:, np.newaxis],
+                    neighbours,
+                )
+            )
+        else:
+            local_values.append(local_values[2])
+
+        estimates = []
+        for series_index, values in enumerate(local_values):
+            values = values / np.log(2.0)
+            cumvalues = np.concatenate([[0.0], np.cumsum(values)])
+            windowindexes = windowstarts - first
+            estimates.append(
+                (
+                    cumvalues[windowindexes + counts[series_index]]
+                    - cumvalues[windowindexes]
+                )
+                / counts[series_index]
+            )
+
+            if local_series is not None:
+                start = first + offsets[series_index]
+                local_series[
+                    series_index, delay_index, start : start + len(values)
+                ] = values
+
+        for window_index, profile in enumerate(profiles):
+            te_fwd, te_bwd, mi_fwd, mi_bwd = [
+                estimate[window_index] for estimate in estimates
+            ]
+            profile.append(
+                (
+                    (te_fwd, None, properties_fwd),
+                    (te_bwd, None, properties_bwd),
+                    (mi_fwd, None),
+                    (mi_bwd, None),
+                )
+            )
+
+    return profiles
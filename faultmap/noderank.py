@@ -17,7 +17,7 @@ import os
 import networkx as nx
 import numpy as np
 
-from faultmap import data_processing, config_setup
+from faultmap import data_processing, config_setup, resultstore
 from test import networkgen
 
 
@@ -153,7 +153,7 @@ class NoderankData:
 
         logging.info("Number of tags: {}".format(len(self.variablelist)))
 
-    def get_boxes(self, scenario, datadir, typename):
+    def get_boxes(self, scenario, datadir, typename, stores=None):
         if "boxindexes" in self.caseconfig[scenario]:
             if self.caseconfig[scenario]["boxindexes"] == "range":
                 boxindexes = range(
@@ -165,9 +165,9 @@ class NoderankData:
         else:
             boxindexes = "all"
         if boxindexes == "all":
-            boxesdir = os.path.join(datadir, typename)
-            boxes = next(os.walk(boxesdir))[1]
-            self.boxes = range(len(boxes))
+            store = resultstore.read_store(datadir, stores=stores)
+            self.boxes = resultstore.get_boxindexes(store)
+            resultstore.close_store(store, stores)
         else:
             self.boxes = boxindexes
 
@@ -581,48 +581,32 @@ def calc_gainrank(gainmatrix, noderankdata, rank_method, dummyweight):
     )
 
 
-def get_gainmatrices(noderankdata, datadir, typename):
-    """Searches in countlocation for all gainmatrices CSV files
-    associated with the specific case, scenario and method at hand and
-    then returns all relevant gainmatrices in a list which can be used to
-    calculate the change of importances over time (transient importances).
+def get_gainmatrices(noderankdata, datadir, typename, stores=None):
+    """Reads all gainmatrices of typename associated with the specific case,
+    scenario and method at hand from the result store and returns them in a
+    list which can be used to calculate the change of importances over time
+    (transient importances).
 
     """
-    # Store all relevant gainmatrices in a list
-    gainmatrices = []
-
-    if typename[:9] == "sigweight" or typename[:20] == "signtested_sigweight":
-        fname = "sigweight_array.csv"
-    elif typename[:6] == "weight" or typename[:17] == "signtested_weight":
-        fname = "weight_array.csv"
-    # TODO: There are more cases to add
-    elif typename[:10] == "dif_weight":
-        fname = "dif_weight_array.csv"
-    # TODO: Complete and re-enable signtested directional arrays creation
-    # elif typename[:21] == 'dif_signtested_weight':
-    #    fname = ''
-
-    for boxindex in noderankdata.boxes:
-        gainmatrix = data_processing.read_matrix(
-            os.path.join(
-                datadir, typename, "box{:03d}".format(boxindex + 1), fname
-            )
-        )
 
-        gainmatrices.append(gainmatrix)
+    store = resultstore.read_store(datadir, stores=stores)
+    # Store all relevant gainmatrices in a list
+    gainmatrices = [
+        resultstore.read_array(store, typename, boxindex)
+        for boxindex in noderankdata.boxes
+    ]
+    resultstore.close_store(store, stores)
 
     return gainmatrices
 
 
-def get_delaymatrices(noderankdata, datadir, typename):
-    """Searches in countlocation for all delaymatrices CSV files
-    associated with the specific case, scenario and method at hand and
-    then returns all relevant delaymatrices in a list which can be used to
-    calculate the change of importances over time (transient importances).
+def get_delaymatrices(noderankdata, datadir, typename, stores=None):
+    """Reads all delaymatrices associated with the specific case, scenario
+    and method at hand from the result store and returns them in a list
+    which can be used to calculate the change of importances over time
+    (transient importances).
 
     """
-    # Store all relevant gainmatrices in a list
-    delaymatrices = []
 
     if typename == "weight_arrays":
         delaytypename = "delay_arrays"
@@ -631,17 +615,13 @@ def get_delaymatrices(noderankdata, datadir, typename):
     else:
         delaytypename = "delay_absolute_arrays"
 
-    for boxindex in noderankdata.boxes:
-        delaymatrix = data_processing.read_matrix(
-            os.path.join(
-                datadir,
-                delaytypename,
-                "box{:03d}".format(boxindex + 1),
-                "delay_array.csv",
-            )
-        )
-
-        delaymatrices.append(delaymatrix)
+    store = resultstore.read_store(datadir, stores=stores)
+    # Store all relevant delaymatrices in a list
+    delaymatrices = [
+        resultstore.read_array(store, delaytypename, boxindex)
+        for boxindex in noderankdata.boxes
+    ]
+    resultstore.close_store(store, stores)
 
     return delaymatrices
 
@@ -654,12 +634,24 @@ def dorankcalc(
     rank_method,
     writeoutput,
     preprocessing,
+    stores=None,
 ):
+    """Ranks the nodes of the gainmatrices of typename in all boxes.
+
+    Returns the importance graph of each box in a dictionary keyed by the
+    directory it is written to, holding the graphs keyed by file name without
+    extension.
+
+    """
 
     if noderankdata.datatype == "file":
-        noderankdata.get_boxes(scenario, datadir, typename)
-        gainmatrices = get_gainmatrices(noderankdata, datadir, typename)
-        delaymatrices = get_delaymatrices(noderankdata, datadir, typename)
+        noderankdata.get_boxes(scenario, datadir, typename, stores)
+        gainmatrices = get_gainmatrices(
+            noderankdata, datadir, typename, stores
+        )
+        delaymatrices = get_delaymatrices(
+            noderankdata, datadir, typename, stores
+        )
 
     elif noderankdata.datatype == "function":
         gainmatrices = [noderankdata.gainmatrix]
@@ -688,7 +680,7 @@ def dorankcalc(
         dif_rel_boxrankdict_name = "dif_rel_boxrankdict_{}.json"
         dif_typename = "dif_" + typename
         dif_gainmatrices = get_gainmatrices(
-            noderankdata, datadir, dif_typename
+            noderankdata, datadir, dif_typename, stores
         )
 
     # Create lists to store the backward faultmap list
@@ -698,6 +690,11 @@ def dorankcalc(
     backward_rankingdicts = []
     dif_backward_rankingdicts = []
 
+    graphs = {}
+
+    # Take datadir and swop out 'weightdata' for 'noderank'
+    savedir = data_processing.change_dirtype(datadir, "weightdata", "noderank")
+
     for index, gainmatrix in enumerate(gainmatrices):
         if preprocessing:
             # modgainmatrix, _ = \
@@ -749,11 +746,6 @@ def dorankcalc(
 
         if writeoutput:
             # Make sure the correct directory exists
-            # Take datadir and swop out 'weightdata' for 'noderank'
-            savedir = data_processing.change_dirtype(
-                datadir, "weightdata", "noderank"
-            )
-
             config_setup.ensure_existence(os.path.join(savedir, typename[:-7]))
 
             if preprocessing:
@@ -782,28 +774,29 @@ def dorankcalc(
             dummystatus = "nodummies"
 
         # Save the faultmap list for each box
-        savepath = config_setup.ensure_existence(
-            os.path.join(
-                savedir,
-                typename[:-7],
-                "box{:03d}".format(noderankdata.boxes[index] + 1),
-                dummystatus,
-            )
+        savepath = os.path.join(
+            savedir,
+            typename[:-7],
+            "box{:03d}".format(noderankdata.boxes[index] + 1),
+            dummystatus,
         )
 
-        writecsv_looprank(
-            os.path.join(savepath, rankinglist_name.format(rank_method)),
-            rankinglist,
-        )
+        if writeoutput:
+            config_setup.ensure_existence(savepath)
 
-        if generate_diffs:
             writecsv_looprank(
-                os.path.join(
-                    savepath, dif_rankinglist_name.format(rank_method)
-                ),
-                dif_rankinglist,
+                os.path.join(savepath, rankinglist_name.format(rank_method)),
+                rankinglist,
             )
 
+            if generate_diffs:
+                writecsv_looprank(
+                    os.path.join(
+                        savepath, dif_rankinglist_name.format(rank_method)
+                    ),
+                    dif_rankinglist,
+                )
+
         # Save the graphs to file
         graph, _ = create_importance_graph(
             noderankdata,
@@ -814,13 +807,16 @@ def dorankcalc(
             delays,
             rankingdict,
         )
-        graph_filename = os.path.join(
-            savepath, graphfile_name.format(rank_method)
-        )
+        graphname = graphfile_name.format(rank_method)
+        graphs[savepath] = {os.path.splitext(graphname)[0]: graph}
+
+        # The remaining results are only written to file
+        if not writeoutput:
+            continue
 
         # Decided to keep connections natural, will rotate hierarchical layout
         # in post-processing
-        nx.readwrite.write_gml(graph, graph_filename)
+        nx.readwrite.write_gml(graph, os.path.join(savepath, graphname))
 
         # Get faultmap dictionaries
         (
@@ -896,16 +892,22 @@ def dorankcalc(
                 dif_basevaldict,
             )
 
-    return None
+    return graphs
 
 
-def noderankcalc(mode, case, writeoutput, preprocessing=False):
+def noderankcalc(mode, case, writeoutput, preprocessing=False, stores=None):
     """Ranks the nodes in a network based on gain matrices already generated
     for different weight types.
 
     The results are stored in the noderank directory but retains the structure
     of the weightdata directory
 
+    The gain matrices are read from the result stores handed over in memory
+    in stores, if provided. The importance graphs are returned in a dictionary
+    keyed by the directory they are written to, holding the graphs keyed by
+    file name without extension, so that they can be handed over to
+    reducegraph.
+
     Notes
     -----
         Preprocessing is experimental and should always be set to False
@@ -918,6 +920,8 @@ def noderankcalc(mode, case, writeoutput, preprocessing=False):
         os.path.join(noderankdata.saveloc, "noderank"), make=True
     )
 
+    graphs = {}
+
     for scenario in noderankdata.scenarios:
 
         logging.info("Running scenario {}".format(scenario))
@@ -936,7 +940,7 @@ def noderankcalc(mode, case, writeoutput, preprocessing=False):
                 )
 
                 if noderankdata.datatype == "file":
-                    sigtypes = next(os.walk(basedir))[1]
+                    sigtypes = config_setup.get_subdirs(basedir, stores)
                 elif noderankdata.datatype == "function":
                     sigtypes = ["test_nosig"]
 
@@ -945,7 +949,9 @@ def noderankcalc(mode, case, writeoutput, preprocessing=False):
                     embedtypesdir = os.path.join(basedir, sigtype)
 
                     if noderankdata.datatype == "file":
-                        embedtypes = next(os.walk(embedtypesdir))[1]
+                        embedtypes = config_setup.get_subdirs(
+                            embedtypesdir, stores
+                        )
                     elif noderankdata.datatype == "function":
                         embedtypes = ["test_noembed"]
 
@@ -973,7 +979,7 @@ def noderankcalc(mode, case, writeoutput, preprocessing=False):
 
                         for typename in typenames:
                             # Start the methods here
-                            dorankcalc(
+                            typegraphs = dorankcalc(
                                 noderankdata,
                                 scenario,
                                 datadir,
@@ -981,6 +987,13 @@ def noderankcalc(mode, case, writeoutput, preprocessing=False):
                                 rank_method,
                                 writeoutput,
                                 preprocessing,
+                                stores,
                             )
+                            # Graphs of different rank methods share the
+                            # same directories
+                            for savepath, savegraphs in typegraphs.items():
+                                graphs.setdefault(savepath, {}).update(
+                                    savegraphs
+                                )
 
-    return None
+    return graphs
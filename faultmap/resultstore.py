@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+"""Stores the results of the weight calculation and array creation stages in
+a single HDF5 file for each method, significance and embedding type.
+
+Weight, mutual information and significance threshold data are stored as
+chunked and compressed tensors indexed by box, causevar, affectedvar and
+delay. The auxiliary data reported for each pair are stored as tensors of
+report fields indexed by box, causevar and affectedvar, and the arrays
+created from them as tensors indexed by box, affectedvar and causevar.
+
+The CSV files of earlier versions can still be generated with export_csv.
+
+When the analysis stages are run one after another in the same process, the
+stores can be handed over in memory in a dictionary keyed by datadir. Such
+stores are kept in memory for the whole run and are only written to disk when
+flushed or closed, if output is written at all.
+
+"""
+
+import csv
+import logging
+import os
+import uuid
+
+import numpy as np
+import tables as tb
+
+from faultmap import config_setup
+
+STORE_NAME = "weightstore.h5"
+
+# Data types stored over all delays for each pair
+WEIGHT_TYPES = [
+    "weights_directional",
+    "weights_absolute",
+    "weights",
+    "mis_directional",
+    "mis_absolute",
+    "sigthresh_directional",
+    "sigthresh_absolute",
+    "sigthresh",
+]
+
+AUX_NAMES = ["auxdata_directional", "auxdata_absolute", "auxdata"]
+
+# Auxiliary data type indicating which pairs were tested for each weight type
+AUX_TYPES = {
+    "weights_directional": "auxdata_directional",
+    "weights_absolute": "auxdata_directional",
+    "weights": "auxdata",
+    "mis_directional": "auxdata_directional",
+    "mis_absolute": "auxdata_directional",
+    "sigthresh_directional": "auxdata_directional",
+    "sigthresh_absolute": "auxdata_directional",
+    "sigthresh": "auxdata",
+}
+
+# Report fields are stored as text, exactly as they would be written to CSV
+AUX_ITEMSIZE = 32
+
+FILTERS = tb.Filters(complevel=5, complib="zlib", shuffle=True)
+
+
+def store_filename(datadir):
+    """Returns the location of the result store in datadir."""
+
+    return os.path.join(datadir, STORE_NAME)
+
+
+class InMemoryStores(dict):
+    """Result stores handed over in memory between analysis stages, keyed by
+    datadir.
+
+    The stores are written to disk when closed only if writeoutput is True.
+
+    """
+
+    def __init__(self, writeoutput):
+        super().__init__()
+        self.writeoutput = writeoutput
+
+    def close(self):
+        """Closes all stores."""
+
+        while self:
+            _, store = self.popitem()
+            store.close()
+
+
+def open_store(datadir, variables, boxnum, delays=None, stores=None):
+    """Opens the result store in datadir for writing.
+
+    A new store is created if none exists yet, if the existing store was
+    created for different variables, number of boxes or delays, or if it
+    cannot be read, as left behind by an interrupted run. The delays only
+    need to be provided when writing weight data.
+
+    If stores handed over in memory are provided, the store of datadir is
+    taken from them, or created in memory and added to them.
+
+    """
+
+    filename = store_filename(datadir)
+
+    if stores is not None and os.path.normpath(datadir) in stores:
+        store = stores.pop(os.path.normpath(datadir))
+    elif os.path.exists(filename):
+        try:
+            store = tb.open_file(filename, "a", **driver_options(stores))
+        except tb.HDF5ExtError:
+            logging.warning("Replacing unreadable result store " + filename)
+            store = None
+    else:
+        store = None
+
+    if store is not None:
+        attrs = store.root._v_attrs
+        if (
+            "variables" in attrs
+            and list(attrs.variables) == list(variables)
+            and attrs.boxnum == boxnum
+            and (
+                delays is None
+                or "delays" not in attrs
+                or np.array_equal(attrs.delays, delays)
+            )
+        ):
+            if (delays is not None) and ("delays" not in attrs):
+                attrs.delays = np.asarray(delays)
+            return keep_store(datadir, store, stores)
+        store.close()
+
+    config_setup.ensure_existence(datadir, make=True)
+    store = tb.open_file(filename, "w", **driver_options(stores))
+    attrs = store.root._v_attrs
+    # Identifies the store, so that results recorded for a store that has
+    # since been replaced are recognised
+    attrs.store_id = uuid.uuid4().hex
+    attrs.variables = list(variables)
+    attrs.boxnum = boxnum
+    attrs.boxindexes = []
+    if delays is not None:
+        attrs.delays = np.asarray(delays)
+
+    return keep_store(datadir, store, stores)
+
+
+def get_store_id(store):
+    """Returns the identifier assigned to a store when it was created, or
+    None for stores created by earlier versions.
+
+    """
+
+    attrs = store.root._v_attrs
+    if "store_id" not in attrs:
+        return None
+
+    return str(attrs.store_id)
+
+
+def driver_options(stores):
+    """Returns the options for opening a store, which is kept in memory if
+    stores are handed over in memory.
+
+    If output is written, the store is backed by its file, which is updated
+    whenever the store is flushed.
+
+    """
+
+    if stores is None:
+        return {}
+
+    return {
+        "driver": "H5FD_CORE",
+        "driver_core_backing_store": int(stores.writeoutput),
+    }
+
+
+def keep_store(datadir, store, stores):
+    if stores is not None:
+        stores[os.path.normpath(datadir)] = store
+
+    return store
+
+
+def close_store(store, stores=None):
+    """Closes a store, unless it is handed over in memory."""
+
+    if stores is None or store not in stores.values():
+        store.close()
+
+
+def read_store(datadir, mode="r", stores=None):
+    """Opens an existing result store in datadir, by default for reading.
+
+    Stores handed over in memory are returned as they are and should be
+    released with close_store.
+
+    """
+
+    if stores is not None and os.path.normpath(datadir) in stores:
+        return stores[os.path.normpath(datadir)]
+
+    return tb.open_file(store_filename(datadir), mode)
+
+
+def has_store(datadir, stores=None):
+    if stores is not None and os.path.normpath(datadir) in stores:
+        return True
+
+    return os.path.exists(store_filename(datadir))
+
+
+def get_variables(store):
+    return list(store.root._v_attrs.variables)
+
+
+def get_boxindexes(store):
+    """Returns the indexes of the boxes with results in the store."""
+
+    return list(store.root._v_attrs.boxindexes)
+
+
+def add_boxindex(store, boxindex):
+    attrs = store.root._v_attrs
+    if boxindex not in attrs.boxindexes:
+        attrs.boxindexes = sorted(list(attrs.boxindexes) + [boxindex])
+
+
+def get_tensor(store, name, atom, shape, chunkshape, where="/"):
+    """Returns the tensor with name, creating it if it does not exist yet."""
+
+    path = where.rstrip("/") + "/" + name
+    if path in store:
+        return store.get_node(path)
+
+    return store.create_carray(
+        where,
+        name,
+        atom=atom,
+        shape=shape,
+        chunkshape=chunkshape,
+        filters=FILTERS,
+        createparents=True,
+    )
+
+
+def write_weights(store, typename, boxindex, causevarindex, columns):
+    """Writes the values over all delays of the pairs of a causevar in a box.
+
+    columns is a dictionary of values over all delays keyed by
+    affectedvarindex. Values of pairs that are not included are stored as
+    NaN.
+
+    """
+
+    attrs = store.root._v_attrs
+    vardims = len(attrs.variables)
+    delaydims = len(attrs.delays)
+
+    tensor = get_tensor(
+        store,
+        typename,
+        tb.Float64Atom(dflt=np.nan),
+        (attrs.boxnum, vardims, vardims, delaydims),
+        (1, 1, vardims, delaydims),
+    )
+
+    values = np.full((vardims, delaydims), np.nan)
+    for affectedvarindex, column in columns.items():
+        values[affectedvarindex] = column
+
+    tensor[boxindex, causevarindex] = values
+
+
+def to_field(item):
+    """Represents a report field the same way as the CSV writer."""
+
+    if item is None:
+        field = ""
+    else:
+        field = str(item)
+
+    if len(field) > AUX_ITEMSIZE:
+        raise ValueError("Report field too long to store: " + field)
+
+    return field
+
+
+def write_auxdata(store, auxname, header, boxindex, causevarindex, rows):
+    """Writes the auxiliary data of the pairs of a causevar in a box.
+
+    rows is a dictionary of report rows keyed by affectedvarindex, with the
+    fields as named in header. The causevar and affectedvar names in the
+    first two fields are not stored, as they follow from the indexes.
+
+    """
+
+    attrs = store.root._v_attrs
+    vardims = len(attrs.variables)
+    fields = list(header[2:])
+
+    tensor = get_tensor(
+        store,
+        auxname,
+        tb.StringAtom(itemsize=AUX_ITEMSIZE),
+        (attrs.boxnum, vardims, vardims, len(fields)),
+        (1, 1, vardims, len(fields)),
+    )
+    tensor.attrs.header = fields
+
+    values = np.zeros((vardims, len(fields)), dtype="S" + str(AUX_ITEMSIZE))
+    for affectedvarindex, row in rows.items():
+        values[affectedvarindex] = [to_field(item) for item in row[2:]]
+
+    tensor[boxindex, causevarindex] = values
+
+    add_boxindex(store, boxindex)
+
+
+def read_tested(store, typename, boxindex, causevarindex):
+    """Returns a boolean vector indicating which affectedvars of a causevar
+    in a box have results of typename in the store.
+
+    """
+
+    values = store.get_node("/", AUX_TYPES[typename])[boxindex, causevarindex]
+
+    return np.any(values != b"", axis=1)
+
+
+def read_auxrows(store, auxname, boxindex, causevarindex):
+    """Returns the header and report rows of the auxiliary data of a causevar
+    in a box, in the format written by the weight calculators.
+
+    """
+
+    variables = get_variables(store)
+    tensor = store.get_node("/", auxname)
+    header = ["causevar", "affectedvar"] + list(tensor.attrs.header)
+
+    values = tensor[boxindex, causevarindex]
+    tested = np.any(values != b"", axis=1)
+
+    rows = [
+        [variables[causevarindex], variables[affectedvarindex]]
+        + [field.decode() for field in values[affectedvarindex]]
+        for affectedvarindex in np.flatnonzero(tested)
+    ]
+
+    return header, rows
+
+
+def read_auxfields(store, auxname, boxindex):
+    """Returns the names and values of the report fields of the auxiliary
+    data of all pairs in a box.
+
+    The values are indexed by causevar, affectedvar and field. The fields of
+    pairs without results are empty.
+
+    """
+
+    tensor = store.get_node("/", auxname)
+
+    return list(tensor.attrs.header), tensor[boxindex]
+
+
+def read_weights(store, typename, boxindex, causevarindex):
+    """Returns the values of a causevar in a box over all delays, in the
+    same format as read from the weight data CSV files.
+
+    The first column of the value matrix contains the delays, followed by a
+    column for every variable. Columns of pairs without results contain NaN.
+
+    """
+
+    variables = get_variables(store)
+    delays = np.asarray(store.root._v_attrs.delays)[:, np.newaxis]
+
+    values = store.get_node("/", typename)[boxindex, causevarindex]
+    valuematrix = np.concatenate((delays, values.T), axis=1)
+
+    return valuematrix, ["Delay"] + variables
+
+
+def write_array(store, arrayname, boxindex, matrix):
+    """Writes an array of the values between all affectedvars (rows) and
+    causevars (columns) of a box.
+
+    """
+
+    attrs = store.root._v_attrs
+    vardims = len(attrs.variables)
+
+    tensor = get_tensor(
+        store,
+        arrayname,
+        tb.Float64Atom(dflt=np.nan),
+        (attrs.boxnum, vardims, vardims),
+        (1, vardims, vardims),
+        where="/arrays",
+    )
+
+    tensor[boxindex] = matrix
+
+    add_boxindex(store, boxindex)
+
+
+def has_array(store, arrayname):
+    return "/arrays/" + arrayname in store
+
+
+def read_array(store, arrayname, boxindex):
+    """Returns the array of a box, with affectedvars in rows and causevars in
+    columns.
+
+    """
+
+    return store.get_node("/arrays", arrayname)[boxindex]
+
+
+def read_arrays(store, arrayname, boxindexes):
+    """Returns the arrays of the boxes in boxindexes stacked in a single
+    (box, affectedvar, causevar) array.
+
+    """
+
+    tensor = store.get_node("/arrays", arrayname)
+    if not boxindexes:
+        return np.empty((0,) + tensor.shape[1:])
+
+    # Read the range spanning the boxes at once and select them in memory
+    boxindexes = np.asarray(boxindexes)
+    first = boxindexes[0]
+    return tensor[first : boxindexes[-1] + 1][boxindexes - first]
+
+
+def writecsv(filename, items, header):
+    with open(filename, "w", newline="") as f:
+        csv.writer(f).writerow(header)
+        csv.writer(f).writerows(items)
+
+
+def export_csv(datadir):
+    """Writes the weight and auxiliary data in the result store of datadir
+    to CSV files, with a file for each data type, box and causevar.
+
+    Each file contains a column for every affectedvar with results.
+
+    """
+
+    def filename(typename, boxindex, causevar):
+        filedir = config_setup.ensure_existence(
+            os.path.join(datadir, typename, "box{:03d}".format(boxindex + 1)),
+            make=True,
+        )
+
+        return os.path.join(filedir, "{}.csv".format(causevar))
+
+    with read_store(datadir) as store:
+        variables = get_variables(store)
+        names = [
+            name for name in WEIGHT_TYPES + AUX_NAMES if name in store.root
+        ]
+
+        for boxindex in get_boxindexes(store):
+            for causevarindex, causevar in enumerate(variables):
+                for name in names:
+                    if name in AUX_NAMES:
+                        header, rows = read_auxrows(
+                            store, name, boxindex, causevarindex
+                        )
+                        if rows:
+                            writecsv(
+                                filename(name, boxindex, causevar),
+                                rows,
+                                header,
+                            )
+                        continue
+
+                    tested = read_tested(store, name, boxindex, causevarindex)
+                    if not np.any(tested):
+                        continue
+
+                    valuematrix, header = read_weights(
+                        store, name, boxindex, causevarindex
+                    )
+                    columns = np.concatenate(([True], tested))
+                    writecsv(
+                        filename(name, boxindex, causevar),
+                        valuematrix[:, columns],
+                        [
+                            item
+                            for item, selected in zip(header, columns)
+                            if selected
+                        ],
+                    )
+
+    return None
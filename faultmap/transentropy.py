@@ -6,6 +6,18 @@
 import jpype
 import numpy as np
 
+# Initialised JIDT calculators of this process, keyed by measure, estimator
+# and parameter set
+_calculator_pool = {}
+
+# Java arrays of this process that observations are transferred through,
+# keyed by length and argument slot
+_observation_buffers = {}
+
+# Number of arrays and bytes transferred to Java by this process, as well as
+# the bytes that first had to be copied into contiguous float64 arrays
+marshalling_stats = {"arrays": 0, "bytes": 0, "copied_bytes": 0}
+
 
 def check_jvm(infodynamicsloc):
     if not jpype.isJVMStarted():
@@ -19,6 +31,41 @@ def check_jvm(infodynamicsloc):
         )
 
 
+def to_java_array(data, slot=0):
+    """Transfers a one-dimensional array of observations to a Java double
+    array.
+
+    Java arrays are allocated once per length and slot and reused for all
+    later observations of this process, with arguments of the same call
+    using different slots. Contiguous float64 data is transferred into them
+    directly from its buffer, while other data (such as column slices of
+    row-major arrays) is first copied into a contiguous array.
+
+    The JVM must be running.
+
+    """
+
+    data = np.asarray(data)
+    array = np.ascontiguousarray(data.ravel(), dtype=np.float64)
+    if not np.shares_memory(array, data):
+        marshalling_stats["copied_bytes"] += array.nbytes
+
+    key = (len(array), slot)
+    try:
+        buffer = _observation_buffers[key]
+    except KeyError:
+        buffer = jpype.JArray(jpype.JDouble)(len(array))
+        _observation_buffers[key] = buffer
+
+    # Slice assignment performs a bulk transfer from the buffer
+    buffer[:] = array
+
+    marshalling_stats["arrays"] += 1
+    marshalling_stats["bytes"] += array.nbytes
+
+    return buffer
+
+
 def setup_infodynamics_te(infodynamicsloc, calcmethod, **parameters):
     """Prepares the teCalc class of the Java Infodyamics Toolkit (JIDT)
     in order to calculate transfer entropy according to the kernel or Kraskov
@@ -158,6 +205,49 @@ def setup_infodynamics_te(infodynamicsloc, calcmethod, **parameters):
     return teCalc
 
 
+def get_pooled_calculator(measure, infodynamicsloc, calcmethod, **parameters):
+    """Returns an initialised JIDT calculator for the measure ("te" or "mi"),
+    estimator and parameters from the calculator pool of this process, along
+    with its pool entry.
+
+    Calculators are only constructed on first use. Afterwards they are
+    reinitialised, which clears previous observations while retaining the
+    properties that were set.
+
+    The entry stores the embedding properties of transfer entropy
+    calculators, as these only change with every estimate when
+    auto-embedding.
+
+    """
+
+    key = (measure, calcmethod, repr(sorted(parameters.items())))
+
+    try:
+        entry = _calculator_pool[key]
+    except KeyError:
+        if measure == "te":
+            calc = setup_infodynamics_te(
+                infodynamicsloc, calcmethod, **parameters
+            )
+        else:
+            calc = setup_infodynamics_mi(
+                infodynamicsloc, calcmethod, **parameters
+            )
+        entry = {"calculator": calc, "properties": None}
+        _calculator_pool[key] = entry
+        return calc, entry
+
+    calc = entry["calculator"]
+    if measure == "te" and calcmethod == "kernel":
+        calc.initialise(
+            parameters.get("k", 1), parameters.get("kernel_width", 0.25)
+        )
+    else:
+        calc.initialise()
+
+    return calc, entry
+
+
 def calc_infodynamics_te(
     infodynamicsloc, calcmethod, affected_data, causal_data, **parameters
 ):
@@ -171,17 +261,25 @@ def calc_infodynamics_te(
     used to generate an autoregressive dataset, or will otherwise indicate the
     dead time between data indicating a causal relationship.
 
+    The mutual information between the two sets of data is returned as well.
+
     """
 
-    teCalc = setup_infodynamics_te(infodynamicsloc, calcmethod, **parameters)
-    miCalc = setup_infodynamics_mi(infodynamicsloc, calcmethod, **parameters)
+    transentropy, te_significance, properties = calc_infodynamics_transent(
+        infodynamicsloc, calcmethod, affected_data, causal_data, **parameters
+    )
 
-    test_significance = parameters.get("test_signifiance", False)
-    significance_permutations = parameters.get("significance_permutations", 30)
+    mutualinfo, mi_significance = calc_infodynamics_mi(
+        infodynamicsloc, calcmethod, affected_data, causal_data, **parameters
+    )
+
+    return (
+        transentropy,
+        [[te_significance, mi_significance], properties, mutualinfo],
+    )
 
-    #    sourceArray = causal_data.tolist()
-    #    destArray = affected_data.tolist()
 
+def check_lengths(causal_data, affected_data):
     if len(causal_data) != len(affected_data):
         print("Source length: " + str(len(causal_data)))
         print("Destination length: " + str(len(affected_data)))
@@ -189,64 +287,120 @@ def calc_infodynamics_te(
             "The source and destination arrays are of different lengths"
         )
 
-    # sourceArrayJava = jpype.JArray(jpype.JDouble, 1)(sourceArray)
-    # destArrayJava = jpype.JArray(jpype.JDouble, 1)(destArray)
 
-    #    sourceArrayJava = np.asarray(sourceArray)
-    #    destArrayJava = np.asarray(destArray)
+def calc_infodynamics_transent(
+    infodynamicsloc, calcmethod, affected_data, causal_data, **parameters
+):
+    """Calculates only the transfer entropy from the causal data to the
+    affected data.
+
+    Returns the transfer entropy, its significance (if tested) and the list
+    of embedding properties used by the calculator.
+
+    """
+
+    teCalc, pool_entry = get_pooled_calculator(
+        "te", infodynamicsloc, calcmethod, **parameters
+    )
+
+    test_significance = parameters.get("test_signifiance", False)
+    significance_permutations = parameters.get("significance_permutations", 30)
+
+    check_lengths(causal_data, affected_data)
 
     if calcmethod == "discrete":
         source = map(int, causal_data)
         dest = map(int, affected_data)
         teCalc.addObservations(source, dest)
-        miCalc.addObservations(source, dest)
     else:
-        teCalc.setObservations(causal_data, affected_data)
-        miCalc.setObservations(causal_data, affected_data)
+        teCalc.setObservations(
+            to_java_array(causal_data, 0), to_java_array(affected_data, 1)
+        )
 
     transentropy = teCalc.computeAverageLocalOfObservations()
-    mutualinfo = miCalc.computeAverageLocalOfObservations()
 
     # Convert nats to bits if necessary
     if calcmethod == "kraskov":
         transentropy = transentropy / np.log(2.0)
-        mutualinfo = mutualinfo / np.log(2.0)
     elif (calcmethod == "kernel") or (calcmethod == "discrete"):
         transentropy = transentropy
-        mutualinfo = mutualinfo
     else:
         raise NameError("Infodynamics method name not recognized")
 
     if test_significance:
         te_significance = teCalc.computeSignificance(significance_permutations)
-        mi_significance = miCalc.computeSignificance(significance_permutations)
     else:
         te_significance = None
-        mi_significance = None
 
     # Get all important properties from used teCalc
-    if calcmethod != "discrete":
+    # These are only read again if changed by auto-embedding
+    if calcmethod == "discrete":
+        properties = [None]
+    elif (pool_entry["properties"] is not None) and (
+        parameters.get("auto_embed", False) is not True
+    ):
+        properties = pool_entry["properties"]
+    else:
         k_history = teCalc.getProperty("k_HISTORY")
         k_tau = teCalc.getProperty("k_TAU")
         l_history = teCalc.getProperty("l_HISTORY")
         l_tau = teCalc.getProperty("l_TAU")
         delay = teCalc.getProperty("DELAY")
 
-        properties = [
-            k_history,
-            k_tau,
-            l_history,
-            l_tau,
-            delay,
-        ]  # Mutual info included as a property
-    else:
-        properties = [None]
+        properties = [k_history, k_tau, l_history, l_tau, delay]
+        pool_entry["properties"] = properties
 
-    return (
-        transentropy,
-        [[te_significance, mi_significance], properties, mutualinfo],
+    return transentropy, te_significance, properties
+
+
+def calc_infodynamics_mi(
+    infodynamicsloc, calcmethod, affected_data, causal_data, **parameters
+):
+    """Calculates only the mutual information between the causal data and the
+    affected data.
+
+    Unless a time difference is specified by the delay parameter, the result
+    is symmetric in the two sets of data.
+
+    Returns the mutual information and its significance (if tested).
+
+    """
+
+    miCalc, _ = get_pooled_calculator(
+        "mi", infodynamicsloc, calcmethod, **parameters
     )
 
+    test_significance = parameters.get("test_signifiance", False)
+    significance_permutations = parameters.get("significance_permutations", 30)
+
+    check_lengths(causal_data, affected_data)
+
+    if calcmethod == "discrete":
+        source = map(int, causal_data)
+        dest = map(int, affected_data)
+        miCalc.addObservations(source, dest)
+    else:
+        miCalc.setObservations(
+            to_java_array(causal_data, 0), to_java_array(affected_data, 1)
+        )
+
+    mutualinfo = miCalc.computeAverageLocalOfObservations()
+
+    # Convert nats to bits if necessary
+    if calcmethod == "kraskov":
+        mutualinfo = mutualinfo / np.log(2.0)
+    elif (calcmethod == "kernel") or (calcmethod == "discrete"):
+        mutualinfo = mutualinfo
+    else:
+        raise NameError("Infodynamics method name not recognized")
+
+    if test_significance:
+        mi_significance = miCalc.computeSignificance(significance_permutations)
+    else:
+        mi_significance = None
+
+    return mutualinfo, mi_significance
+
 
 def setup_infodynamics_mi(infodynamicsloc, calcmethod, **parameters):
     """Prepares the miCalc class of the Java Infodyamics Toolkit (JIDT)
@@ -431,9 +585,7 @@ def calc_infodynamics_entropy(entropyCalc, data, estimator):
         Nats can be converted to bits by division with ln(2).
     """
 
-    dataArray = data.tolist()
-    dataArrayJava = jpype.JArray(jpype.JDouble, 1)(dataArray)
-    entropyCalc.setObservations(dataArrayJava)
+    entropyCalc.setObservations(to_java_array(data))
     entropy = entropyCalc.computeAverageLocalOfObservations()
     if estimator == "gaussian":
         # Convert nats to bits
@@ -43,7 +43,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 from plotting import plotter
-from faultmap import data_processing
+from faultmap import data_processing, resultstore
 from faultmap.gaincalc import WeightcalcData
 
 # from plotter import get_scenario_data_vectors
@@ -248,33 +248,24 @@ def fig_values_vs_delays(graphdata, graph, scenario, savedir):
                 r"Delay ({})".format(graphdata.timeunit), fontsize=14
             )
 
-            # Open data file and plot graph
-            sourcefile = os.path.join(
-                weightdir,
-                typename,
-                "box{:03d}".format(boxindex),
-                "{}.csv".format(sourcevar),
-            )
-
-            valuematrix, headers = data_processing.read_header_values_datafile(
-                sourcefile
-            )
-
-            if graphdata.thresholdplotting:
-                threshold_sourcefile = os.path.join(
-                    weightdir,
-                    thresh_typenames[typeindex],
-                    "box{:03d}".format(boxindex),
-                    "{}.csv".format(sourcevar),
+            # Read data from result store and plot graph
+            with resultstore.read_store(weightdir) as store:
+                sourcevarindex = resultstore.get_variables(store).index(
+                    sourcevar
                 )
 
-                (
-                    threshmatrix,
-                    headers,
-                ) = data_processing.read_header_values_datafile(
-                    threshold_sourcefile
+                valuematrix, headers = resultstore.read_weights(
+                    store, typename, boxindex - 1, sourcevarindex
                 )
 
+                if graphdata.thresholdplotting:
+                    threshmatrix, headers = resultstore.read_weights(
+                        store,
+                        thresh_typenames[typeindex],
+                        boxindex - 1,
+                        sourcevarindex,
+                    )
+
             bbox_props = dict(boxstyle="round", fc="w", ec="0.5", alpha=0.8)
 
             for destvarindex, destvar in enumerate(graphdata.destvars):
@@ -425,21 +416,9 @@ def fig_diffscen_vs_delay(graphdata, graph, scenario, savedir):
                 r"Delay ({})".format(graphdata.timeunit), fontsize=14
             )
 
-            # Open data file and plot graph
-            sourcefile = os.path.join(
-                weightdir,
-                typename,
-                "box{:03d}".format(boxindex),
-                "{}.csv".format(sourcevar),
-            )
-
-            _, headers = data_processing.read_header_values_datafile(
-                sourcefile
-            )
-
             # Get valuematrices
-            valuematrices = plotter.get_scenario_data_vectors(
-                graphdata, sourcefile, scenario
+            valuematrices, headers = plotter.get_scenario_data_vectors(
+                graphdata, weightdir, typename, boxindex, sourcevar, scenario
             )
 
             bbox_props = dict(boxstyle="round", fc="w", ec="0.5", alpha=0.8)
@@ -7,7 +7,7 @@ import json
 import os
 
 from plotting import figtypes
-from faultmap import data_processing, config_setup
+from faultmap import data_processing, config_setup, resultstore
 
 
 def raw_string(s):
@@ -113,10 +113,21 @@ class GraphData(object):
         self.typenames = self.caseconfig[graph]["types"]
 
 
-def get_scenario_data_vectors(graphdata, example_sourcefile, example_scenario):
-    """Extract value matrices from different scenarios."""
+def get_scenario_data_vectors(
+    graphdata,
+    example_weightdir,
+    typename,
+    boxindex,
+    sourcevar,
+    example_scenario,
+):
+    """Extract value matrices from different scenarios.
 
-    # example_sourcefile is based on the scenario with which the graph was called
+    Returns the value matrices along with their column headers.
+
+    """
+
+    # example_weightdir is based on the scenario with which the graph was called
     # This graph will be plotted multiple times for all scenarios involved
     # TODO: Find a more elegant solution
 
@@ -124,17 +135,21 @@ def get_scenario_data_vectors(graphdata, example_sourcefile, example_scenario):
 
     for scenario in graphdata.scenarios:
 
-        # Change sourcefile path on scenario level
+        # Change result store location on scenario level
 
-        sourcefile = data_processing.change_dirtype(
-            example_sourcefile, example_scenario, scenario
-        )
-        valuematrix, _ = data_processing.read_header_values_datafile(
-            sourcefile
+        weightdir = data_processing.change_dirtype(
+            example_weightdir, example_scenario, scenario
         )
+        with resultstore.read_store(weightdir) as store:
+            valuematrix, headers = resultstore.read_weights(
+                store,
+                typename,
+                boxindex - 1,
+                resultstore.get_variables(store).index(sourcevar),
+            )
         valuematrices.append(valuematrix)
 
-    return valuematrices
+    return valuematrices, headers
 
 
 def get_box_data_vectors(graphdata):
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""Exports the weight and auxiliary data in the result stores generated by
+run_weightcalc process to CSV files.
+
+"""
+import json
+import logging
+import os
+
+from faultmap import config_setup
+from faultmap.data_processing import csv_export
+
+logging.basicConfig(level=logging.INFO)
+
+dataloc, configloc, saveloc, _ = config_setup.get_locations()
+csvexport_config = json.load(
+    open(os.path.join(configloc, "config_csvexport.json"))
+)
+
+mode = csvexport_config["mode"]
+cases = csvexport_config["cases"]
+
+for case in cases:
+    csv_export(mode, case)
@@ -9,7 +9,7 @@ import logging
 import multiprocessing
 import os
 
-from faultmap import config_setup
+from faultmap import config_setup, resultstore
 from faultmap.gaincalc import weightcalc
 from faultmap.data_processing import result_reconstruction
 from faultmap.data_processing import trend_extraction
@@ -22,7 +22,7 @@ from plotting.plotter import plotdraw
 # TODO: Perform analysis on scenario level inside class object
 
 
-def run_weightcalc(configloc, writeoutput, mode, case, robust):
+def run_weightcalc(configloc, writeoutput, mode, case, robust, stores=None):
     with open(os.path.join(configloc, "config_weightcalc.json")) as f:
         weightcalc_config = json.load(f)
     f.close()
@@ -43,6 +43,7 @@ def run_weightcalc(configloc, writeoutput, mode, case, robust):
                 single_entropies,
                 fftcalc,
                 do_multiprocessing,
+                stores=stores,
             )
         except:
             raise RuntimeError("Weight calculation failed for case: " + case)
@@ -54,64 +55,62 @@ def run_weightcalc(configloc, writeoutput, mode, case, robust):
             single_entropies,
             fftcalc,
             do_multiprocessing,
+            stores=stores,
         )
 
     return None
 
 
-def run_createarrays(writeoutput, mode, case, robust):
+def run_createarrays(writeoutput, mode, case, robust, stores=None):
 
     if robust:
         try:
-            # Needs to execute twice for nosigtest cases if derived from
-            # sigtest cases
-            # TODO: Remove this requirement
-            result_reconstruction(mode, case, writeoutput)
-            result_reconstruction(mode, case, writeoutput)
+            result_reconstruction(mode, case, writeoutput, stores)
         except:
             raise RuntimeError("Array creation failed for case: " + case)
     else:
-        result_reconstruction(mode, case, writeoutput)
-        result_reconstruction(mode, case, writeoutput)
+        result_reconstruction(mode, case, writeoutput, stores)
 
     return None
 
 
-def run_trendextraction(writeoutput, mode, case, robust):
+def run_trendextraction(writeoutput, mode, case, robust, stores=None):
 
     if robust:
         try:
-            trend_extraction(mode, case, writeoutput)
+            trend_extraction(mode, case, writeoutput, stores)
         except:
             raise RuntimeError("Trend extraction failed for case: " + case)
     else:
-        trend_extraction(mode, case, writeoutput)
+        trend_extraction(mode, case, writeoutput, stores)
 
     return None
 
 
-def run_noderank(writeoutput, mode, case, robust):
+def run_noderank(writeoutput, mode, case, robust, stores=None):
 
     if robust:
         try:
-            noderankcalc(mode, case, writeoutput)
+            graphs = noderankcalc(mode, case, writeoutput, stores=stores)
         except:
             raise RuntimeError("Node faultmap failed for case: " + case)
     else:
-        noderankcalc(mode, case, writeoutput)
+        graphs = noderankcalc(mode, case, writeoutput, stores=stores)
 
-    return None
+    return graphs
 
 
-def run_graphreduce(writeoutput, mode, case, robust):
+def run_graphreduce(writeoutput, mode, case, robust, graphs=None):
 
     if robust:
         try:
-            reducegraph(mode, case, writeoutput)
+            reduced_graphs = reducegraph(mode, case, writeoutput, graphs)
         except:
             raise RuntimeError("Graph reduction failed for case: " + case)
     else:
-        reducegraph(mode, case, writeoutput)
+        reduced_graphs = reducegraph(mode, case, writeoutput, graphs)
+
+    return reduced_graphs
 
 
 def run_plotting(writeoutput, mode, case, robust):
@@ -135,18 +134,35 @@ def run_all(mode, robust=False):
 
     # Flag indicating whether calculated results should be written to disk
     writeoutput = fullrun_config["writeoutput"]
+    # Flag indicating whether results are handed over in memory from one
+    # analysis step to the next instead of being read back from disk
+    if "handover" in fullrun_config:
+        handover = fullrun_config["handover"]
+    else:
+        handover = True
     # Provide the mode and case names to calculate
     mode = fullrun_config["mode"]
     cases = fullrun_config["cases"]
 
     for case in cases:
         logging.info("Now attempting case: " + case)
-        run_weightcalc(configloc, writeoutput, mode, case, robust)
-        run_createarrays(writeoutput, mode, case, robust)
-        run_trendextraction(writeoutput, mode, case, robust)
-        run_noderank(writeoutput, mode, case, robust)
-        run_graphreduce(writeoutput, mode, case, robust)
-        # run_plotting(writeoutput, mode, case, robust)
+        if handover:
+            # The result stores are only written to disk once closed
+            stores = resultstore.InMemoryStores(writeoutput)
+        else:
+            stores = None
+        try:
+            run_weightcalc(configloc, writeoutput, mode, case, robust, stores)
+            run_createarrays(writeoutput, mode, case, robust, stores)
+            run_trendextraction(writeoutput, mode, case, robust, stores)
+            graphs = run_noderank(writeoutput, mode, case, robust, stores)
+            if not handover:
+                graphs = None
+            run_graphreduce(writeoutput, mode, case, robust, graphs)
+            # run_plotting(writeoutput, mode, case, robust)
+        finally:
+            if stores is not None:
+                stores.close()
         logging.info("Done with case: " + case)
 
 
@@ -115,6 +115,29 @@ class TestAutoregressiveTransferEntropy(unittest.TestCase):
         delayedval = self.entropies_infodyn_kraskov[self.delay]
         self.assertEqual(maxval, delayedval)
 
+    def test_pooled_calculator_reuse(self):
+        # Reused calculators should not retain observations of earlier
+        # estimates
+        results = []
+        for timelag in [self.delay, self.delay - 2, self.delay]:
+            [_, x_hist, y_hist] = autoreg_datagen(
+                self.delay, timelag, self.samples, self.sub_samples
+            )
+            x_hist_norm = preprocessing.scale(x_hist, axis=1)
+            y_hist_norm = preprocessing.scale(y_hist, axis=1)
+
+            result_infodyn, _ = te_info(
+                "infodynamics.jar",
+                "kraskov",
+                x_hist_norm[0],
+                y_hist_norm[0],
+                auto_embed=False,
+            )
+            results.append(result_infodyn)
+
+        self.assertAlmostEqual(results[0], results[2], delta=0.01)
+        self.assertGreater(results[0], results[1])
+
     def test_peakentropy_infodyn_kraskov_autoembed(self):
         self.entropies_infodyn_kraskov = []
         for timelag in range(self.delay - 5, self.delay + 6):
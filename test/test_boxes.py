@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Verifies that robust boxes are continous and spaced as requested.
+
+"""
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from faultmap import data_processing
+
+
+class TestContinousBoxes(unittest.TestCase):
+    def setUp(self):
+        index = pd.date_range("2020-01-01", periods=100, freq="1s")
+        self.df = pd.DataFrame(
+            np.arange(200.0).reshape(100, 2), index=index, columns=["a", "b"]
+        )
+        # Bad data in a single variable breaks continuity
+        self.df.iloc[40:45, 1] = np.nan
+
+    def test_box_endates(self):
+        end_dates = data_processing.get_box_endates(self.df, 20, 15, "1s")
+
+        end_indexes = [self.df.index.get_loc(date) for date in end_dates]
+        self.assertEqual(end_indexes, [19, 34, 64, 79, 94])
+
+    def test_continous_boxes(self):
+        boxbounds, boxdates = data_processing.get_continous_boxes(
+            self.df, 20, 15, "1s"
+        )
+
+        self.assertEqual(boxbounds[0], (0, 20))
+        self.assertEqual(boxbounds[2], (45, 65))
+        for (start, end), (startdate, enddate) in zip(boxbounds, boxdates):
+            box = self.df.iloc[start:end]
+            self.assertFalse(box.isna().any().any())
+            self.assertEqual(enddate, self.df.index[end - 1].value // 10 ** 9)
+            self.assertEqual(enddate - startdate, 20)
+
+
+class TestSelectedBoxes(unittest.TestCase):
+    def test_compact_boxbounds(self):
+        boxbounds = [(0, 20), (15, 35), (50, 70), (90, 110)]
+        rows = data_processing.get_box_rows(boxbounds, [3, 1, 0])
+        self.assertEqual(rows, [(0, 35), (90, 110)])
+
+        data = np.arange(110)
+        compact = np.concatenate([data[start:end] for start, end in rows])
+        compactbounds = data_processing.compact_boxbounds(boxbounds, rows)
+        self.assertIsNone(compactbounds[2])
+        for boxindex in [0, 1, 3]:
+            start, end = boxbounds[boxindex]
+            compactstart, compactend = compactbounds[boxindex]
+            np.testing.assert_array_equal(
+                compact[compactstart:compactend], data[start:end]
+            )
+
+    def test_analysis_bounds(self):
+        boxbounds = [(0, 100), (60, 160)]
+        data = np.arange(160)
+        delays = [-3, 0, 3, 6]
+        analysisbounds, startindex = data_processing.get_analysis_bounds(
+            boxbounds, 10, 50, delays
+        )
+        self.assertEqual(analysisbounds, [(7, 66), (67, 126)])
+        self.assertEqual(startindex, 3)
+        for (start, end), (windowstart, windowend) in zip(
+            boxbounds, analysisbounds
+        ):
+            box = data[start:end]
+            window = data[windowstart:windowend]
+            for delay in delays:
+                np.testing.assert_array_equal(
+                    window[startindex + delay : startindex + 50 + delay],
+                    box[10 + delay : 60 + delay],
+                )
+
+        # Windows starting before the box keep the complete boxes
+        analysisbounds, startindex = data_processing.get_analysis_bounds(
+            boxbounds, 2, 50, delays
+        )
+        self.assertEqual(analysisbounds, boxbounds)
+        self.assertEqual(startindex, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
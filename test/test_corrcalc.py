@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Verifies that the sliding window correlation of overlapping boxes matches
+the correlation calculated for every box individually, and that significance
+thresholds do not depend on the worker process analysing a pair.
+
+"""
+
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+from pathos.helpers import mp
+
+from faultmap import data_processing
+from faultmap.gaincalc import CorrWeightcalc
+
+
+class TestSlidingCorrelation(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(11)
+        self.data = np.cumsum(rng.normal(size=(1300, 4)), axis=0) + 50.0
+        self.startindex = 10
+        self.size = 300
+        self.sample_delays = [-3, -1, 0, 2, 5]
+
+    def test_matches_individual_boxes(self):
+        for boxnum in [2, 7]:
+            boxbounds = data_processing.split_tsdata_bounds(
+                len(self.data), 1, 400, boxnum
+            )
+            cov_tensors = CorrWeightcalc.calc_sliding_covariances(
+                self.data,
+                [start + self.startindex for start, _ in boxbounds],
+                self.size,
+                self.sample_delays,
+            )
+
+            for boxindex, (start, end) in enumerate(boxbounds):
+                np.testing.assert_allclose(
+                    cov_tensors[boxindex],
+                    CorrWeightcalc.calc_covariance_tensor(
+                        self.data[start:end],
+                        self.startindex,
+                        self.size,
+                        self.sample_delays,
+                    ),
+                    rtol=1e-9,
+                    atol=1e-9,
+                )
+
+    def test_bad_data(self):
+        windowstarts = [100, 500]
+        # Bad data outside the windows is ignored
+        self.data[10, 1] = np.nan
+        cov_tensors = CorrWeightcalc.calc_sliding_covariances(
+            self.data, windowstarts, self.size, self.sample_delays
+        )
+        self.assertFalse(np.isnan(cov_tensors).any())
+
+        # Bad data in a window only affects that window
+        self.data[200, 2] = np.nan
+        cov_tensors = CorrWeightcalc.calc_sliding_covariances(
+            self.data, windowstarts, self.size, self.sample_delays
+        )
+        self.assertTrue(np.isnan(cov_tensors[0]).any())
+
+        for window, windowstart in enumerate(windowstarts):
+            np.testing.assert_allclose(
+                cov_tensors[window],
+                CorrWeightcalc.calc_covariance_tensor(
+                    self.data, windowstart, self.size, self.sample_delays
+                ),
+                rtol=1e-9,
+                atol=1e-9,
+            )
+
+
+class TestSurrogateThresholds(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        self.box = np.cumsum(rng.normal(size=(200, 3)), axis=0)
+        self.pairs = [
+            (causevar, affectedvar)
+            for causevar in ["a", "b", "c"]
+            for affectedvar in ["a", "b", "c"]
+            if causevar != affectedvar
+        ]
+
+    def get_weightcalculator(self, surr_method):
+        weightcalcdata = SimpleNamespace(
+            sigtest=True,
+            thresh_method="rankorder",
+            surr_method=surr_method,
+            sliding_correlation=False,
+            variables=["a", "b", "c"],
+            startindex=5,
+            testsize=150,
+            sample_delays=[-2, -1, 0, 1, 2],
+            actual_delays=[-2.0, -1.0, 0.0, 1.0, 2.0],
+            bidirectional_delays=True,
+        )
+        box = self.box
+        weightcalculator = CorrWeightcalc(weightcalcdata)
+        weightcalculator.prepare_box(weightcalcdata, box, 3)
+
+        def calcsigthresh(pair):
+            return weightcalculator.calcsigthresh(
+                weightcalcdata, pair[0], pair[1], box, None
+            )
+
+        return calcsigthresh
+
+    def test_pool_matches_sequential(self):
+        for surr_method in ["random_shuffle", "iAAFT"]:
+            calcsigthresh = self.get_weightcalculator(surr_method)
+            sequential = [calcsigthresh(pair) for pair in self.pairs]
+
+            # Every pair is analysed by a separate copy of a newly prepared
+            # calculator
+            calcsigthresh = self.get_weightcalculator(surr_method)
+            pool = mp.Pool(processes=2)
+            try:
+                pooled = pool.map(calcsigthresh, self.pairs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+
+            self.assertEqual(pooled, sequential)
+            self.assertNotEqual(sequential[0], sequential[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
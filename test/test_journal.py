@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Verifies that pair results are only resumed from journals recorded for
+the same settings and result store.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from faultmap import gaincalc_oneset
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        self.journal = os.path.join(self.datadir, "box001.jsonl")
+        self.header = {"store": "a", "delays": [0, 1, 2], "testsize": 100}
+        self.result = {"weightlist": [[0.1, 0.2, 0.3]]}
+
+        gaincalc_oneset.start_journal(self.journal, self.header)
+        gaincalc_oneset.append_journal(self.journal, "X 1", "X 2", self.result)
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def test_resume(self):
+        # A partially written record is dropped
+        with open(self.journal, "a") as f:
+            f.write('{"causevar": "X 1"')
+
+        records = gaincalc_oneset.read_journal(self.journal, self.header)
+
+        self.assertEqual(records, {("X 1", "X 2"): self.result})
+        with open(self.journal) as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+    def test_mismatch(self):
+        for key, value in [
+            ("store", "b"),
+            ("delays", [0, 2]),
+            ("testsize", 1),
+        ]:
+            header = dict(self.header, **{key: value})
+
+            # Journals are left alone if no output is written
+            self.assertEqual(
+                gaincalc_oneset.read_journal(self.journal, header, False), {}
+            )
+            self.assertEqual(
+                gaincalc_oneset.read_journal(self.journal, self.header),
+                {("X 1", "X 2"): self.result},
+            )
+
+        # Otherwise a new journal is started
+        header = dict(self.header, store="b")
+        self.assertEqual(
+            gaincalc_oneset.read_journal(self.journal, header), {}
+        )
+        self.assertEqual(
+            gaincalc_oneset.read_journal(self.journal, header), {}
+        )
+        self.assertEqual(
+            gaincalc_oneset.read_journal(self.journal, self.header), {}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Verifies the native Kraskov transfer entropy and mutual information
+estimators against the JIDT implementation and known analytical results.
+
+The native estimators are tested without Java, while the comparisons with
+JIDT are skipped if the JVM cannot be started.
+
+"""
+
+import unittest
+
+import numpy as np
+from sklearn import preprocessing
+
+from faultmap import ksg
+from test.datagen import autoreg_datagen
+
+
+class KraskovTestCase(unittest.TestCase):
+    def setUp(self):
+        # Define number of samples to generate
+        self.samples = 2500
+        # Define number of samples to analyse
+        self.sub_samples = 1000
+        # Delay in actual data
+        self.delay = 5
+
+    def get_timelag_data(self, timelag):
+        [_, x_hist, y_hist] = autoreg_datagen(
+            self.delay, timelag, self.samples, self.sub_samples
+        )
+
+        x_hist_norm = preprocessing.scale(x_hist, axis=1)
+        y_hist_norm = preprocessing.scale(y_hist, axis=1)
+
+        return x_hist_norm[0], y_hist_norm[0]
+
+
+class TestNativeMatchesJidt(KraskovTestCase):
+    def setUp(self):
+        super().setUp()
+
+        try:
+            import jpype
+
+            from faultmap.transentropy import calc_infodynamics_te
+
+            infodynamicsloc = "infodynamics.jar"
+            if not jpype.isJVMStarted():
+                jpype.startJVM(
+                    jpype.getDefaultJVMPath(),
+                    "-ea",
+                    "-Djava.class.path=" + infodynamicsloc,
+                )
+        except Exception as error:
+            self.skipTest("JVM not available: {}".format(error))
+
+        self.te_info = calc_infodynamics_te
+
+    def test_native_matches_jidt_noautoembed(self):
+        for timelag in range(self.delay - 5, self.delay + 6):
+            affected_data, causal_data = self.get_timelag_data(timelag)
+
+            result_infodyn, [_, properties_infodyn, mi_infodyn] = self.te_info(
+                "infodynamics.jar",
+                "kraskov",
+                affected_data,
+                causal_data,
+                auto_embed=False,
+            )
+
+            result_native, _, properties_native = ksg.calc_native_transent(
+                affected_data, causal_data, auto_embed=False
+            )
+            mi_native, _ = ksg.calc_native_mi(affected_data, causal_data)
+
+            print("JIDT TE result: %.4f bits" % result_infodyn)
+            print("Native TE result: %.4f bits" % result_native)
+
+            # Both estimators add random noise to the data
+            self.assertAlmostEqual(result_infodyn, result_native, delta=0.01)
+            self.assertAlmostEqual(mi_infodyn, mi_native, delta=0.01)
+            self.assertEqual(list(properties_infodyn), properties_native)
+
+    def test_native_matches_jidt_autoembed(self):
+        affected_data, causal_data = self.get_timelag_data(self.delay)
+
+        result_infodyn, [_, properties_infodyn, _] = self.te_info(
+            "infodynamics.jar",
+            "kraskov",
+            affected_data,
+            causal_data,
+            auto_embed=True,
+        )
+
+        result_native, _, properties_native = ksg.calc_native_transent(
+            affected_data, causal_data, auto_embed=True
+        )
+
+        self.assertEqual(list(properties_infodyn), properties_native)
+        self.assertAlmostEqual(result_infodyn, result_native, delta=0.01)
+
+
+class TestNativeKraskov(KraskovTestCase):
+    def test_peakentropy_native(self):
+        entropies_native = []
+        for timelag in range(self.delay - 5, self.delay + 6):
+            affected_data, causal_data = self.get_timelag_data(timelag)
+            result_native, _, _ = ksg.calc_native_transent(
+                affected_data, causal_data
+            )
+            entropies_native.append(result_native)
+
+        maxval = max(entropies_native)
+        delayedval = entropies_native[self.delay]
+        self.assertEqual(maxval, delayedval)
+
+    def test_delay_profile_matches_single_estimates(self):
+        [_, x_hist, y_hist] = autoreg_datagen(
+            self.delay, 0, self.samples, self.sub_samples + 20
+        )
+        causal_data = preprocessing.scale(y_hist[0])
+        affected_data = preprocessing.scale(x_hist[0])
+        sample_delays = list(range(0, 11))
+
+        for auto_embed in [False, True]:
+            parameters = {"auto_embed": auto_embed, "noise_level": 0}
+            profile = ksg.calc_native_delay_profile(
+                causal_data,
+                affected_data,
+                5,
+                self.sub_samples,
+                sample_delays,
+                **parameters
+            )
+
+            for delay, (te_fwd, te_bwd, mi_fwd, mi_bwd) in zip(
+                sample_delays, profile
+            ):
+                causal_window = causal_data[5 : 5 + self.sub_samples]
+                affected_window = affected_data[
+                    5 + delay : 5 + self.sub_samples + delay
+                ]
+                self.assertEqual(
+                    te_fwd,
+                    ksg.calc_native_transent(
+                        affected_window, causal_window, **parameters
+                    ),
+                )
+                self.assertEqual(
+                    te_bwd,
+                    ksg.calc_native_transent(
+                        causal_window, affected_window, **parameters
+                    ),
+                )
+                self.assertEqual(
+                    mi_fwd,
+                    ksg.calc_native_mi(
+                        affected_window, causal_window, **parameters
+                    ),
+                )
+                self.assertEqual(mi_bwd, mi_fwd)
+
+    def test_local_profile_matches_window_estimates(self):
+        [_, x_hist, y_hist] = autoreg_datagen(
+            self.delay, 0, self.samples, self.sub_samples
+        )
+        causal_data = preprocessing.scale(y_hist[0])
+        affected_data = preprocessing.scale(x_hist[0])
+        parameters = {"k_history": 2, "noise_level": 0}
+
+        # A window over the complete records has the same neighbours
+        [[local_estimates]] = ksg.calc_native_local_profile(
+            causal_data,
+            affected_data,
+            [0],
+            self.sub_samples,
+            [0],
+            **parameters
+        )
+        [window_estimates] = ksg.calc_native_delay_profile(
+            causal_data, affected_data, 0, self.sub_samples, [0], **parameters
+        )
+        for local_estimate, window_estimate in zip(
+            local_estimates, window_estimates
+        ):
+            self.assertAlmostEqual(local_estimate[0], window_estimate[0])
+
+        # Window estimates are the averages of the local values
+        sample_delays = [0, self.delay]
+        local_series = np.full((4, 2, self.sub_samples), np.nan)
+        profiles = ksg.calc_native_local_profile(
+            causal_data,
+            affected_data,
+            [10, 200],
+            500,
+            sample_delays,
+            local_series,
+            **parameters
+        )
+        starttime = ksg.get_starttime(2, 1, 1, 1, 1)
+        for delay_index in range(len(sample_delays)):
+            self.assertAlmostEqual(
+                profiles[1][delay_index][0][0],
+                np.mean(
+                    local_series[
+                        0, delay_index, 200 + starttime : 200 + 500 - 1
+                    ]
+                ),
+            )
+
+    def test_gaussian_mutual_information(self):
+        np.random.seed(35)
+        correlation = 0.6
+        causal_data = np.random.randn(2000)
+        affected_data = correlation * causal_data + np.sqrt(
+            1 - correlation ** 2
+        ) * np.random.randn(2000)
+
+        mi_native, _ = ksg.calc_native_mi(affected_data, causal_data)
+        mi_analytic = -0.5 * np.log2(1 - correlation ** 2)
+
+        self.assertAlmostEqual(mi_native, mi_analytic, delta=0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()
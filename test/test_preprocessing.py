@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""Verifies that the fused preprocessing of blocks of variables matches the
+preprocessing steps applied to the complete data set one after the other, and
+that time series data converted to binary files match the CSV files.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from faultmap import data_processing
+
+
+class TestPreprocessing(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.variables = ["V{}".format(index) for index in range(9)]
+        self.inputdata_raw = (
+            np.cumsum(rng.normal(size=(1001, 9)), axis=0) + 50.0
+        )
+
+    def test_matches_stepwise_preprocessing(self):
+        for detrend in [False, "first_differences", "linear_model"]:
+            normalised = data_processing.normalise_inputdata(
+                self.inputdata_raw, self.variables, "standardise", None
+            )
+            bandgapped = data_processing.bandgap_inputdata(
+                normalised, 0.01, 0.3
+            )
+            detrended = data_processing.detrend_inputdata(bandgapped, detrend)
+
+            inputdata, intermediate = data_processing.preprocess_data(
+                self.inputdata_raw,
+                self.variables,
+                "standardise",
+                None,
+                (0.01, 0.3),
+                detrend,
+                3,
+                outputs=["normalised", "detrended"],
+                chunksize=4000,
+            )
+
+            self.assertTrue(inputdata.flags.f_contiguous)
+            np.testing.assert_allclose(inputdata, detrended[0::3], atol=1e-12)
+            np.testing.assert_allclose(
+                intermediate["normalised"], normalised, atol=1e-12
+            )
+            np.testing.assert_allclose(
+                intermediate["detrended"], detrended, atol=1e-12
+            )
+            self.assertNotIn("bandgapped", intermediate)
+
+    def test_selected_rows(self):
+        rows = [(5, 40), (100, 180)]
+        rowindexes = np.r_[5:40, 100:180]
+        for normalise, detrend in [
+            (False, False),
+            ("standardise", "first_differences"),
+        ]:
+            inputdata, _ = data_processing.preprocess_data(
+                self.inputdata_raw,
+                self.variables,
+                normalise,
+                None,
+                None,
+                detrend,
+                2,
+            )
+            selected, _ = data_processing.preprocess_data(
+                self.inputdata_raw,
+                self.variables,
+                normalise,
+                None,
+                None,
+                detrend,
+                2,
+                rows=rows,
+                chunksize=4000,
+            )
+
+            self.assertTrue(selected.flags.f_contiguous)
+            np.testing.assert_array_equal(selected, inputdata[rowindexes])
+
+    def test_skogestad_scale(self):
+        scalingvalues = pd.DataFrame(
+            {
+                "var": self.variables[::-1],
+                "low": np.arange(9.0),
+                "nominal": np.full(9, 50.0),
+                "high": 60.0 + 2 * np.arange(9.0),
+                "vartype": ["D", "S"] * 4 + ["D"],
+            }
+        ).set_index("var")
+
+        scaled = data_processing.skogestad_scale(
+            self.inputdata_raw, self.variables, scalingvalues
+        )
+
+        for index, var in enumerate(self.variables):
+            limits = scalingvalues.loc[var]
+            factor = data_processing.skogestad_scale_select(
+                limits["vartype"],
+                limits["low"],
+                limits["nominal"],
+                limits["high"],
+            )
+            np.testing.assert_allclose(
+                scaled[:, index],
+                (self.inputdata_raw[:, index] - limits["nominal"]) / factor,
+            )
+
+
+class TestIngest(unittest.TestCase):
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        self.raw_tsdata = os.path.join(self.datadir, "data.csv")
+        self.write_tsdata(np.arange(30.0).reshape(10, 3))
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def write_tsdata(self, values):
+        df = pd.DataFrame(values, columns=["X 1", "X 2", "X 3"])
+        df.insert(0, "Time", 1600000000 + np.arange(len(values)))
+        df.to_csv(self.raw_tsdata, index=False)
+
+    def test_ingest_tsdata(self):
+        binarydir = os.path.join(self.datadir, "binary")
+        variables, timestamps, inputdata = data_processing.ingest_tsdata(
+            self.raw_tsdata, binarydir, chunkrows=4
+        )
+
+        self.assertEqual(variables, ["X 1", "X 2", "X 3"])
+        np.testing.assert_array_equal(timestamps, 1600000000 + np.arange(10))
+        np.testing.assert_array_equal(
+            inputdata, np.arange(30.0).reshape(10, 3)
+        )
+        self.assertTrue(inputdata.flags.f_contiguous)
+
+        # Changes to the CSV file are converted again
+        self.write_tsdata(-np.arange(36.0).reshape(12, 3))
+        _, timestamps, inputdata = data_processing.ingest_tsdata(
+            self.raw_tsdata, binarydir
+        )
+        self.assertEqual(len(timestamps), 12)
+        np.testing.assert_array_equal(
+            inputdata, -np.arange(36.0).reshape(12, 3)
+        )
+
+    def test_ingest_partitions(self):
+        partitions = []
+        for index, rows in enumerate([slice(0, 4), slice(4, 10)]):
+            partition = os.path.join(self.datadir, "part{}.csv".format(index))
+            df = pd.read_csv(self.raw_tsdata)[rows]
+            df.to_csv(partition, index=False)
+            partitions.append(partition)
+
+        variables, timestamps, inputdata = data_processing.ingest_tsdata(
+            partitions,
+            os.path.join(self.datadir, "partitions"),
+            chunkrows=3,
+            processes=2,
+        )
+
+        self.assertEqual(variables, ["X 1", "X 2", "X 3"])
+        np.testing.assert_array_equal(timestamps, 1600000000 + np.arange(10))
+        np.testing.assert_array_equal(
+            inputdata, np.arange(30.0).reshape(10, 3)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Verifies that weight results written to the result store are read and
+exported in the same format as the CSV files of earlier versions, and that
+stores of interrupted runs can be reopened.
+
+"""
+
+import csv
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+from faultmap import data_processing, resultstore
+
+
+class TestResultStore(unittest.TestCase):
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        self.variables = ["X 1", "X 2", "X 3"]
+        self.delays = [0, 2, 4]
+        self.header = ["causevar", "affectedvar", "base_corr", "max_delay"]
+
+        with resultstore.open_store(
+            self.datadir, self.variables, 2, self.delays
+        ) as store:
+            resultstore.write_weights(
+                store, "weights", 1, 0, {2: [0.1, 0.2, 0.3]}
+            )
+            resultstore.write_auxdata(
+                store,
+                "auxdata",
+                self.header,
+                1,
+                0,
+                {2: ["X 1", "X 3", 0.1, None]},
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def test_read_weights(self):
+        with resultstore.read_store(self.datadir) as store:
+            self.assertEqual(resultstore.get_boxindexes(store), [1])
+            valuematrix, header = resultstore.read_weights(
+                store, "weights", 1, 0
+            )
+            tested = resultstore.read_tested(store, "weights", 1, 0)
+
+        self.assertEqual(header, ["Delay"] + self.variables)
+        np.testing.assert_array_equal(valuematrix[:, 0], self.delays)
+        np.testing.assert_array_equal(valuematrix[:, 3], [0.1, 0.2, 0.3])
+        self.assertTrue(np.all(np.isnan(valuematrix[:, 1:3])))
+        np.testing.assert_array_equal(tested, [False, False, True])
+
+    def test_reopen_store(self):
+        # Matching stores are kept, others are replaced
+        with resultstore.open_store(
+            self.datadir, self.variables, 2, self.delays
+        ) as store:
+            self.assertIn("weights", store.root)
+        with resultstore.open_store(
+            self.datadir, self.variables, 3, self.delays
+        ) as store:
+            self.assertNotIn("weights", store.root)
+
+    def test_inmemory_store(self):
+        datadir = os.path.join(self.datadir, "inmemory")
+        stores = resultstore.InMemoryStores(False)
+        store = resultstore.open_store(
+            datadir, self.variables, 2, self.delays, stores
+        )
+        resultstore.write_array(store, "weight_arrays", 0, np.eye(3))
+        resultstore.close_store(store, stores)
+
+        # The store is handed over open and never written to disk
+        self.assertTrue(resultstore.has_store(datadir, stores))
+        store = resultstore.read_store(datadir, stores=stores)
+        np.testing.assert_array_equal(
+            resultstore.read_array(store, "weight_arrays", 0), np.eye(3)
+        )
+        stores.close()
+        self.assertFalse(resultstore.has_store(datadir))
+
+    def test_read_arrays(self):
+        with resultstore.open_store(
+            self.datadir, self.variables, 4, self.delays
+        ) as store:
+            for boxindex in [0, 2, 3]:
+                resultstore.write_array(
+                    store, "weight_arrays", boxindex, np.eye(3) * boxindex
+                )
+            arrays = resultstore.read_arrays(
+                store, "weight_arrays", resultstore.get_boxindexes(store)
+            )
+
+        self.assertEqual(arrays.shape, (3, 3, 3))
+        np.testing.assert_array_equal(arrays[:, 1, 1], [0, 2, 3])
+
+    def test_process_auxfields(self):
+        header = [
+            "causevar",
+            "affectedvar",
+            "max_ent",
+            "max_delay",
+            "threshold",
+            "threshpass",
+            "directionpass",
+            "bias_mean",
+        ]
+        fields = [
+            ["X 1", "X 2", "0.5", "2", "0.25", "True", "True", "0.1"],
+            ["X 1", "X 3", "0.2", "4", "0.25", "False", "True", "0.1"],
+            ["X 2", "X 3", "-0.1", "0", "", "", "", "0.0"],
+        ]
+        (
+            weights,
+            nosigtest_weights,
+            sigweights,
+            delays,
+            thresholds,
+        ) = data_processing.process_auxfields(header, fields)
+
+        np.testing.assert_allclose(weights, [0.4, 0.0, 0.0])
+        np.testing.assert_allclose(nosigtest_weights, [0.5, 0.2, 0.0])
+        np.testing.assert_allclose(sigweights, [2.0, 0.0, 0.0])
+        np.testing.assert_array_equal(delays, [2, 4, 0])
+        np.testing.assert_array_equal(thresholds, [0.25, 0.25, 0.0])
+
+    def test_export_csv(self):
+        resultstore.export_csv(self.datadir)
+
+        with open(
+            os.path.join(self.datadir, "auxdata", "box002", "X 1.csv")
+        ) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows, [self.header, ["X 1", "X 3", "0.1", ""]])
+
+        with open(
+            os.path.join(self.datadir, "weights", "box002", "X 1.csv")
+        ) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], ["Delay", "X 3"])
+        self.assertEqual(
+            [[float(item) for item in row] for row in rows[1:]],
+            [[0.0, 0.1], [2.0, 0.2], [4.0, 0.3]],
+        )
+
+        self.assertFalse(
+            os.path.exists(os.path.join(self.datadir, "weights", "box001"))
+        )
+
+
+# Writes the weights of two causevars, flushing the store after the first
+# only, and kills the process without closing the store
+INTERRUPTED_RUN = """
+import os
+import sys
+
+from faultmap import resultstore
+
+datadir, inmemory = sys.argv[1], sys.argv[2] == "1"
+stores = resultstore.InMemoryStores(True) if inmemory else None
+store = resultstore.open_store(datadir, ["X 1", "X 2"], 1, [0, 1], stores)
+print(resultstore.get_store_id(store))
+resultstore.write_weights(store, "weights", 0, 0, {1: [0.1, 0.2]})
+store.flush()
+resultstore.write_weights(store, "weights", 0, 1, {0: [0.3, 0.4]})
+sys.stdout.flush()
+os._exit(1)
+"""
+
+
+class TestInterruptedRun(unittest.TestCase):
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def run_interrupted(self, inmemory):
+        process = subprocess.run(
+            [sys.executable, "-c", INTERRUPTED_RUN, self.datadir, inmemory],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+        self.assertEqual(process.returncode, 1)
+        return process.stdout.strip()
+
+    def test_resume_flushed(self):
+        # Stores handed over in memory are written to disk when flushed
+        for inmemory in ["0", "1"]:
+            store_id = self.run_interrupted(inmemory)
+
+            with resultstore.open_store(
+                self.datadir, ["X 1", "X 2"], 1, [0, 1]
+            ) as store:
+                self.assertEqual(resultstore.get_store_id(store), store_id)
+                valuematrix, _ = resultstore.read_weights(
+                    store, "weights", 0, 0
+                )
+            np.testing.assert_array_equal(valuematrix[:, 2], [0.1, 0.2])
+
+            os.remove(resultstore.store_filename(self.datadir))
+
+    def test_replace_unreadable(self):
+        store_id = self.run_interrupted("0")
+
+        # Truncated like a store that was never flushed
+        filename = resultstore.store_filename(self.datadir)
+        with open(filename, "r+b") as f:
+            f.truncate(1024)
+
+        with resultstore.open_store(
+            self.datadir, ["X 1", "X 2"], 1, [0, 1]
+        ) as store:
+            self.assertNotEqual(resultstore.get_store_id(store), store_id)
+            self.assertNotIn("weights", store.root)
+
+
+if __name__ == "__main__":
+    unittest.main()
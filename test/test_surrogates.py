@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Verifies that iAAFT surrogates keep the amplitude distribution and
+approximately the Fourier amplitudes of the original signal, and that
+surrogates generated from a seeded random generator are reproducible.
+
+"""
+
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from faultmap import data_processing
+
+
+class TestSurrogates(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.data = np.cumsum(rng.normal(size=512))
+        self.amplitudes = np.abs(np.fft.rfft(self.data))
+        self.trials = 20
+
+    def spectrum_errors(self, surrogates):
+        return np.sum(
+            np.abs(np.abs(np.fft.rfft(surrogates, axis=1)) - self.amplitudes),
+            axis=1,
+        ) / np.sum(self.amplitudes)
+
+    def test_permutations(self):
+        surrogates = data_processing.gen_iaaft_surrogate_batch(
+            self.data, self.trials, rng=np.random.default_rng(1)
+        )
+
+        for surrogate in surrogates:
+            np.testing.assert_array_equal(
+                np.sort(surrogate), np.sort(self.data)
+            )
+        self.assertFalse(np.array_equal(surrogates[0], surrogates[1]))
+
+    def test_fourier_amplitudes(self):
+        surrogates = data_processing.gen_iaaft_surrogate_batch(
+            self.data, self.trials, rng=np.random.default_rng(1)
+        )
+        shuffled = data_processing.gen_surrogates(
+            self.data,
+            "random_shuffle",
+            self.trials,
+            rng=np.random.default_rng(1),
+        )
+
+        self.assertLess(self.spectrum_errors(surrogates).max(), 0.1)
+        self.assertGreater(self.spectrum_errors(shuffled).min(), 1.0)
+
+    def test_convergence(self):
+        # The Fourier amplitudes of the original signal are calculated once
+        # and those of the surrogates twice per iteration
+        with mock.patch.object(np.fft, "rfft", wraps=np.fft.rfft) as rfft:
+            surrogates = data_processing.gen_iaaft_surrogate_batch(
+                self.data,
+                self.trials,
+                max_iterations=1000,
+                rng=np.random.default_rng(1),
+            )
+        self.assertLess(rfft.call_count, 1 + 2 * 100)
+
+        np.testing.assert_array_equal(
+            surrogates,
+            data_processing.gen_iaaft_surrogate_batch(
+                self.data,
+                self.trials,
+                max_iterations=100,
+                rng=np.random.default_rng(1),
+            ),
+        )
+
+    def test_reproducible(self):
+        for surr_method in ["iAAFT", "random_shuffle"]:
+            surrogates = [
+                data_processing.gen_surrogates(
+                    self.data,
+                    surr_method,
+                    self.trials,
+                    rng=np.random.default_rng(seed),
+                )
+                for seed in [1, 1, 2]
+            ]
+
+            np.testing.assert_array_equal(surrogates[0], surrogates[1])
+            self.assertFalse(np.array_equal(surrogates[0], surrogates[2]))
+
+    def test_shapes(self):
+        for surr_method in ["iAAFT", "random_shuffle"]:
+            for trials in [1, 7]:
+                surrogates = data_processing.gen_surrogates(
+                    self.data[:, np.newaxis],
+                    surr_method,
+                    trials,
+                    rng=np.random.default_rng(1),
+                )
+                self.assertEqual(surrogates.shape, (trials, len(self.data)))
+
+        self.assertEqual(
+            data_processing.gen_iaaft_surrogates(
+                self.data[np.newaxis, :], 5
+            ).shape,
+            (1, len(self.data)),
+        )
+
+        with self.assertRaises(ValueError):
+            data_processing.gen_surrogates(self.data, "unknown", 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
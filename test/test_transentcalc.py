@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Verifies that mutual information estimates are only shared between both
+directions of a pair when this does not change the results, and that only
+estimates without a delay are shared with other pairs.
+
+"""
+
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+from faultmap.gaincalc import TransentWeightcalc
+
+
+def get_weightcalcdata(parameters):
+    return SimpleNamespace(
+        infodynamicsloc="infodynamics.jar",
+        sigtest=False,
+        additional_parameters=parameters,
+        use_gpu=False,
+        kernel_width=None,
+        do_multiprocessing=False,
+        local_estimates=False,
+        startindex=2,
+        sample_delays=[0, 3],
+    )
+
+
+class TestSymmetricMutualInformation(unittest.TestCase):
+    def setUp(self):
+        self.causevardata = np.array([[1.0, 2.0, 3.0]])
+        self.affectedvardata = np.array([[4.0, 5.0, 6.0]])
+
+    def calcweight(self, parameters, delay_index=0):
+        weightcalcdata = get_weightcalcdata(parameters)
+        weightcalculator = TransentWeightcalc(weightcalcdata, "kraskov")
+        calls = []
+
+        # The significance of mutual information depends on the direction,
+        # as only the source is permuted
+        def calc_mi(affecteddata, causaldata):
+            calls.append((affecteddata[0, 0], causaldata[0, 0]))
+            return 0.5, causaldata[0, 0]
+
+        weightcalculator.calc_mi = calc_mi
+        weightcalculator.calc_transent = lambda *_: (0.1, None, [1, 1, 1, 1])
+
+        _, [auxdata_fwd, auxdata_bwd] = weightcalculator.calcweight(
+            self.causevardata,
+            self.affectedvardata,
+            weightcalcdata,
+            0,
+            1,
+            delay_index,
+        )
+        self.estimate_cache = dict(weightcalculator.estimate_cache)
+
+        return calls, auxdata_fwd, auxdata_bwd
+
+    def test_shared_without_significance(self):
+        calls, auxdata_fwd, auxdata_bwd = self.calcweight({})
+
+        self.assertEqual(calls, [(4.0, 1.0)])
+        self.assertEqual(auxdata_fwd[2], auxdata_bwd[2])
+        self.assertEqual(len(self.estimate_cache), 3)
+
+    def test_separate_with_significance(self):
+        calls, auxdata_fwd, auxdata_bwd = self.calcweight(
+            {"test_signifiance": True}
+        )
+
+        self.assertEqual(calls, [(4.0, 1.0), (1.0, 4.0)])
+        self.assertEqual(auxdata_fwd[0][1], 1.0)
+        self.assertEqual(auxdata_bwd[0][1], 4.0)
+
+    def test_delayed_not_shared(self):
+        calls, auxdata_fwd, auxdata_bwd = self.calcweight({}, 1)
+
+        self.assertEqual(calls, [(4.0, 1.0)])
+        self.assertEqual(auxdata_fwd[2], auxdata_bwd[2])
+        self.assertEqual(self.estimate_cache, {})
+
+
+if __name__ == "__main__":
+    unittest.main()